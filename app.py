@@ -1,11 +1,170 @@
-from flask import Flask, render_template, request
-from vector_search import VectorSearch
+import os
+import time
+from flask import Flask, Response, g, render_template, request, jsonify
+from vector_search import MODES, VectorSearch
+from bool_search import BooleanSearchEngine
+from compact_index import COMPACT_INDEX_PATH
+from positional_index import POSITIONAL_INDEX_PATH
+from metrics import Metrics, SlowQueryLog
+from doc_store import DOC_STORE_PATH, DocStore, make_snippet
+from lsa import LSA_INDEX_PATH
+from hot_reload import IndexReloader
+from manifest import MANIFEST_PATH
+from normalizer import NORMALIZER_PATH, Normalizer
 
 app = Flask(__name__)
 
 pages_dir = 'pages'
 index_path = 'inverted_index.txt'
-search_engine = VectorSearch(pages_dir=pages_dir, index_path=index_path)
+# Бинарный индекс (tf_idf.py) открывается через mmap и разделяется между воркерами;
+# необязательные файлы проверяются при каждой загрузке поколения индекса
+compact_path = COMPACT_INDEX_PATH
+positions_path = POSITIONAL_INDEX_PATH
+docs_path = DOC_STORE_PATH
+lsa_path = LSA_INDEX_PATH
+# Как часто (в секундах) проверять, не пересобран ли индекс
+reload_interval = float(os.environ.get('INDEX_RELOAD_INTERVAL', 5))
+cache_size = int(os.environ.get('SEARCH_CACHE_SIZE', 1024))
+cache_ttl = float(os.environ['SEARCH_CACHE_TTL']) if 'SEARCH_CACHE_TTL' in os.environ else None
+ranking = os.environ.get('SEARCH_RANKING', 'cosine')
+# Режим поиска по умолчанию: lexical, semantic или hybrid (последние два — при наличии lsa.bin)
+search_mode = os.environ.get('SEARCH_MODE', 'lexical')
+# Гистограммы этапов поиска для /metrics и лог запросов медленнее SLOW_QUERY_MS
+metrics = Metrics()
+slow_query_log = SlowQueryLog(float(os.environ.get('SLOW_QUERY_MS', 200)), os.environ.get('SLOW_QUERY_LOG'))
+# Ограничения на размер запроса к API
+MAX_TOP_N = 100
+MAX_BATCH = 100
+
+
+
+def _existing(path):
+    return path if os.path.exists(path) else None
+
+
+def _load_generation():
+    """Загружает поколение индекса: (векторный поиск, булев поиск, хранилище документов или None)"""
+    compact = _existing(compact_path)
+    # Таблица открывается заново: после пересборки она могла смениться вместе с индексом
+    normalizer = Normalizer(NORMALIZER_PATH)
+    lsa = _existing(lsa_path)
+    search_engine = VectorSearch(pages_dir=pages_dir, index_path=index_path, compact_path=compact,
+                                 cache_size=cache_size, cache_ttl=cache_ttl, ranking=ranking,
+                                 normalizer=normalizer, lsa_path=lsa,
+                                 mode=search_mode if lsa is not None else 'lexical')
+    search_engine.hooks += [metrics, slow_query_log]
+    boolean_engine = BooleanSearchEngine(index_path, compact_file=compact, cache_size=cache_size,
+                                         cache_ttl=cache_ttl, positions_file=_existing(positions_path),
+                                         normalizer=normalizer)
+    boolean_engine.hooks += [metrics, slow_query_log]
+    docs = _existing(docs_path)
+    return search_engine, boolean_engine, DocStore(docs) if docs is not None else None
+
+
+def _close_generation(generation):
+    """Закрывает mmap-файлы заменённого поколения индекса"""
+    search_engine, boolean_engine, doc_store = generation
+    search_engine.close()
+    boolean_engine.close()
+    if doc_store is not None:
+        doc_store.close()
+    # Таблица нормализации у поколения своя и общая для обоих движков
+    search_engine.normalizer.close()
+
+
+# Индексы загружаются при первом load_engines(): в serve.py — один раз до fork воркеров.
+# После пересборки (новые mtime/размер файлов) поколение загружается в фоне и подменяется
+reloader = IndexReloader(_load_generation, [index_path, compact_path, positions_path, docs_path,
+                                            lsa_path, NORMALIZER_PATH, MANIFEST_PATH],
+                         interval=reload_interval, close=_close_generation)
+
+
+def load_engines():
+    """
+    Поколение индекса запроса: (векторный поиск, булев поиск, хранилище документов)
+
+    Поколение берётся один раз на запрос (reloader.acquire) и отпускается
+    в конце запроса (_release_engines), даже если в это время загрузится
+    новое: заменённое поколение закрывается, когда его отпустит последний
+    запрос.
+    """
+    generation = g.get('engines')
+    if generation is None:
+        reloader.maybe_reload()
+        generation = g.engines = reloader.acquire()
+    return generation
+
+
+@app.teardown_request
+def _release_engines(exc):
+    generation = g.pop('engines', None)
+    if generation is not None:
+        reloader.release(generation)
+
+
+def _params():
+    """Параметры запроса: JSON-тело для POST, строка запроса для GET"""
+    if request.method == 'POST':
+        return request.get_json(silent=True) or {}
+    return request.args
+
+
+def _top_n(params):
+    try:
+        top_n = int(params.get('top_n', 10))
+    except (TypeError, ValueError):
+        return None
+    return top_n if 0 < top_n <= MAX_TOP_N else None
+
+
+def _error(message, status=400):
+    return jsonify({'error': message}), status
+
+
+def _timed_response(payload, start):
+    """Добавляет к ответу серверное время обработки (поле took_ms и заголовок Server-Timing)"""
+    took_ms = (time.perf_counter() - start) * 1000
+    payload['took_ms'] = round(took_ms, 3)
+    response = jsonify(payload)
+    response.headers['Server-Timing'] = f'search;dur={took_ms:.3f}'
+    return response
+
+
+def _vector_results(results, doc_store, lemmas=None):
+    """
+    Результаты для ответа API
+
+    Если есть хранилище документов, добавляются заголовок и URL, а при
+    переданных леммах — сниппет с подсветкой (HTML).
+    """
+    items = []
+    for doc_id, score in results:
+        item = {'doc_id': doc_id, 'score': score}
+        document = doc_store.get(doc_id) if doc_store is not None else None
+        if document is not None:
+            item['title'] = document['title']
+            item['url'] = document['url']
+            if lemmas is not None:
+                item['snippet'] = str(_snippet(document, lemmas))
+        items.append(item)
+    return items
+
+
+def _snippet(document, lemmas):
+    return make_snippet(document['text'], lemmas, document['lemmas'].get, fallback=document['summary'])
+
+
+def _flag(params, name):
+    return str(params.get(name, '')).lower() in ('1', 'true', 'yes')
+
+
+def _mode(params, engine):
+    """Режим поиска из параметра mode или None, если он недоступен для движка"""
+    value = str(params.get('mode') or engine.mode)
+    if value not in MODES or (value != 'lexical' and engine.lsa is None):
+        return None
+    return value
+
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -15,17 +174,114 @@ def index():
     if request.method == 'POST':
         query = request.form['query'].strip()
         if query:
-            search_results = search_engine.search(query, top_n=10)
-            results = [
-                {
+            engine, _, doc_store = load_engines()
+            search_results = engine.search(query, top_n=10)
+            lemmas = engine.query_lemmas(query)
+            for doc_id, score in search_results:
+                result = {
                     "doc_id": doc_id,
                     "score": f"{score:.4f}",
                 }
-                for doc_id, score in search_results
-            ]
+                document = doc_store.get(doc_id) if doc_store is not None else None
+                if document is not None:
+                    result.update(title=document['title'], url=document['url'],
+                                  snippet=_snippet(document, lemmas))
+                results.append(result)
 
     return render_template('index.html', query=query, results=results)
 
 
+@app.route('/search', methods=['GET', 'POST'])
+def search():
+    """
+    Векторный поиск
+
+    Параметры: q — запрос, top_n — число результатов (по умолчанию 10),
+    prune — отсечение MaxScore, snippets — добавить сниппеты с подсветкой,
+    mode — lexical, semantic или hybrid (два последних — при наличии lsa.bin).
+    Ответ: {"query", "count", "results", "took_ms"}.
+    """
+    start = time.perf_counter()
+    params = _params()
+    query = str(params.get('q', '')).strip()
+    top_n = _top_n(params)
+    if not query:
+        return _error('missing query parameter "q"')
+    if top_n is None:
+        return _error(f'top_n must be an integer from 1 to {MAX_TOP_N}')
+    prune = _flag(params, 'prune')
+
+    engine, _, doc_store = load_engines()
+    mode = _mode(params, engine)
+    if mode is None:
+        return _error(f'mode must be one of {", ".join(MODES)} (semantic modes need lsa.bin)')
+    results = engine.search(query, top_n=top_n, prune=prune, mode=mode)
+    lemmas = engine.query_lemmas(query) if _flag(params, 'snippets') else None
+    return _timed_response({'query': query, 'count': len(results),
+                            'results': _vector_results(results, doc_store, lemmas)}, start)
+
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Пакетный векторный поиск
+
+    Тело: {"queries": [...], "top_n": 10, "mode": "lexical"}. Ответ: {"count", "results": [{"query",
+    "count", "results"}, ...], "took_ms"} в порядке запросов.
+    """
+    start = time.perf_counter()
+    params = request.get_json(silent=True) or {}
+    queries = params.get('queries')
+    top_n = _top_n(params)
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return _error('"queries" must be a list of strings')
+    if len(queries) > MAX_BATCH:
+        return _error(f'at most {MAX_BATCH} queries per batch')
+    if top_n is None:
+        return _error(f'top_n must be an integer from 1 to {MAX_TOP_N}')
+
+    engine, _, doc_store = load_engines()
+    mode = _mode(params, engine)
+    if mode is None:
+        return _error(f'mode must be one of {", ".join(MODES)} (semantic modes need lsa.bin)')
+    batch = engine.search_batch(queries, top_n=top_n, mode=mode)
+    results = [{'query': query, 'count': len(results), 'results': _vector_results(results, doc_store)}
+               for query, results in zip(queries, batch)]
+    return _timed_response({'count': len(results), 'results': results}, start)
+
+
+@app.route('/boolean', methods=['GET', 'POST'])
+def boolean():
+    """
+    Булев поиск (AND, OR, NOT, скобки, "фразы", NEAR/k)
+
+    Ответ: {"query", "count", "results": [doc_id, ...], "took_ms"}.
+    """
+    start = time.perf_counter()
+    query = str(_params().get('q', '')).strip()
+    if not query:
+        return _error('missing query parameter "q"')
+    try:
+        results = load_engines()[1].search(query)
+    except (ValueError, IndexError, KeyError) as e:
+        return _error(f'invalid boolean query: {e}')
+    return _timed_response({'query': query, 'count': len(results), 'results': results}, start)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики поиска в текстовом формате Prometheus (включая счётчики кэшей и поколение индекса)"""
+    gauges = {}
+    for engine_name, engine in zip(('vector', 'boolean'), load_engines()[:2]):
+        for cache, stats in engine.cache_stats().items():
+            for stat, value in stats.items():
+                labels = (('engine', engine_name), ('cache', cache))
+                gauges[(f'search_cache_{stat}', labels)] = value
+    gauges[('search_index_generation', ())] = reloader.generation
+    gauges[('search_index_reload_failures', ())] = reloader.failures
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Для разработки; в продакшене — serve.py
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,366 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import string
+import platform
+import resource
+import argparse
+import contextlib
+import multiprocessing
+import numpy as np
+from normalizer import LEMMAS_SEED, NORMALIZER_PATH, TOKENS_SEED, build_normalizer, get_normalizer
+
+BENCH_DIR = 'bench_data'
+REPORT_PATH = 'bench_report.json'
+# Метрики, где больше — хуже (для сравнения с базовым отчётом)
+METRICS = ('seconds', 'peak_rss_mb', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def _word(i):
+    """Детерминированное буквенное слово для номера i (цифры вырезаются токенизатором)"""
+    letters = []
+    i += 26 * 27  # не короче трёх букв
+    while i:
+        i, r = divmod(i, 26)
+        letters.append(string.ascii_lowercase[r])
+    return ''.join(reversed(letters))
+
+
+def generate_corpus(output_dir, n_docs, vocab_size=50000, zipf_s=1.1, mean_length=300, seed=0):
+    """
+    Генерирует синтетический корпус в формате pages/page_N
+
+    Частоты слов распределены по Зипфу с показателем zipf_s, длины
+    документов — логнормально со средним mean_length. У каждой леммы два
+    слова: сама лемма и форма с окончанием "s". Пишутся tokens.txt
+    ("слово число") и lemmas.txt, как после tokenizer.py, и таблица
+    нормализации корпуса (normalizer.bin) для разбора запросов.
+
+    :return: метаданные корпуса (они же сохраняются в corpus.json)
+    """
+    meta = {'n_docs': n_docs, 'vocab_size': vocab_size, 'zipf_s': zipf_s,
+            'mean_length': mean_length, 'seed': seed}
+    meta_path = os.path.join(output_dir, 'corpus.json')
+    normalizer_path = os.path.join(output_dir, NORMALIZER_PATH)
+    if os.path.exists(meta_path) and os.path.exists(normalizer_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == meta:
+                return meta
+        shutil.rmtree(output_dir)
+
+    rng = np.random.default_rng(seed)
+    probabilities = 1.0 / np.arange(1, vocab_size + 1) ** zipf_s
+    probabilities /= probabilities.sum()
+    lemmas = [_word(i // 2) for i in range(vocab_size)]
+    words = [lemma + ('s' if i % 2 else '') for i, lemma in enumerate(lemmas)]
+    sigma = 0.5
+    lengths = rng.lognormal(np.log(mean_length) - sigma ** 2 / 2, sigma, n_docs).astype(int) + 1
+
+    pages_dir = os.path.join(output_dir, 'pages')
+    os.makedirs(pages_dir, exist_ok=True)
+    for doc_id, length in enumerate(lengths):
+        word_ids, counts = np.unique(rng.choice(vocab_size, length, p=probabilities), return_counts=True)
+        doc_words = sorted(zip((words[i] for i in word_ids), word_ids.tolist(), counts.tolist()))
+        forms = {}
+        for word, word_id, _ in doc_words:
+            forms.setdefault(lemmas[word_id], []).append(word)
+
+        page_dir = os.path.join(pages_dir, f'page_{doc_id}')
+        os.makedirs(page_dir, exist_ok=True)
+        with open(os.path.join(page_dir, 'tokens.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(f"{word} {count}\n" for word, _, count in doc_words)
+        with open(os.path.join(page_dir, 'lemmas.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(f"{lemma} {' '.join(forms[lemma])}\n" for lemma in sorted(forms))
+
+    lemmas_path = os.path.join(output_dir, LEMMAS_SEED)
+    tokens_path = os.path.join(output_dir, TOKENS_SEED)
+    with open(lemmas_path, 'w', encoding='utf-8') as f:
+        f.writelines(f"{lemma} {lemma} {lemma}s\n" for lemma in sorted(set(lemmas)))
+    with open(tokens_path, 'w', encoding='utf-8') as f:
+        f.writelines(f"{word}\n" for word in sorted(words))
+    build_normalizer([lemmas_path], [tokens_path], output_path=normalizer_path, base_files=(),
+                     proper_nouns_files=())
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return meta
+
+
+def _peak_rss_mb():
+    # ru_maxrss в Linux — в килобайтах, в macOS — в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _isolated_task(queue, target, args):
+    start = time.perf_counter()
+    result = target(*args)
+    queue.put({'seconds': time.perf_counter() - start, 'peak_rss_mb': _peak_rss_mb(), 'result': result})
+
+
+def run_isolated(target, *args):
+    """
+    Выполняет target в отдельном (spawn) процессе
+
+    Так пиковый RSS относится только к этому этапу, а не к процессу
+    бенчмарка целиком.
+
+    :return: {"seconds", "peak_rss_mb", "result"}
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_isolated_task, args=(queue, target, args))
+    process.start()
+    measurement = queue.get()
+    process.join()
+    return measurement
+
+
+def _build_inverted_index(work_dir):
+    import inverted_index
+    inverted_index.build_inverted_index_txt(os.path.join(work_dir, 'pages'),
+                                            os.path.join(work_dir, 'inverted_index.txt'), full=True,
+                                            manifest_path=os.path.join(work_dir, 'manifest.json'),
+                                            duplicates_path=None)
+
+
+def _build_tf_idf(work_dir):
+    import tf_idf
+    tf_idf.calculate_tf_idf(os.path.join(work_dir, 'pages'), full=True,
+                            manifest_path=os.path.join(work_dir, 'manifest.json'),
+                            stats_path=os.path.join(work_dir, 'tf_idf_stats.json'), duplicates_path=None)
+
+
+def _build_compact_index(work_dir):
+    import compact_index
+    compact_index.build_compact_index(os.path.join(work_dir, 'pages'),
+                                      os.path.join(work_dir, 'inverted_index.txt'),
+                                      os.path.join(work_dir, 'index.bin'), duplicates_path=None)
+
+
+def _build_lsa(work_dir):
+    import lsa
+    lsa.build_lsa_index(os.path.join(work_dir, 'index.bin'), os.path.join(work_dir, 'lsa.bin'), refit=True)
+
+
+BUILD_STAGES = {
+    'inverted_index': _build_inverted_index,
+    'tf_idf': _build_tf_idf,
+    'compact_index': _build_compact_index,
+    'lsa': _build_lsa,
+}
+
+
+def make_queries(meta, n_queries, seed=1):
+    """
+    Смешанная нагрузка: запросы из 1–4 слов, слова выбираются по тому же
+    распределению Зипфа, что и в корпусе (частые слова встречаются чаще)
+
+    :return: {"vector": [...], "boolean": [...]}
+    """
+    rng = np.random.default_rng(seed)
+    vocab_size = meta['vocab_size']
+    probabilities = 1.0 / np.arange(1, vocab_size + 1) ** meta['zipf_s']
+    probabilities /= probabilities.sum()
+
+    vector, boolean = [], []
+    for _ in range(n_queries):
+        word_ids = rng.choice(vocab_size, rng.integers(1, 5), p=probabilities)
+        query_words = [_word(i // 2) + ('s' if i % 2 else '') for i in word_ids]
+        vector.append(' '.join(query_words))
+        if len(query_words) == 1:
+            boolean.append(query_words[0])
+        else:
+            operators = rng.choice(['AND', 'OR', 'AND NOT'], len(query_words) - 1, p=[0.5, 0.3, 0.2])
+            parts = [query_words[0]]
+            for operator, word in zip(operators, query_words[1:]):
+                parts += [operator, word]
+            boolean.append(' '.join(parts))
+    return {'vector': vector, 'boolean': boolean}
+
+
+def _percentiles(latencies):
+    latencies = np.sort(np.array(latencies) * 1000)
+    return {
+        'n': int(len(latencies)),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+def _engine_config(name, work_dir):
+    """Фабрика движка по имени конфигурации"""
+    index_path = os.path.join(work_dir, 'inverted_index.txt')
+    compact_path = os.path.join(work_dir, 'index.bin')
+    pages_dir = os.path.join(work_dir, 'pages')
+    normalizer_path = os.path.join(work_dir, NORMALIZER_PATH)
+    if name == 'vector_text':
+        from vector_search import VectorSearch
+        return 'vector', lambda: VectorSearch(pages_dir, index_path, cache_size=0,
+                                              normalizer=get_normalizer(normalizer_path))
+    if name == 'vector_compact':
+        from vector_search import VectorSearch
+        return 'vector', lambda: VectorSearch(pages_dir, index_path, compact_path, cache_size=0,
+                                              normalizer=get_normalizer(normalizer_path))
+    if name == 'bm25_compact':
+        from vector_search import VectorSearch
+        return 'vector', lambda: VectorSearch(pages_dir, index_path, compact_path, cache_size=0, ranking='bm25',
+                                              normalizer=get_normalizer(normalizer_path))
+    if name == 'sparse_compact':
+        from sparse_search import SparseVectorSearch
+        return 'vector', lambda: SparseVectorSearch(pages_dir, index_path, compact_path, cache_size=0,
+                                                    normalizer=get_normalizer(normalizer_path))
+    if name in ('semantic_compact', 'hybrid_compact'):
+        from vector_search import VectorSearch
+        lsa_path = os.path.join(work_dir, 'lsa.bin')
+        mode = name.split('_')[0]
+        return 'vector', lambda: VectorSearch(pages_dir, index_path, compact_path, cache_size=0,
+                                              normalizer=get_normalizer(normalizer_path),
+                                              lsa_path=lsa_path, mode=mode)
+    if name == 'boolean_compact':
+        from bool_search import BooleanSearchEngine
+        return 'boolean', lambda: BooleanSearchEngine(index_path, compact_path, cache_size=0,
+                                                     normalizer=get_normalizer(normalizer_path))
+    raise ValueError(f'Неизвестный движок: {name}')
+
+
+ENGINES = ('vector_text', 'vector_compact', 'bm25_compact', 'sparse_compact', 'semantic_compact',
+           'hybrid_compact', 'boolean_compact')
+
+
+def _bench_engine(name, work_dir, queries, top_n, prune):
+    """Загрузка движка и прогон запросов (выполняется в отдельном процессе)"""
+    workload, factory = _engine_config(name, work_dir)
+    start = time.perf_counter()
+    engine = factory()
+    load_seconds = time.perf_counter() - start
+    load_rss = _peak_rss_mb()
+
+    latencies = []
+    # Сообщения движков ("Не найдено лемм...") в вывод бенчмарка не нужны
+    with contextlib.redirect_stdout(io.StringIO()):
+        for query in queries[workload]:
+            start = time.perf_counter()
+            if workload == 'vector':
+                engine.search(query, top_n, prune)
+            else:
+                engine.search(query)
+            latencies.append(time.perf_counter() - start)
+    return {'load_seconds': load_seconds, 'load_peak_rss_mb': load_rss, 'queries': _percentiles(latencies)}
+
+
+def run_benchmark(sizes, work_root=BENCH_DIR, engines=ENGINES, n_queries=1000, top_n=10, prune=False,
+                  vocab_size=50000, zipf_s=1.1, mean_length=300, seed=0):
+    """
+    Полный прогон: генерация корпусов, сборка индекса, загрузка, запросы
+
+    :return: отчёт {"meta", "sizes": {n_docs: {"build": ..., "engines": ...}}}
+    """
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'n_queries': n_queries, 'top_n': top_n, 'prune': prune,
+            'vocab_size': vocab_size, 'zipf_s': zipf_s, 'mean_length': mean_length, 'seed': seed,
+        },
+        'sizes': {},
+    }
+    for n_docs in sizes:
+        work_dir = os.path.join(work_root, f'docs_{n_docs}')
+        start = time.perf_counter()
+        meta = generate_corpus(work_dir, n_docs, vocab_size, zipf_s, mean_length, seed)
+        print(f"[{n_docs}] corpus ready in {time.perf_counter() - start:.1f}s")
+
+        build = {}
+        for stage, target in BUILD_STAGES.items():
+            measurement = run_isolated(target, work_dir)
+            build[stage] = {'seconds': measurement['seconds'], 'peak_rss_mb': measurement['peak_rss_mb']}
+            print(f"[{n_docs}] build {stage}: {measurement['seconds']:.2f}s, "
+                  f"peak RSS {measurement['peak_rss_mb']:.1f} MB")
+
+        queries = make_queries(meta, n_queries, seed + 1)
+        results = {}
+        for name in engines:
+            measurement = run_isolated(_bench_engine, name, work_dir, queries, top_n, prune)
+            result = measurement['result']
+            results[name] = {
+                'load': {'seconds': result['load_seconds'], 'peak_rss_mb': result['load_peak_rss_mb']},
+                'queries': result['queries'],
+                'peak_rss_mb': measurement['peak_rss_mb'],
+            }
+            print(f"[{n_docs}] {name}: load {result['load_seconds']:.2f}s, "
+                  f"p50 {result['queries']['p50_ms']:.2f} ms, p95 {result['queries']['p95_ms']:.2f} ms, "
+                  f"p99 {result['queries']['p99_ms']:.2f} ms")
+        report['sizes'][str(n_docs)] = {'build': build, 'engines': results}
+    return report
+
+
+def _flatten(report):
+    """{путь метрики: значение} для всех сравнимых метрик отчёта"""
+    flat = {}
+
+    def walk(node, path):
+        for key, value in node.items():
+            if isinstance(value, dict):
+                walk(value, path + (key,))
+            elif key in METRICS:
+                flat['.'.join(path + (key,))] = value
+    walk(report['sizes'], ())
+    return flat
+
+
+def compare_reports(report, baseline, threshold=0.1):
+    """
+    Сравнивает отчёт с базовым
+
+    :param threshold: допустимое относительное ухудшение (0.1 — 10%)
+    :return: список (метрика, базовое значение, новое значение, отношение, регрессия ли)
+    """
+    current, base = _flatten(report), _flatten(baseline)
+    rows = []
+    for path in sorted(set(current) & set(base)):
+        ratio = current[path] / base[path] if base[path] else float('inf')
+        rows.append((path, base[path], current[path], ratio, ratio > 1 + threshold))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк индексации и поиска на синтетическом корпусе')
+    parser.add_argument('--docs', type=int, nargs='+', default=[1000, 10000],
+                        help='размеры корпусов (например, 1000 10000 100000 1000000)')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--prune', action='store_true')
+    parser.add_argument('--vocab-size', type=int, default=50000)
+    parser.add_argument('--zipf-s', type=float, default=1.1)
+    parser.add_argument('--mean-length', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=BENCH_DIR)
+    parser.add_argument('--output', default=REPORT_PATH)
+    parser.add_argument('--baseline', help='отчёт для сравнения; при регрессии код выхода 1')
+    parser.add_argument('--threshold', type=float, default=0.1, help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.docs, args.work_dir, args.engines, args.queries, args.top_n, args.prune,
+                           args.vocab_size, args.zipf_s, args.mean_length, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = 0
+        for path, old, new, ratio, regressed in compare_reports(report, baseline, args.threshold):
+            regressions += regressed
+            mark = 'REGRESSION' if regressed else ''
+            print(f"{path:60s} {old:12.3f} {new:12.3f} {ratio:7.2f}x {mark}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,16 @@
+import math
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def bm25_idf(df, N):
+    return math.log(1 + (N - df + 0.5) / (df + 0.5))
+
+
+def bm25_weight(tf, idf, doc_length, avgdl, k1=BM25_K1, b=BM25_B):
+    """Вклад термина с частотой tf в BM25-скор документа длины doc_length"""
+    if not tf:
+        return 0.0
+    norm = k1 * (1 - b + b * doc_length / avgdl) if avgdl else k1
+    return idf * tf * (k1 + 1) / (tf + norm)
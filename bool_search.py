@@ -1,19 +1,58 @@
+import os
 import re
-import operator
 from collections import defaultdict
-from nltk.stem import WordNetLemmatizer
+from compact_index import CompactIndex
+from postings import to_postings, intersect, union, difference
+from positional_index import (POSITIONAL_INDEX_PATH, PositionalIndex, phrase_positions,
+                              near_positions)
+from manifest import MANIFEST_PATH
+from metrics import QueryTrace, run_hooks
+from normalizer import MIN_TOKEN_LENGTH, get_normalizer
+from query_cache import LRUCache, index_version
+from term_dict import MAX_EXPANSIONS, TermDictionary, is_pattern
 
 
 class BooleanSearchEngine:
-    def __init__(self, index_file='inverted_index.txt'):
+    def __init__(self, index_file='inverted_index.txt', compact_file=None, cache_size=1024,
+                 cache_ttl=None, positions_file=None, normalizer=None):
         self.index = defaultdict(list)
-        self.lemmatizer = WordNetLemmatizer()
+        # Слова запроса приводятся к леммам той же таблицей, что и при индексации
+        self.normalizer = normalizer or get_normalizer()
+        self.index_version = index_version(compact_file or index_file, MANIFEST_PATH, self.normalizer.path)
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        self.lemma_cache = LRUCache(cache_size * 8, cache_ttl)
+        # Хуки получают QueryTrace каждого запроса (metrics.Metrics, metrics.SlowQueryLog)
+        self.hooks = []
         self.operations = {
-            'AND': operator.and_,
-            'OR': operator.or_,
-            'NOT': operator.sub
+            'AND': intersect,
+            'OR': union,
+            'NOT': difference
         }
-        self._load_index(index_file)
+        self.compact_index = None
+        if compact_file is not None:
+            # Постинги декодируются из mmap-индекса по запросу
+            self.compact_index = CompactIndex(compact_file)
+            self.index = self.compact_index.postings_map
+            self._universe = to_postings(self.compact_index.doc_ids.tolist())
+            # Шаблоны и опечатки ищутся по словам индекса и переводятся в их леммы
+            self.term_dict = self.compact_index.word_dictionary()
+            self._word_lemma = self.compact_index.lemma
+        else:
+            self._load_index(index_file)
+            self._universe = to_postings(sorted(set().union(*self.index.values())))
+            # В текстовом индексе есть только леммы: по ним и ищутся расширения
+            self.term_dict = TermDictionary(sorted(self.index))
+            self._word_lemma = str
+        # Позиционный индекс нужен только для фраз и NEAR/k
+        self.positional_index = PositionalIndex(positions_file) if positions_file else None
+
+    def close(self):
+        """Закрывает mmap-файлы индексов; таблицу нормализации закрывает её владелец"""
+        if self.compact_index is not None:
+            self.compact_index.close()
+        if self.positional_index is not None:
+            self.positional_index.close()
+        self.index = self.term_dict = self._word_lemma = None
 
     def _load_index(self, index_file):
         """
@@ -29,23 +68,30 @@ class BooleanSearchEngine:
                     continue
 
                 term, doc_ids = line.split(':', 1)
-                self.index[term] = list(map(int, doc_ids.split(',')))
+                self.index[term] = to_postings(sorted(map(int, doc_ids.split(','))))
+
+    @staticmethod
+    def _precedence(token):
+        """Приоритет оператора или None для слова (NEAR без /k — обычное слово near)"""
+        if token.startswith('NEAR/'):
+            return 4
+        return {'NOT': 3, 'AND': 2, 'OR': 1}.get(token)
 
     def _shunting_yard(self, tokens):
         output = []
         operators = []
-        precedence = {'NOT': 3, 'AND': 2, 'OR': 1}
 
         for token in tokens:
+            precedence = self._precedence(token)
             if token == '(':
                 operators.append(token)
             elif token == ')':
                 while operators and operators[-1] != '(':
                     output.append(operators.pop())
                 operators.pop()
-            elif token in precedence:
+            elif precedence is not None:
                 while (operators and operators[-1] != '(' and
-                       precedence[operators[-1]] >= precedence[token]):
+                       self._precedence(operators[-1]) >= precedence):
                     output.append(operators.pop())
                 operators.append(token)
             else:
@@ -56,58 +102,216 @@ class BooleanSearchEngine:
 
         return output
 
-    def _evaluate_postfix(self, postfix):
+    def _build_plan(self, postfix):
         """
-        Вычисление постфиксного выражения
+        Строит дерево запроса из постфиксной записи
 
-        :param postfix: список токенов в постфиксной нотации
-        :return: список ID документов, удовлетворяющих запросу
+        Узлы: ('TERM', лемма), ('PHRASE', [(смещение, лемма)]), ('NEAR', k, узел, узел),
+        ('NOT', узел), ('AND' | 'OR', [узлы]); вложенные AND/OR одного вида
+        сливаются в один n-арный узел. Шаблон (vaccin*, vacc?ne) и слово не из
+        индекса раскрываются в OR по подходящим леммам (_term_node).
         """
         stack = []
 
         for token in postfix:
-            if token in self.operations:
-                if token == 'NOT':
-                    operand = set(stack.pop())
-                    all_docs = set(range(self._get_total_documents()))
-                    result = all_docs - operand
-                else:
-                    operand2 = set(stack.pop())
-                    operand1 = set(stack.pop())
-                    result = self.operations[token](operand1, operand2)
-                stack.append(list(result))
+            if token == 'NOT':
+                stack.append(('NOT', stack.pop()))
+            elif token.startswith('NEAR/'):
+                right = stack.pop()
+                left = stack.pop()
+                stack.append(('NEAR', int(token.split('/')[1]), left, right))
+            elif token.startswith('"'):
+                # Стоп-слова и слишком короткие слова не индексируются: от них
+                # во фразе остаётся только смещение
+                words = re.findall(r'\w+', token)
+                stack.append(('PHRASE', [(offset, self._lemmatize(word))
+                                         for offset, word in enumerate(words)
+                                         if len(word) >= MIN_TOKEN_LENGTH and not self.normalizer.is_stopword(word)]))
+            elif token in self.operations:
+                right = stack.pop()
+                left = stack.pop()
+                children = []
+                for child in (left, right):
+                    children.extend(child[1] if child[0] == token else [child])
+                stack.append((token, children))
             else:
-                lemma = self.lemmatizer.lemmatize(token)
-                stack.append(self.index.get(lemma, []))
+                stack.append(self._term_node(token))
+
+        return stack[0] if stack else None
+
+    def _term_node(self, token):
+        """
+        Узел слова запроса
+
+        Известное слово — ('TERM', лемма). Шаблон раскрывается в леммы
+        подходящих слов словаря, неизвестное слово — в леммы ближайших по
+        расстоянию Левенштейна (не больше MAX_EXPANSIONS слов); несколько
+        лемм объединяются через OR.
+        """
+        if is_pattern(token):
+            words = self.term_dict.wildcard(token, MAX_EXPANSIONS)
+        else:
+            lemma = self._lemmatize(token)
+            if lemma in self.index or not token.isalpha() or self.normalizer.is_stopword(token):
+                return ('TERM', lemma)
+            words = [word for word, _ in self.term_dict.fuzzy(token, limit=MAX_EXPANSIONS)]
+            if not words:
+                return ('TERM', lemma)
+        lemmas = list(dict.fromkeys(self._word_lemma(word) for word in words))
+        if len(lemmas) == 1:
+            return ('TERM', lemmas[0])
+        return ('OR', [('TERM', lemma) for lemma in lemmas]) if lemmas else ('TERM', token)
+
+    def _lemmatize(self, word):
+        lemma = self.lemma_cache.get(word)
+        if lemma is None:
+            lemma = self.normalizer.lemma(word) or word
+            self.lemma_cache.put(word, lemma)
+        return lemma
+
+    def _term_postings(self, lemma):
+        return to_postings(self.index.get(lemma, []))
+
+    def _positions(self, node):
+        """
+        Позиционные постинги узла-слова, фразы или NEAR: список (doc_id, позиции)
+
+        Стоп-слова в узел фразы не попадают (_build_plan), но их смещения
+        сохраняются. Слово фразы без позиций в индексе делает фразу пустой.
+        """
+        if self.positional_index is None:
+            raise ValueError("Phrase and NEAR queries require a positional index")
+
+        kind = node[0]
+        if kind == 'TERM':
+            return self.positional_index.postings(node[1])
+        if kind == 'PHRASE':
+            postings_lists, offsets = [], []
+            for offset, lemma in node[1]:
+                postings = self.positional_index.postings(lemma)
+                if not postings:
+                    return []
+                postings_lists.append(postings)
+                offsets.append(offset)
+            if not postings_lists:
+                return []
+            return phrase_positions(postings_lists, offsets)
+        if kind == 'NEAR':
+            return near_positions(self._positions(node[2]), self._positions(node[3]), node[1])
+        if kind == 'OR' and all(child[0] == 'TERM' for child in node[1]):
+            # Раскрытый шаблон или исправленное слово: позиции всех его лемм
+            merged = defaultdict(list)
+            for child in node[1]:
+                for doc_id, positions in self._positions(child):
+                    merged[doc_id].extend(positions)
+            return [(doc_id, to_postings(sorted(set(positions)))) for doc_id, positions in sorted(merged.items())]
+        raise ValueError("NEAR operands must be words or phrases")
 
-        return sorted(stack[0]) if stack else []
+    def _estimate(self, node):
+        """Оценка размера результата узла (для упорядочивания операндов)"""
+        kind = node[0]
+        if kind == 'PHRASE':
+            return min((self._estimate(('TERM', lemma)) for _, lemma in node[1]), default=0)
+        if kind == 'NEAR':
+            return min(self._estimate(node[2]), self._estimate(node[3]))
+        if kind == 'TERM':
+            if self.compact_index is not None:
+                term_id = self.compact_index.term_id(node[1])
+                return self.compact_index.df(term_id) if term_id >= 0 else 0
+            return len(self.index.get(node[1], ()))
+        if kind == 'NOT':
+            return len(self._universe) - self._estimate(node[1])
+        if kind == 'AND':
+            return min(self._estimate(child) for child in node[1])
+        return min(len(self._universe), sum(self._estimate(child) for child in node[1]))
 
-    def _get_total_documents(self):
-        max_doc_id = 0
-        for doc_ids in self.index.values():
-            if doc_ids:
-                max_doc_id = max(max_doc_id, max(doc_ids))
-        return max_doc_id + 1
+    def _evaluate(self, node, trace=None):
+        kind = node[0]
+        if kind == 'TERM':
+            postings = self._term_postings(node[1])
+            if trace is not None:
+                trace.count('postings', len(postings))
+            return postings
+        if kind in ('PHRASE', 'NEAR'):
+            postings = to_postings([doc_id for doc_id, _ in self._positions(node)])
+            if trace is not None:
+                trace.count('postings', len(postings))
+            return postings
+        if kind == 'NOT':
+            return difference(self._universe, self._evaluate(node[1], trace))
+        if kind == 'OR':
+            result = to_postings([])
+            for child in sorted(node[1], key=self._estimate):
+                result = union(result, self._evaluate(child, trace))
+            return result
+
+        # AND: пересекаем от самого селективного операнда,
+        # a AND NOT b вычисляется как разность, без дополнения до всех документов
+        positive = sorted((child for child in node[1] if child[0] != 'NOT'), key=self._estimate)
+        negative = sorted((child[1] for child in node[1] if child[0] == 'NOT'),
+                          key=self._estimate, reverse=True)
+
+        result = self._evaluate(positive[0], trace) if positive else self._universe
+        for child in positive[1:]:
+            if not result:
+                return result
+            result = intersect(result, self._evaluate(child, trace))
+        for child in negative:
+            if not result:
+                return result
+            result = difference(result, self._evaluate(child, trace))
+        return result
+
+    def _evaluate_postfix(self, postfix):
+        """
+        Вычисление постфиксного выражения
+
+        :param postfix: список токенов в постфиксной нотации
+        :return: список ID документов, удовлетворяющих запросу
+        """
+        plan = self._build_plan(postfix)
+        return list(self._evaluate(plan)) if plan else []
 
     def search(self, query):
         """
         Выполнение поиска по булевому запросу
 
-        :param query: строка запроса (например, "(cat AND dog) OR (mouse NOT cheese)")
+        :param query: строка запроса (например, "(cat AND dog) OR (mouse NOT cheese)",
+            '"public health" AND vaccine NEAR/5 uptake', 'vaccin* AND helth')
         :return: отсортированный список ID документов
         """
         if not query.strip():
             return []
 
-        tokens = re.findall(r'\(|\)|[\w]+', query)
-        postfix = self._shunting_yard(tokens)
-        return self._evaluate_postfix(postfix)
+        trace = QueryTrace('boolean', query)
+        with trace.stage('parse'):
+            tokens = re.findall(r'"[^"]*"|NEAR/\d+|\(|\)|[\w*?]*\w[\w*?]*', query)
+            postfix = self._shunting_yard(tokens)
+        key = (self.index_version, ' '.join(postfix))
+        results = self.result_cache.get(key)
+        if results is None:
+            with trace.stage('plan'):
+                plan = self._build_plan(postfix)
+            trace.plan = {'postfix': ' '.join(postfix), 'tree': plan}
+            with trace.stage('evaluate'):
+                results = tuple(self._evaluate(plan, trace)) if plan else ()
+            self.result_cache.put(key, results)
+        else:
+            trace.count('cache_hits')
+        trace.count('results', len(results))
+        run_hooks(self.hooks, trace)
+        return list(results)
+
+    def cache_stats(self):
+        """Счётчики кэшей результатов и лемм"""
+        return {'results': self.result_cache.stats(), 'lemmas': self.lemma_cache.stats()}
 
     def interactive_search(self):
         print("Boolean Search Engine")
-        print("Supported operators: AND, OR, NOT")
+        print("Supported operators: AND, OR, NOT, NEAR/k, \"phrase\"")
         print("Parentheses can be used for grouping")
         print("Example: (cat AND dog) OR (mouse NOT cheese)")
+        print("Example: \"public health\" AND vaccine NEAR/5 uptake")
         print("Type 'exit' to quit\n")
 
         while True:
@@ -131,5 +335,6 @@ class BooleanSearchEngine:
 
 
 if __name__ == '__main__':
-    search_engine = BooleanSearchEngine('inverted_index.txt')
+    positions_file = POSITIONAL_INDEX_PATH if os.path.exists(POSITIONAL_INDEX_PATH) else None
+    search_engine = BooleanSearchEngine('inverted_index.txt', positions_file=positions_file)
     search_engine.interactive_search()
\ No newline at end of file
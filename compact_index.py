@@ -0,0 +1,446 @@
+import os
+import mmap
+import struct
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from bm25 import BM25_K1, BM25_B, bm25_idf, bm25_weight
+from page_files import DUPLICATES_PATH, read_doc_counts, read_duplicate_ids
+from term_dict import TermDictionary, build_trie
+
+COMPACT_INDEX_PATH = 'index.bin'
+
+MAGIC = b'OIPIDX\x00\x04'
+# magic, n_docs, n_terms, n_words, n_postings, n_trie_nodes, 19 смещений секций
+HEADER = struct.Struct('<8sIIIQQ19Q')
+SECTIONS = ('doc_ids', 'norms', 'doc_lengths', 'bm25', 'term_offsets', 'term_blob',
+            'term_postings', 'term_weights', 'term_max', 'term_bm25_max', 'postings', 'weights',
+            'tfs', 'word_offsets', 'word_blob', 'word_lemmas', 'trie_children', 'trie_labels',
+            'trie_words')
+# Запас, чтобы округление до float32 не занизило верхнюю границу
+MAX_SCORE_SLACK = 1 + 1e-6
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_postings(buf, start, end):
+    """Декодирует delta/varint-постинги из buf[start:end] в список doc_id"""
+    doc_ids = []
+    doc_id = 0
+    value = shift = 0
+    for pos in range(start, end):
+        byte = buf[pos]
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        doc_id += value
+        doc_ids.append(doc_id)
+        value = shift = 0
+    return doc_ids
+
+
+def _pack_strings(strings):
+    offsets = [0]
+    blob = bytearray()
+    for s in strings:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+    return struct.pack(f'<{len(offsets)}Q', *offsets), bytes(blob)
+
+
+def write_compact_index(output_path, doc_norms, postings, lemmas_map, doc_lengths,
+                        k1=BM25_K1, b=BM25_B, collection=None):
+    """
+    Записывает бинарный индекс
+
+    Верхние границы вклада термина (для cosine и для BM25 с параметрами
+    k1, b) вычисляются здесь, чтобы поиск мог отсекать документы без
+    прохода по постингам. Префиксное дерево слов (term_dict.build_trie)
+    сохраняется для расширения слов запроса по шаблону и опечаткам.
+
+    :param output_path: путь к файлу индекса
+    :param doc_norms: словарь {doc_id: норма TF-IDF вектора}
+    :param postings: словарь {лемма: список (doc_id, tf-idf, число вхождений)}
+    :param lemmas_map: словарь {слово: лемма}
+    :param doc_lengths: словарь {doc_id: число токенов документа}
+    :param collection: статистика всего корпуса {"n_docs", "avgdl", "df"} для
+        индекса-шарда; по умолчанию корпус — это сами doc_norms
+    """
+    doc_ids = sorted(doc_norms)
+    if collection is not None:
+        n_docs, avgdl = collection['n_docs'], collection['avgdl']
+    else:
+        n_docs = len(doc_ids)
+        avgdl = sum(doc_lengths.get(d, 0) for d in doc_ids) / len(doc_ids) if doc_ids else 0.0
+    terms = sorted(postings)
+    term_ids = {term: i for i, term in enumerate(terms)}
+    words = sorted(word for word, lemma in lemmas_map.items() if lemma in term_ids)
+
+    term_postings = [0]
+    term_weights = [0]
+    term_max = []
+    term_bm25_max = []
+    postings_blob = bytearray()
+    weights = []
+    tfs = []
+    for term in terms:
+        prev = 0
+        max_score = 0.0
+        max_bm25 = 0.0
+        df = collection['df'].get(term, 0) if collection is not None else len(postings[term])
+        idf = bm25_idf(df, n_docs)
+        for doc_id, weight, tf in sorted(postings[term]):
+            encode_varint(doc_id - prev, postings_blob)
+            prev = doc_id
+            weights.append(weight)
+            tfs.append(tf)
+            if doc_norms.get(doc_id):
+                max_score = max(max_score, weight / doc_norms[doc_id])
+            max_bm25 = max(max_bm25, bm25_weight(tf, idf, doc_lengths.get(doc_id, 0), avgdl, k1, b))
+        term_max.append(max_score * MAX_SCORE_SLACK)
+        term_bm25_max.append(max_bm25 * MAX_SCORE_SLACK)
+        term_postings.append(len(postings_blob))
+        term_weights.append(len(weights))
+
+    term_offsets, term_blob = _pack_strings(terms)
+    word_offsets, word_blob = _pack_strings(words)
+    trie_children, trie_labels, trie_words = build_trie(words)
+    sections = {
+        'doc_ids': struct.pack(f'<{len(doc_ids)}i', *doc_ids),
+        'norms': struct.pack(f'<{len(doc_ids)}d', *(doc_norms[d] for d in doc_ids)),
+        'doc_lengths': struct.pack(f'<{len(doc_ids)}I', *(doc_lengths.get(d, 0) for d in doc_ids)),
+        'bm25': struct.pack('<3d', k1, b, avgdl),
+        'term_offsets': term_offsets,
+        'term_blob': term_blob,
+        'term_postings': struct.pack(f'<{len(term_postings)}Q', *term_postings),
+        'term_weights': struct.pack(f'<{len(term_weights)}Q', *term_weights),
+        'term_max': struct.pack(f'<{len(term_max)}f', *term_max),
+        'term_bm25_max': struct.pack(f'<{len(term_bm25_max)}f', *term_bm25_max),
+        'postings': bytes(postings_blob),
+        'weights': struct.pack(f'<{len(weights)}f', *weights),
+        'tfs': struct.pack(f'<{len(tfs)}I', *tfs),
+        'word_offsets': word_offsets,
+        'word_blob': word_blob,
+        'word_lemmas': struct.pack(f'<{len(words)}I', *(term_ids[lemmas_map[w]] for w in words)),
+        'trie_children': struct.pack(f'<{len(trie_children)}I', *trie_children),
+        'trie_labels': struct.pack(f'<{len(trie_labels)}I', *trie_labels),
+        'trie_words': struct.pack(f'<{len(trie_words)}i', *trie_words),
+    }
+
+    offsets = []
+    body = bytearray()
+    for name in SECTIONS:
+        # Выравнивание по 8 байт для memoryview.cast
+        body += b'\x00' * (-(HEADER.size + len(body)) % 8)
+        offsets.append(HEADER.size + len(body))
+        body += sections[name]
+
+    header = HEADER.pack(MAGIC, len(doc_ids), len(terms), len(words), len(weights), len(trie_labels),
+                         *offsets)
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_path, output_path)
+
+
+def _read_lemma_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split()
+            if parts:
+                yield parts
+
+
+def load_page_index(pages_dir='pages', index_path='inverted_index.txt', exclude=()):
+    """
+    Читает inverted_index.txt и файлы страниц
+
+    Каталоги без tokens.txt (ещё не разобранные страницы, почти-дубликаты)
+    и doc_id из exclude документами не считаются.
+
+    :return: (нормы документов, постинги {лемма: [(doc_id, tf-idf, tf)]},
+        словарь {слово: лемма}, длины документов)
+    """
+    lemmas_map = {}
+    postings = {}
+    doc_norms = {}
+    doc_lengths = {}
+
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() and ':' in line:
+                postings[line.split(':', 1)[0]] = []
+
+    for page_dir in os.listdir(pages_dir):
+        page_path = os.path.join(pages_dir, page_dir)
+        # Рядом с каталогами page_N могут лежать исходные page_N.html
+        if not page_dir.startswith('page_') or not os.path.isdir(page_path):
+            continue
+        doc_id = int(page_dir.split('_')[1])
+        if doc_id in exclude or not os.path.exists(os.path.join(page_path, 'tokens.txt')):
+            continue
+
+        lemmas_path = os.path.join(page_path, 'lemmas.txt')
+        if os.path.exists(lemmas_path):
+            for parts in _read_lemma_lines(lemmas_path):
+                for word in parts[1:]:
+                    lemmas_map[word] = parts[0]
+
+        counts = read_doc_counts(page_path)
+        lemma_tfs = counts[1] if counts else {}
+        doc_lengths[doc_id] = counts[2] if counts else 0
+
+        norm = 0.0
+        tfidf_path = os.path.join(page_path, 'lemmas_tfidf.txt')
+        if os.path.exists(tfidf_path):
+            for parts in _read_lemma_lines(tfidf_path):
+                if len(parts) < 3:
+                    continue
+                weight = float(parts[2])
+                norm += weight ** 2
+                postings.setdefault(parts[0], []).append((doc_id, weight, lemma_tfs.get(parts[0], 0)))
+        doc_norms[doc_id] = norm ** 0.5
+
+    return doc_norms, postings, lemmas_map, doc_lengths
+
+
+def build_compact_index(pages_dir='pages', index_path='inverted_index.txt',
+                        output_path=COMPACT_INDEX_PATH, duplicates_path=DUPLICATES_PATH):
+    """Собирает бинарный индекс из inverted_index.txt и файлов страниц (без почти-дубликатов)"""
+    write_compact_index(output_path, *load_page_index(pages_dir, index_path,
+                                                      read_duplicate_ids(duplicates_path)))
+
+
+class CompactIndex:
+    """
+    Бинарный индекс, открытый через mmap
+
+    Словарь терминов отсортирован, поиск термина — бинарный поиск по
+    отображённой памяти; постинги декодируются только для нужных терминов.
+    Страницы файла разделяются между всеми процессами, открывшими индекс.
+    """
+
+    def __init__(self, path=COMPACT_INDEX_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.n_words, n_postings, n_nodes, *offsets = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: неизвестный формат индекса')
+
+        view = memoryview(self._mm)
+        bounds = dict(zip(SECTIONS, offsets))
+        sizes = {
+            'doc_ids': 4 * self.n_docs,
+            'norms': 8 * self.n_docs,
+            'doc_lengths': 4 * self.n_docs,
+            'bm25': 8 * 3,
+            'term_offsets': 8 * (self.n_terms + 1),
+            'term_postings': 8 * (self.n_terms + 1),
+            'term_weights': 8 * (self.n_terms + 1),
+            'term_max': 4 * self.n_terms,
+            'term_bm25_max': 4 * self.n_terms,
+            'weights': 4 * n_postings,
+            'tfs': 4 * n_postings,
+            'word_offsets': 8 * (self.n_words + 1),
+            'word_lemmas': 4 * self.n_words,
+            'trie_children': 4 * (n_nodes + 1),
+            'trie_labels': 4 * n_nodes,
+            'trie_words': 4 * n_nodes,
+        }
+
+        def section(name, fmt):
+            start = bounds[name]
+            return view[start:start + sizes[name]].cast(fmt)
+
+        self.doc_ids = section('doc_ids', 'i')
+        self.norms = section('norms', 'd')
+        self.doc_lengths = section('doc_lengths', 'I')
+        self.bm25_k1, self.bm25_b, self.avgdl = section('bm25', 'd').tolist()
+        self._term_offsets = section('term_offsets', 'Q')
+        self._term_postings = section('term_postings', 'Q')
+        self._term_weights = section('term_weights', 'Q')
+        self._term_max = section('term_max', 'f')
+        self._term_bm25_max = section('term_bm25_max', 'f')
+        self._weights = section('weights', 'f')
+        self._tfs = section('tfs', 'I')
+        self._word_offsets = section('word_offsets', 'Q')
+        self._word_lemmas = section('word_lemmas', 'I')
+        self._trie = (section('trie_children', 'I'), section('trie_labels', 'I'), section('trie_words', 'i'))
+        self._term_blob = bounds['term_blob']
+        self._postings = bounds['postings']
+        self._word_blob = bounds['word_blob']
+
+        self.lemmas_map = _LemmasMap(self)
+        # Отсортированные словари слов и лемм
+        self.words = _Strings(self.word, self.n_words)
+        self.terms = _Strings(self.term, self.n_terms)
+        self.postings_map = _PostingsMap(self)
+        self.norms_map = _NormsMap(self)
+
+    def close(self):
+        # Отображения и словари ссылаются на индекс, а он на них: без разрыва
+        # цикла индекс освобождает только сборщик мусора
+        self.lemmas_map = self.words = self.terms = self.postings_map = self.norms_map = None
+        for name in ('doc_ids', 'norms', 'doc_lengths', '_term_offsets', '_term_postings',
+                     '_term_weights', '_term_max', '_term_bm25_max', '_weights', '_tfs',
+                     '_word_offsets', '_word_lemmas'):
+            getattr(self, name).release()
+        for section in self._trie:
+            section.release()
+        self._mm.close()
+
+    def _string(self, blob, offsets, i):
+        return self._mm[blob + offsets[i]:blob + offsets[i + 1]].decode('utf-8')
+
+    def term(self, term_id):
+        return self._string(self._term_blob, self._term_offsets, term_id)
+
+    def word(self, word_id):
+        return self._string(self._word_blob, self._word_offsets, word_id)
+
+    def _find(self, key, count, getter):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if getter(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < count and getter(lo) == key else -1
+
+    def term_id(self, term):
+        """Номер термина в словаре или -1"""
+        return self._find(term, self.n_terms, self.term)
+
+    def lemma(self, word):
+        """Лемма слова или None"""
+        word_id = self._find(word, self.n_words, self.word)
+        return None if word_id < 0 else self.term(self._word_lemmas[word_id])
+
+    def word_dictionary(self):
+        """Словарь слов индекса с поиском по префиксу, шаблону и опечаткам (поверх mmap)"""
+        return TermDictionary(self.words, self._trie)
+
+    def df(self, term_id):
+        return self._term_weights[term_id + 1] - self._term_weights[term_id]
+
+    def max_score(self, term_id):
+        """Верхняя граница weight / doc_norm по постингам термина"""
+        return self._term_max[term_id]
+
+    def bm25_max_score(self, term_id):
+        """Верхняя граница BM25-вклада термина (для k1, b, с которыми собран индекс)"""
+        return self._term_bm25_max[term_id]
+
+    def postings(self, term_id):
+        """Отсортированный список doc_id термина"""
+        start = self._postings + self._term_postings[term_id]
+        end = self._postings + self._term_postings[term_id + 1]
+        return decode_postings(self._mm, start, end)
+
+    def term_weights(self, term_id):
+        """Список (doc_id, tf-idf) термина"""
+        start, end = self._term_weights[term_id], self._term_weights[term_id + 1]
+        return list(zip(self.postings(term_id), self._weights[start:end].tolist()))
+
+    def term_tfs(self, term_id):
+        """Список (doc_id, число вхождений) термина"""
+        start, end = self._term_weights[term_id], self._term_weights[term_id + 1]
+        return list(zip(self.postings(term_id), self._tfs[start:end].tolist()))
+
+    def norm(self, doc_id):
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < self.n_docs and self.doc_ids[i] == doc_id:
+            return self.norms[i]
+        return None
+
+
+class _Strings(Sequence):
+    """Отсортированные строки словаря индекса как последовательность (для bisect)"""
+
+    def __init__(self, getter, count):
+        self._getter = getter
+        self._count = count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._getter(i)
+
+    def __len__(self):
+        return self._count
+
+
+class _LemmasMap(Mapping):
+    """Отображение {слово: лемма} поверх CompactIndex"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, word):
+        lemma = self._index.lemma(word)
+        if lemma is None:
+            raise KeyError(word)
+        return lemma
+
+    def __contains__(self, word):
+        return self._index.lemma(word) is not None
+
+    def __iter__(self):
+        return (self._index.word(i) for i in range(self._index.n_words))
+
+    def __len__(self):
+        return self._index.n_words
+
+
+class _PostingsMap(Mapping):
+    """Отображение {лемма: список doc_id} поверх CompactIndex"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, term):
+        term_id = self._index.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        return self._index.postings(term_id)
+
+    def __contains__(self, term):
+        return self._index.term_id(term) >= 0
+
+    def __iter__(self):
+        return (self._index.term(i) for i in range(self._index.n_terms))
+
+    def __len__(self):
+        return self._index.n_terms
+
+
+class _NormsMap(Mapping):
+    """Отображение {doc_id: норма} поверх CompactIndex"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, doc_id):
+        norm = self._index.norm(doc_id)
+        if norm is None:
+            raise KeyError(doc_id)
+        return norm
+
+    def __iter__(self):
+        return iter(self._index.doc_ids.tolist())
+
+    def __len__(self):
+        return self._index.n_docs
+
+
+if __name__ == '__main__':
+    build_compact_index()
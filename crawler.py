@@ -1,12 +1,13 @@
 import os
-import random
+import json
 import time
-import requests
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+import aiohttp
 from bs4 import BeautifulSoup
-
-if not os.path.exists('pages'):
-    os.makedirs('pages')
-
+from dedup import DUPLICATES_PATH, DuplicateIndex, canonical_url, html_signature
 
 base_url = 'https://www.frontiersin.org'
 search_url = 'https://www.frontiersin.org/journals/public-health/articles'
@@ -17,36 +18,225 @@ user_agents = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15',
 ]
-article_links = []
 
-def get_article_links(url, max_pages=10):
-    for page in range(1, max_pages + 1):
+STATE_PATH = 'crawl_state.json'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CrawlState:
+    """
+    Состояние обхода, сохраняемое на диск после каждого шага
+
+    article_links — упорядоченный список найденных статей (номер страницы
+    pages/page_N.html равен позиции ссылки), seen — множество канонических
+    URL (canonical_url) для проверки за O(1): варианты /full, /abstract и
+    ссылки со строкой запроса не добавляются повторно. done_listings и
+    downloaded позволяют продолжить прерванный обход.
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.article_links = []
+        self.seen = set()
+        self.done_listings = set()
+        self.downloaded = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.article_links = data['article_links']
+            self.seen = {canonical_url(link) for link in self.article_links}
+            self.done_listings = set(data['done_listings'])
+            self.downloaded = set(data['downloaded'])
+
+    def add_link(self, link):
+        key = canonical_url(link)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.article_links.append(link)
+        return True
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'article_links': self.article_links,
+                'done_listings': sorted(self.done_listings),
+                'downloaded': sorted(self.downloaded),
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+class HostLimiter:
+    """
+    Ограничение одновременных запросов и частоты запросов к каждому хосту
+
+    К хосту одновременно идёт не больше concurrency запросов. Задержка
+    min_delay..max_delay выдерживается в каждом из concurrency слотов,
+    поэтому старты запросов к хосту разнесены на delay / concurrency: при
+    общем интервале delay между любыми стартами запросы шли бы по одному,
+    и concurrency ничего бы не давала.
+    """
+
+    def __init__(self, concurrency=4, min_delay=1.0, max_delay=3.0):
+        self.concurrency = concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._semaphores = {}
+        self._locks = {}
+        self._next_time = {}
+
+    async def __call__(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.concurrency)
+            self._locks[host] = asyncio.Lock()
+        # Интервал между стартами запросов к хосту — случайный, как раньше, но делится между слотами
+        async with self._locks[host]:
+            delay = self._next_time.get(host, 0.0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            interval = random.uniform(self.min_delay, self.max_delay) / self.concurrency
+            self._next_time[host] = time.monotonic() + interval
+        return self._semaphores[host]
+
+
+async def fetch(session, limiter, url, retries=3, backoff=1.0):
+    """
+    Загружает страницу с повторами и экспоненциальной задержкой
+
+    :return: текст ответа или None, если все попытки неудачны
+    """
+    for attempt in range(retries + 1):
+        semaphore = await limiter(url)
+        try:
+            async with semaphore:
+                async with session.get(url, headers={'User-Agent': random.choice(user_agents)}) as response:
+                    if response.status in RETRY_STATUSES:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=response.reason)
+                    response.raise_for_status()
+                    return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUSES
+            if attempt == retries or not retryable:
+                print(f'Failed to download {url}: {e}')
+                return None
+            await asyncio.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+    return None
+
+
+def extract_article_links(html, site_url=base_url):
+    soup = BeautifulSoup(html, 'html.parser')
+    for link in soup.find_all('a', href=True):
+        if '/articles/' in link['href'] and 'doi.org' not in link['href']:
+            yield site_url + link['href'] if not link['href'].startswith('http') else link['href']
+
+
+async def get_article_links(session, limiter, state, url, max_pages=10, site_url=base_url):
+    async def process_listing(page):
         page_url = f'{url}?page={page}'
-        headers = {'User-Agent': random.choice(user_agents)}
-        response = requests.get(page_url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for link in soup.find_all('a', href=True):
-            if '/articles/' in link['href'] and 'doi.org' not in link['href']:
-                full_link = base_url + link['href'] if not link['href'].startswith('http') else link['href']
-                if full_link not in article_links:
-                    article_links.append(full_link)
-        print(f'Processed page {page}, found {len(article_links)} articles so far.')
-        time.sleep(random.uniform(1, 3))
-    return article_links
-
-def download_page(url, index):
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        with open(f'pages/page_{index}.html', 'w', encoding='utf-8') as file:
-            file.write(response.text)
-    except requests.exceptions.RequestException as e:
-        print(f'Failed to download {url}: {e}')
-
-get_article_links(search_url)
-
-for index, link in enumerate(article_links[:150]):
-    download_page(link, index)
-    with open('index.txt', 'a') as index_file:
-        index_file.write(f'{index}: {link}\n')
-    print(f'Downloaded {index}: {link}')
\ No newline at end of file
+        html = await fetch(session, limiter, page_url)
+        if html is None:
+            return
+        for full_link in extract_article_links(html, site_url):
+            state.add_link(full_link)
+        state.done_listings.add(page_url)
+        state.save()
+        print(f'Processed page {page}, found {len(state.article_links)} articles so far.')
+
+    pending = [page for page in range(1, max_pages + 1)
+               if f'{url}?page={page}' not in state.done_listings]
+    await asyncio.gather(*(process_listing(page) for page in pending))
+    return state.article_links
+
+
+def append_index_line(index_file, index, url):
+    """
+    Дописывает в index.txt строку "N: url", если её там ещё нет
+
+    Строка пишется до state.save(): если обход прервался между ними,
+    повторный запуск скачает страницу снова, но вторую строку не добавит.
+    """
+    line = f'{index}: {url}\n'
+    if os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            if line in f:
+                return
+    with open(index_file, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+
+async def download_page(session, limiter, state, url, index, pages_dir='pages', index_file='index.txt',
+                        duplicates=None):
+    """
+    Скачивает статью в pages/page_N.html
+
+    Если duplicates (DuplicateIndex) находит в уже скачанных почти такую же
+    страницу, файл не сохраняется: в duplicates.json записывается номер
+    канонической страницы.
+    """
+    html = await fetch(session, limiter, url)
+    if html is None:
+        return
+    if duplicates is not None:
+        canonical = duplicates.add(index, html_signature(html))
+        duplicates.save()
+        if canonical != index:
+            state.downloaded.add(url)
+            state.save()
+            print(f'Skipped {index}: {url} (near-duplicate of page {canonical})')
+            return
+    path = os.path.join(pages_dir, f'page_{index}.html')
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        file.write(html)
+    os.replace(f'{path}.tmp', path)
+    append_index_line(index_file, index, url)
+    state.downloaded.add(url)
+    state.save()
+    print(f'Downloaded {index}: {url}')
+
+
+async def crawl(start_url=search_url, site_url=base_url, max_pages=10, max_articles=150,
+                concurrency=4, min_delay=1.0, max_delay=3.0, pages_dir='pages',
+                index_file='index.txt', state_path=STATE_PATH, duplicates_path=DUPLICATES_PATH):
+    """
+    Асинхронный обход: сначала страницы списка статей, затем сами статьи
+
+    Одна сессия aiohttp переиспользует соединения; при повторном запуске
+    уже обработанные страницы списка и скачанные статьи пропускаются.
+    Почти-дубликаты уже скачанных статей не сохраняются (см. dedup.py).
+    """
+    os.makedirs(pages_dir, exist_ok=True)
+    state = CrawlState(state_path)
+    limiter = HostLimiter(concurrency, min_delay, max_delay)
+    duplicates = DuplicateIndex(duplicates_path) if duplicates_path is not None else None
+    connector = aiohttp.TCPConnector(limit=concurrency * 4, limit_per_host=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+        await get_article_links(session, limiter, state, start_url, max_pages, site_url)
+        await asyncio.gather(*(
+            download_page(session, limiter, state, link, index, pages_dir, index_file, duplicates)
+            for index, link in enumerate(state.article_links[:max_articles])
+            if link not in state.downloaded
+        ))
+    return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Асинхронный краулер статей')
+    parser.add_argument('--base-url', default=base_url)
+    parser.add_argument('--start-url', default=search_url)
+    parser.add_argument('--max-pages', type=int, default=10)
+    parser.add_argument('--max-articles', type=int, default=150)
+    parser.add_argument('--concurrency', type=int, default=4, help='запросов к одному хосту одновременно')
+    parser.add_argument('--min-delay', type=float, default=1.0, help='задержка между запросами одного слота')
+    parser.add_argument('--max-delay', type=float, default=3.0)
+    parser.add_argument('--state', default=STATE_PATH)
+    parser.add_argument('--duplicates', default=DUPLICATES_PATH)
+    args = parser.parse_args()
+    asyncio.run(crawl(args.start_url, args.base_url, args.max_pages, args.max_articles,
+                      args.concurrency, args.min_delay, args.max_delay, state_path=args.state,
+                      duplicates_path=args.duplicates))
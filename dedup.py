@@ -0,0 +1,215 @@
+import os
+import json
+import zlib
+import argparse
+from urllib.parse import urlsplit, urlunsplit
+import numpy as np
+from bs4 import BeautifulSoup
+from manifest import write_json_atomic
+from normalizer import clean_text, get_normalizer, tokenize
+from page_files import DUPLICATES_PATH
+# Длина шингла в словах
+SHINGLE_SIZE = 5
+# Сигнатура MinHash — NUM_BANDS полос по BAND_ROWS значений. Пара попадает
+# в кандидаты, если совпала хотя бы одна полоса: при 16 × 8 вероятность
+# этого круто растёт около сходства (1/16)^(1/8) ≈ 0.7
+NUM_BANDS = 16
+BAND_ROWS = 8
+NUM_PERM = NUM_BANDS * BAND_ROWS
+# Кандидат считается дубликатом при оценке сходства Жаккара не ниже этой
+DUPLICATE_THRESHOLD = 0.8
+# Хвосты путей, под которыми сайт отдаёт ту же статью
+ARTICLE_SUFFIXES = ('/full', '/abstract', '/pdf', '/epub', '/xml')
+
+# Простое число Мерсенна 2^31 - 1: a * x + b при x, a, b < 2^31 не переполняет uint64
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(0)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def canonical_url(url):
+    """
+    URL статьи без строки запроса, фрагмента и хвостов /full, /abstract и т. п.
+
+    Разные представления одной статьи дают одну строку, поэтому краулер не
+    ставит их в очередь повторно.
+    """
+    scheme, netloc, path, _, _ = urlsplit(url)
+    path = path.rstrip('/')
+    for suffix in ARTICLE_SUFFIXES:
+        if path.endswith(suffix):
+            path = path[:-len(suffix)]
+            break
+    return urlunsplit((scheme, netloc.lower(), path, '', ''))
+
+
+def shingles(tokens, size=SHINGLE_SIZE):
+    """Хэши (crc32) шинглов — последовательностей из size подряд идущих токенов"""
+    if len(tokens) < size:
+        return {zlib.crc32(' '.join(tokens).encode('utf-8'))} if tokens else set()
+    return {zlib.crc32(' '.join(tokens[i:i + size]).encode('utf-8')) for i in range(len(tokens) - size + 1)}
+
+
+def minhash(shingle_hashes):
+    """
+    Сигнатура MinHash: минимумы NUM_PERM случайных хэш-функций (a * x + b) mod p
+
+    Доля совпадающих позиций двух сигнатур — несмещённая оценка сходства
+    Жаккара множеств шинглов.
+    :return: массив uint32 длины NUM_PERM или None для пустого множества
+    """
+    if not shingle_hashes:
+        return None
+    x = np.fromiter(shingle_hashes, dtype=np.uint64, count=len(shingle_hashes)) % _PRIME
+    values = (np.outer(_A, x) + _B[:, None]) % _PRIME
+    return values.min(axis=1).astype(np.uint32)
+
+
+def page_signature(tokens):
+    """Сигнатура страницы по последовательности её индексируемых токенов"""
+    return minhash(shingles(tokens))
+
+
+def positions_signature(positions):
+    """Сигнатура страницы по позициям её токенов {токен: [позиции]} (tokenizer.analyze_page)"""
+    return page_signature([token for _, token in sorted((position, token) for token, token_positions
+                                                        in positions.items() for position in token_positions)])
+
+
+def html_signature(html):
+    """
+    Сигнатура HTML-страницы
+
+    Токены отбираются так же, как при индексации (tokenizer.analyze_page),
+    поэтому сигнатуры краулера и pipeline.py совпадают.
+    """
+    normalizer = get_normalizer()
+    text = BeautifulSoup(html, 'html.parser').get_text()
+    return page_signature([token for token in tokenize(clean_text(text)) if normalizer.is_indexable(token)])
+
+
+class DuplicateIndex:
+    """
+    Поиск почти-дубликатов страниц через MinHash и LSH
+
+    Сигнатура делится на NUM_BANDS полос; каждая полоса — ключ корзины.
+    Кандидаты на дубликат — документы из тех же корзин, поэтому проверка
+    новой страницы не зависит от размера коллекции линейно. Кандидат
+    подтверждается оценкой сходства по полной сигнатуре.
+
+    В корзинах лежат только канонические документы: дубликат привязывается
+    к каноническому документу своего кластера (первому добавленному), и
+    кластер не растёт цепочкой через дубликаты.
+
+    Состояние (сигнатуры канонических документов и отображение дубликат ->
+    канонический doc_id) хранится в duplicates.json.
+    """
+
+    def __init__(self, path=DUPLICATES_PATH, threshold=DUPLICATE_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.signatures = {}
+        self.duplicates = {}
+        self._buckets = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.duplicates = {int(doc_id): canonical for doc_id, canonical in data['duplicates'].items()}
+            for doc_id, signature in data['signatures'].items():
+                self._insert(int(doc_id), np.frombuffer(bytes.fromhex(signature), dtype='<u4'))
+
+    def _bands(self, signature):
+        return [(band, signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes())
+                for band in range(NUM_BANDS)]
+
+    def _insert(self, doc_id, signature):
+        self.signatures[doc_id] = signature
+        for key in self._bands(signature):
+            self._buckets.setdefault(key, []).append(doc_id)
+
+    def canonical(self, doc_id):
+        """Канонический doc_id кластера (сам doc_id, если он не дубликат)"""
+        seen = set()
+        # Канонический документ мог позже сам оказаться дубликатом
+        while doc_id in self.duplicates and doc_id not in seen:
+            seen.add(doc_id)
+            doc_id = self.duplicates[doc_id]
+        return doc_id
+
+    def is_duplicate(self, doc_id):
+        return doc_id in self.duplicates
+
+    def find(self, signature):
+        """
+        Канонический документ, почти совпадающий с сигнатурой
+
+        :return: (doc_id, оценка сходства) лучшего кандидата или None
+        """
+        candidates = set()
+        for key in self._bands(signature):
+            candidates.update(self._buckets.get(key, ()))
+        best = None
+        for doc_id in candidates:
+            similarity = float(np.mean(self.signatures[doc_id] == signature))
+            if similarity >= self.threshold and (best is None or (similarity, -doc_id) > (best[1], -best[0])):
+                best = (doc_id, similarity)
+        return best
+
+    def add(self, doc_id, signature):
+        """
+        Добавляет страницу
+
+        :param signature: сигнатура из page_signature (None — пустая страница,
+            она не бывает дубликатом и в корзины не попадает)
+        :return: канонический doc_id (doc_id, если страница не дубликат)
+        """
+        if doc_id in self.signatures or doc_id in self.duplicates:
+            self.forget([doc_id])
+        match = self.find(signature) if signature is not None else None
+        if match is not None and match[0] != doc_id:
+            self.duplicates[doc_id] = match[0]
+            return match[0]
+        if signature is not None:
+            self._insert(doc_id, signature)
+        return doc_id
+
+    def forget(self, doc_ids):
+        """
+        Удаляет страницы (например, перед повторным разбором)
+
+        Отображение дубликатов на удалённый канонический документ остаётся:
+        при повторном разборе страница с тем же doc_id снова станет
+        канонической.
+        """
+        doc_ids = set(doc_ids)
+        for doc_id in doc_ids:
+            self.duplicates.pop(doc_id, None)
+            signature = self.signatures.pop(doc_id, None)
+            if signature is None:
+                continue
+            for key in self._bands(signature):
+                bucket = self._buckets[key]
+                bucket.remove(doc_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def save(self, path=None):
+        write_json_atomic({
+            'duplicates': {str(doc_id): canonical for doc_id, canonical in sorted(self.duplicates.items())},
+            'signatures': {str(doc_id): signature.astype('<u4').tobytes().hex()
+                           for doc_id, signature in sorted(self.signatures.items())},
+        }, path or self.path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Кластеры почти-дубликатов страниц')
+    parser.add_argument('--duplicates', default=DUPLICATES_PATH)
+    args = parser.parse_args()
+    index = DuplicateIndex(args.duplicates)
+    clusters = {}
+    for doc_id in index.duplicates:
+        clusters.setdefault(index.canonical(doc_id), []).append(doc_id)
+    print(f"{len(index.signatures)} canonical pages, {len(index.duplicates)} duplicates")
+    for canonical, doc_ids in sorted(clusters.items()):
+        print(f"{canonical}: {' '.join(map(str, sorted(doc_ids)))}")
@@ -0,0 +1,293 @@
+import os
+import re
+import json
+import mmap
+import zlib
+import struct
+import argparse
+from bisect import bisect_left
+from multiprocessing import Pool
+from bs4 import BeautifulSoup
+from markupsafe import Markup, escape
+from page_files import DOCUMENT_FILE, read_duplicate_ids, read_lemma_words
+
+DOC_STORE_PATH = 'docs.bin'
+
+MAGIC = b'OIPDOC\x00\x01'
+# magic, n_docs, смещения doc_ids, record_offsets, records
+HEADER = struct.Struct('<8sI3Q')
+SUMMARY_WORDS = 40
+SNIPPET_WORDS = 30
+_NON_WORD = re.compile(r'\W+')
+
+
+def load_urls(index_file='index.txt'):
+    """Читает index.txt краулера ("N: url") в словарь {doc_id: url}"""
+    urls = {}
+    if not os.path.exists(index_file):
+        return urls
+    with open(index_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            doc_id, sep, url = line.partition(':')
+            if sep and doc_id.strip().isdigit():
+                urls[int(doc_id)] = url.strip()
+    return urls
+
+
+def iter_html_pages(pages_dir='pages'):
+    """
+    Перебирает (doc_id, путь) HTML-страниц
+
+    Поддерживаются оба варианта раскладки: pages/page_N.html (как после
+    краулера) и pages/page_N/page_N.html.
+    """
+    pages = {}
+    for name in os.listdir(pages_dir):
+        if not name.startswith('page_'):
+            continue
+        if name.endswith('.html'):
+            pages[int(name[len('page_'):-len('.html')])] = os.path.join(pages_dir, name)
+        else:
+            path = os.path.join(pages_dir, name, f'{name}.html')
+            if os.path.exists(path):
+                pages.setdefault(int(name[len('page_'):]), path)
+    return sorted(pages.items())
+
+
+def extract_document(path):
+    """Извлекает из HTML-файла заголовок, краткое описание и очищенный текст"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return document_from_soup(BeautifulSoup(f, 'html.parser'))
+
+
+def document_from_soup(soup):
+    """
+    Извлекает из разобранной страницы заголовок, краткое описание и очищенный текст
+
+    Текст берётся из <main>, если он есть; навигация, шапка и подвал
+    отбрасываются (из soup), чтобы сниппеты не попадали в меню сайта.
+    Описание — meta description страницы или, если его нет, первые
+    SUMMARY_WORDS слов текста.
+    """
+    title = soup.title.get_text(' ', strip=True) if soup.title else ''
+    for tag in soup(['script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside']):
+        tag.decompose()
+
+    if not title and soup.h1:
+        title = soup.h1.get_text(' ', strip=True)
+    body = soup.main or soup.body or soup
+    text = ' '.join(body.get_text(' ').split())
+
+    meta = soup.find('meta', attrs={'name': 'description'})
+    summary = ' '.join(meta.get('content', '').split()) if meta else ''
+    if not summary:
+        summary = ' '.join(text.split()[:SUMMARY_WORDS])
+    return {'title': title, 'summary': summary, 'text': text}
+
+
+def _extract_task(args):
+    doc_id, path, page_dir = args
+    document_path = os.path.join(page_dir, DOCUMENT_FILE)
+    # Токенизатор сохраняет документ при разборе страницы; HTML разбирается
+    # заново только для страниц, токенизированных до появления document.json
+    if os.path.exists(document_path):
+        with open(document_path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+    else:
+        document = extract_document(path)
+    lemmas_path = os.path.join(page_dir, 'lemmas.txt')
+    # Словарь слово -> лемма документа: подсветка без поиска по общему словарю
+    document['lemmas'] = {}
+    if os.path.exists(lemmas_path):
+        for lemma, words in read_lemma_words(lemmas_path):
+            for word in words:
+                document['lemmas'][word] = lemma
+    return doc_id, document
+
+
+def write_doc_store(output_path, documents):
+    """
+    Записывает хранилище документов
+
+    Каждая запись — JSON {"title", "url", "summary", "text", "lemmas"},
+    сжатый zlib отдельно, поэтому чтение одного документа распаковывает
+    только его.
+
+    :param documents: словарь {doc_id: запись}
+    """
+    _write_records(output_path, {doc_id: zlib.compress(json.dumps(document, ensure_ascii=False).encode('utf-8'), 6)
+                                 for doc_id, document in documents.items()})
+
+
+def _write_records(output_path, compressed):
+    """Записывает хранилище из уже сжатых записей {doc_id: bytes}"""
+    doc_ids = sorted(compressed)
+    record_offsets = [0]
+    records = bytearray()
+    for doc_id in doc_ids:
+        records += compressed[doc_id]
+        record_offsets.append(len(records))
+
+    sections = [
+        struct.pack(f'<{len(doc_ids)}i', *doc_ids),
+        struct.pack(f'<{len(record_offsets)}Q', *record_offsets),
+        bytes(records),
+    ]
+    offsets = []
+    body = bytearray()
+    for section in sections:
+        body += b'\x00' * (-(HEADER.size + len(body)) % 8)
+        offsets.append(HEADER.size + len(body))
+        body += section
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(doc_ids), *offsets))
+        f.write(body)
+    os.replace(tmp_path, output_path)
+
+
+def build_doc_store(pages_dir='pages', index_file='index.txt', output_path=DOC_STORE_PATH, workers=1,
+                    exclude=(), changed=None):
+    """
+    Собирает хранилище документов при индексации
+
+    Заголовок и текст берутся из pages/page_N/document.json, который пишет
+    токенизатор, а леммы слов — из lemmas.txt, поэтому запускать после
+    токенизации.
+
+    :param exclude: doc_id страниц, которые не индексируются (например, почти-дубликаты)
+    :param changed: doc_id изменённых страниц; записи остальных страниц
+        копируются из существующего хранилища без распаковки (None — собрать заново)
+    """
+    urls = load_urls(index_file)
+    exclude = set(exclude)
+    pages = [(doc_id, path, os.path.join(pages_dir, f'page_{doc_id}'))
+             for doc_id, path in iter_html_pages(pages_dir) if doc_id not in exclude]
+
+    compressed = {}
+    if changed is not None and os.path.exists(output_path):
+        store = DocStore(output_path)
+        try:
+            for doc_id, _, _ in pages:
+                if doc_id not in changed:
+                    record = store.record(doc_id)
+                    if record is not None:
+                        compressed[doc_id] = record
+        finally:
+            store.close()
+    pages = [page for page in pages if page[0] not in compressed]
+
+    if workers > 1 and len(pages) > 1:
+        with Pool(processes=min(workers, len(pages))) as pool:
+            extracted = pool.imap(_extract_task, pages, chunksize=4)
+            documents = dict(extracted)
+    else:
+        documents = dict(map(_extract_task, pages))
+    for doc_id, document in documents.items():
+        document['url'] = urls.get(doc_id, '')
+        compressed[doc_id] = zlib.compress(json.dumps(document, ensure_ascii=False).encode('utf-8'), 6)
+    _write_records(output_path, compressed)
+    print(f"Stored {len(compressed)} documents in {output_path} ({len(documents)} updated, "
+          f"{os.path.getsize(output_path)} bytes)")
+
+
+class DocStore:
+    """Хранилище документов, открытое через mmap"""
+
+    def __init__(self, path=DOC_STORE_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, doc_ids_at, offsets_at, self._records = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: неизвестный формат хранилища документов')
+        view = memoryview(self._mm)
+        self.doc_ids = view[doc_ids_at:doc_ids_at + 4 * self.n_docs].cast('i')
+        self._offsets = view[offsets_at:offsets_at + 8 * (self.n_docs + 1)].cast('Q')
+
+    def close(self):
+        self.doc_ids.release()
+        self._offsets.release()
+        self._mm.close()
+
+    def record(self, doc_id):
+        """Сжатая запись документа (байты zlib) или None"""
+        i = bisect_left(self.doc_ids, doc_id)
+        if i == self.n_docs or self.doc_ids[i] != doc_id:
+            return None
+        start = self._records + self._offsets[i]
+        end = self._records + self._offsets[i + 1]
+        return self._mm[start:end]
+
+    def get(self, doc_id):
+        """Запись документа {"title", "url", "summary", "text", "lemmas"} или None"""
+        record = self.record(doc_id)
+        return json.loads(zlib.decompress(record)) if record is not None else None
+
+
+def make_snippet(text, lemmas, lemma_of, width=SNIPPET_WORDS, fallback=''):
+    """
+    Фрагмент текста с подсвеченными словами запроса
+
+    Выбирается окно из width слов с наибольшим числом разных лемм
+    запроса (при равенстве — с большим числом совпадений).
+
+    :param lemmas: множество лемм запроса
+    :param lemma_of: функция слово -> лемма (например, lemmas_map.get)
+    :param fallback: текст, если в документе нет слов запроса
+    :return: Markup с <mark> вокруг совпадений, остальное экранировано
+    """
+    # Текст уже нормализован extract_document: слова разделены одним пробелом
+    words = text.split()
+    hits = []
+    # Слова повторяются: нормализация и lemma_of выполняются один раз на слово
+    known = {}
+    for i, word in enumerate(words):
+        lemma = known.get(word, known)
+        if lemma is known:
+            token = _NON_WORD.sub('', word).lower()
+            lemma = lemma_of(token) if token else None
+            known[word] = lemma = lemma if lemma in lemmas else None
+        if lemma is not None:
+            hits.append((i, lemma))
+    if not hits:
+        return escape(fallback)
+
+    # Скользящее окно по позициям совпадений: счётчики лемм обновляются
+    # на входе и выходе совпадения
+    best_start, best_key = 0, (-1, -1)
+    counts = {}
+    left = 0
+    for right, (end, lemma) in enumerate(hits):
+        counts[lemma] = counts.get(lemma, 0) + 1
+        while hits[left][0] <= end - width:
+            old = hits[left][1]
+            counts[old] -= 1
+            if not counts[old]:
+                del counts[old]
+            left += 1
+        key = (len(counts), right - left + 1)
+        if key > best_key:
+            best_start, best_key = max(end - width + 1, 0), key
+
+    marked = {i for i, _ in hits}
+    parts = []
+    for i in range(best_start, min(best_start + width, len(words))):
+        word = escape(words[i])
+        parts.append(Markup('<mark>{}</mark>').format(word) if i in marked else word)
+    snippet = Markup(' ').join(parts)
+    if best_start > 0:
+        snippet = Markup('… ') + snippet
+    if best_start + width < len(words):
+        snippet += Markup(' …')
+    return snippet
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сборка хранилища документов для сниппетов')
+    parser.add_argument('pages_dir', nargs='?', default='pages')
+    parser.add_argument('--index-file', default='index.txt')
+    parser.add_argument('--output', default=DOC_STORE_PATH)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    build_doc_store(args.pages_dir, args.index_file, args.output, args.workers, exclude=read_duplicate_ids())
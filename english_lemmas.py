@@ -0,0 +1,160 @@
+import os
+import re
+import argparse
+from bs4 import BeautifulSoup
+from spacy.lookups import load_lookups
+from doc_store import iter_html_pages
+from normalizer import BASE_WORDS, ENGLISH_LEMMAS, LEMMAS_SEED, PROPER_NOUNS, TOKENS_SEED, read_seed_lemmas, \
+    read_words
+
+# Части речи правил лемматизатора spaCy в порядке перебора для слова вне индекса лемм
+POS_ORDER = ('noun', 'verb', 'adj', 'adv')
+# Логарифм вероятности слова, которого нет в таблице lexeme_prob (как oov_prob в spaCy)
+OOV_PROB = -20.0
+# Слово с заглавной буквы считается именем собственным, если в корпусе
+# spaCy оно встречается с заглавной хотя бы в e^1 ≈ 2.7 раза чаще
+PROPER_PROB_MARGIN = 1.0
+
+
+class RuleLemmatizer:
+    """
+    Лемматизатор по таблицам spaCy (spacy-lookups-data): индекс лемм WordNet,
+    исключения и правила отбрасывания окончаний по частям речи
+
+    Нужен только для предвычисления english_lemmas.txt и proper_nouns.txt —
+    загрузка таблицы нормализации spaCy не импортирует. Теггера нет, поэтому
+    часть речи выбирается так: окончание отбрасывается, только если
+    результат есть в индексе лемм этой части речи, а слово, которое само
+    есть в индексе существительных (string, feed, provider), считается
+    формой множественного числа или глагола только если лемма-кандидат
+    встречается чаще него (days -> day, found -> find, но species, mass
+    остаются собой).
+    """
+
+    def __init__(self):
+        lookups = load_lookups('en', ['lemma_index', 'lemma_exc', 'lemma_rules', 'lexeme_prob'])
+        # Ключи таблиц spaCy — хэши строк, поэтому части речи берутся по имени
+        self.index = {pos: set(lookups.get_table('lemma_index').get(pos, ())) for pos in POS_ORDER}
+        self.exceptions = {pos: lookups.get_table('lemma_exc').get(pos, {}) for pos in POS_ORDER}
+        self.rules = {pos: lookups.get_table('lemma_rules').get(pos, []) for pos in POS_ORDER}
+        self.probs = lookups.get_table('lexeme_prob')
+
+    def prob(self, word):
+        prob = self.probs.get(word)
+        return OOV_PROB if prob is None else prob
+
+    def forms(self, word, pos):
+        """Леммы-кандидаты слова для части речи: исключения, затем правила с проверкой по индексу"""
+        forms = list(self.exceptions[pos].get(word, []))
+        for old, new in self.rules[pos]:
+            if word.endswith(old) and len(word) > len(old):
+                form = word[:len(word) - len(old)] + new
+                if form in self.index[pos] and form not in forms:
+                    forms.append(form)
+        return forms
+
+    def _more_frequent(self, word, forms):
+        return [form for form in forms if self.prob(form) > self.prob(word)]
+
+    def lemma(self, word):
+        if word in self.index['noun']:
+            forms = self._more_frequent(word, self.exceptions['verb'].get(word, []))
+            if not forms and word.endswith('s'):
+                forms = self._more_frequent(word, self.forms(word, 'noun'))
+            return forms[0] if forms else word
+        if word in self.exceptions['verb']:
+            return self.exceptions['verb'][word][0]
+        if word in self.index['verb']:
+            return word
+        if word in self.index['adj'] or word in self.index['adv']:
+            # Причастия (accepted, interesting) WordNet держит как прилагательные
+            for pos in ('verb', 'adj') if word.endswith(('ed', 'ing')) else ('adj',):
+                forms = self.forms(word, pos)
+                if forms:
+                    return forms[0]
+            return word
+        for pos in POS_ORDER:
+            forms = self.forms(word, pos)
+            if forms:
+                return forms[0]
+        return word
+
+    def is_proper(self, word):
+        return self.prob(word.capitalize()) - self.prob(word) >= PROPER_PROB_MARGIN
+
+
+def capitalized_words(pages_dir='pages'):
+    """
+    Слова корпуса (в нижнем регистре), которые встречаются только с заглавной
+    буквы и не в начале предложения
+    """
+    capitalized, lowercase = set(), set()
+    for _, path in iter_html_pages(pages_dir):
+        with open(path, 'r', encoding='utf-8') as f:
+            text = BeautifulSoup(f, 'html.parser').get_text()
+        for line in text.splitlines():
+            matches = list(re.finditer(r'[A-Za-z]+', line))
+            # Заголовки и пункты меню пишутся с заглавных — по ним не судим
+            heading = 2 * sum(m.group()[0].isupper() for m in matches) > len(matches)
+            for m in matches:
+                word = m.group()
+                if word.islower():
+                    lowercase.add(word)
+                elif not heading and word[0].isupper() and word[1:].islower():
+                    before = line[:m.start()].rstrip()
+                    if before and before[-1] not in '.!?:;"\'(':
+                        capitalized.add(word.lower())
+    return capitalized - lowercase
+
+
+def build_english_lemmas(words, lemmatizer, seed_lemmas=None, output_path=ENGLISH_LEMMAS):
+    """
+    Записывает леммы слов в формате lemmas_common.txt ("лемма слово слово ...")
+
+    Слова, у которых уже есть лемма в seed_lemmas (леммы корпуса), пропускаются.
+    """
+    seed_lemmas = seed_lemmas or {}
+    groups = {}
+    for word in words:
+        if word not in seed_lemmas:
+            groups.setdefault(lemmatizer.lemma(word), set()).add(word)
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for lemma, forms in sorted(groups.items()):
+            f.write(f"{lemma} {' '.join(sorted(forms))}\n")
+    os.replace(tmp_path, output_path)
+    return len(groups)
+
+
+def build_proper_nouns(words, lemmatizer, pages_dir='pages', output_path=PROPER_NOUNS):
+    """
+    Записывает имена собственные корпуса: слова словаря, которые в страницах
+    встречаются только с заглавной буквы внутри предложения и в корпусе
+    spaCy заметно чаще пишутся с заглавной (parker, miller, boston)
+    """
+    proper = sorted(word for word in capitalized_words(pages_dir) & words
+                    if lemmatizer.is_proper(word) and word not in lemmatizer.index['adv'])
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for word in proper:
+            f.write(f"{word}\n")
+    os.replace(tmp_path, output_path)
+    return len(proper)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Предвычисление лемм общего словаря и списка имён собственных (нужны spaCy '
+                    'и spacy-lookups-data; normalizer.py их не импортирует)')
+    parser.add_argument('--words', nargs='+', default=[BASE_WORDS, TOKENS_SEED], help='слова для лемматизации')
+    parser.add_argument('--lemmas', nargs='*', default=[LEMMAS_SEED], help='леммы корпуса — они важнее')
+    parser.add_argument('--pages', default='pages', help='каталог страниц для поиска имён собственных')
+    parser.add_argument('--output', default=ENGLISH_LEMMAS)
+    parser.add_argument('--proper-output', default=PROPER_NOUNS)
+    args = parser.parse_args()
+    lemmatizer = RuleLemmatizer()
+    seed_lemmas = read_seed_lemmas(args.lemmas)
+    words = read_words(args.words) | set(seed_lemmas)
+    n_lemmas = build_english_lemmas(words, lemmatizer, seed_lemmas, args.output)
+    n_proper = build_proper_nouns(words, lemmatizer, args.pages, args.proper_output)
+    print(f"{n_lemmas} lemmas saved to {args.output}, {n_proper} proper nouns saved to {args.proper_output}")
@@ -0,0 +1,241 @@
+import gc
+import time
+import logging
+import threading
+from query_cache import index_version
+
+logger = logging.getLogger(__name__)
+# Заменённое поколение закрывается, когда его отпустит последний запрос;
+# запрос, который держит его дольше этого (в секундах), считается зависшим,
+# и поколение закрывается всё равно
+RETIRE_TIMEOUT = 600.0
+
+
+class IndexReloader:
+    """
+    Текущее поколение индекса с подменой после пересборки
+
+    Поколение — любой объект, который возвращает load() (например, набор
+    движков поиска). Запрос берёт поколение один раз через acquire,
+    работает с ним до конца и отпускает через release, поэтому подмена
+    ссылки атомарна: начатые запросы дорабатывают на старом поколении,
+    новые получают новое. Заменённое поколение закрывается функцией close,
+    когда его отпустит последний запрос (или сразу, если запросов на нём
+    нет): она закрывает mmap-файлы и разрывает циклические ссылки, поэтому
+    поколение освобождается счётчиком ссылок. На сборщик мусора полагаться
+    нельзя: после gc.freeze() в serve.py поколение, загруженное до fork,
+    лежит в постоянном поколении сборщика и им не просматривается. Если
+    запрос держит заменённое поколение дольше retire_timeout секунд, оно
+    закрывается с предупреждением в логе.
+
+    Новое поколение определяется по штампу index_version файлов paths.
+    Загрузка идёт в фоновом потоке и начинается, только когда штамп не
+    меняется между двумя проверками (пересборка закончила писать файлы).
+    Ошибка загрузки записывается в лог, а запросы продолжают обслуживаться
+    текущим поколением.
+
+    Проверка запускается из обработчика запроса (maybe_reload), а не
+    отдельным потоком-наблюдателем: потоки не переживают fork, а так
+    каждый воркер serve.py следит за индексом сам. По той же причине
+    обработчик сигнала только ставит флаг (request_reload), а загрузку
+    запускает следующий maybe_reload.
+
+    :param load: функция без аргументов, загружающая поколение
+    :param paths: файлы индекса, изменение которых означает новое поколение
+    :param interval: как часто (в секундах) проверять файлы
+    :param close: функция, закрывающая заменённое поколение (или None)
+    :param retire_timeout: через сколько секунд закрыть заменённое поколение,
+        даже если его ещё держат запросы
+    """
+
+    def __init__(self, load, paths, interval=5.0, close=None, retire_timeout=RETIRE_TIMEOUT):
+        self.load = load
+        self.paths = tuple(paths)
+        self.interval = interval
+        self.close = close
+        self.retire_timeout = retire_timeout
+        self.generation = 0
+        self.reloads = 0
+        self.failures = 0
+        self._current = None
+        self._stamp = None
+        self._pending = None
+        self._failed = None
+        self._checked = 0.0
+        self._loading = None
+        self._requested = False
+        # Число запросов на поколении: {id(поколение): число}
+        self._uses = {}
+        # Заменённые поколения, которые ещё держат запросы: (крайний срок закрытия, поколение)
+        self._retired = []
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """
+        Текущее поколение; при первом обращении загружается синхронно
+
+        Обращение не учитывается в числе запросов на поколении: запросы
+        берут поколение через acquire.
+        """
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    stamp = self.stamp()
+                    self._current = self.load()
+                    self._stamp = stamp
+                    self.generation += 1
+                current = self._current
+        return current
+
+    def acquire(self):
+        """Текущее поколение для запроса; после запроса его нужно отпустить через release"""
+        self.current
+        with self._lock:
+            generation = self._current
+            self._uses[id(generation)] = self._uses.get(id(generation), 0) + 1
+        return generation
+
+    def release(self, generation):
+        """Отпускает поколение, взятое acquire; заменённое поколение без запросов закрывается"""
+        with self._lock:
+            key = id(generation)
+            uses = self._uses.get(key)
+            if uses is None:
+                # Закрыто по retire_timeout, пока запрос его держал
+                return
+            if uses > 1:
+                self._uses[key] = uses - 1
+                return
+            del self._uses[key]
+            retired = [entry for entry in self._retired if entry[1] is generation]
+            for entry in retired:
+                self._retired.remove(entry)
+        if retired:
+            self._close(generation)
+
+    def stamp(self):
+        return index_version(*self.paths)
+
+    def request_reload(self):
+        """
+        Просит загрузить поколение заново при следующем maybe_reload
+
+        Только ставит флаг, поэтому безопасна в обработчике сигнала: он
+        выполняется в главном потоке между байт-кодами, возможно, пока тот
+        держит блокировку.
+        """
+        self._requested = True
+
+    def maybe_reload(self):
+        """
+        Проверяет файлы индекса не чаще раза в interval секунд
+
+        Не блокирует вызывающего: загрузка нового поколения идёт в фоне.
+        Заодно закрывает заменённые поколения, у которых истёк retire_timeout.
+        :return: True, если запущена загрузка
+        """
+        now = time.monotonic()
+        if self._retired and self._retired[0][0] <= now:
+            self._close_overdue(now)
+        requested = self._requested
+        if (not requested and now - self._checked < self.interval) or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked = now
+            if self._loading is not None or self._current is None:
+                return False
+            stamp = self.stamp()
+            if requested:
+                self._requested = False
+                self._start(stamp)
+                return True
+            if stamp == self._stamp or stamp == self._failed:
+                self._pending = None
+                return False
+            if stamp != self._pending:
+                # Файлы ещё могут дописываться: ждём следующей проверки
+                self._pending = stamp
+                return False
+            self._start(stamp)
+            return True
+        finally:
+            self._lock.release()
+
+    def reload(self, wait=False):
+        """
+        Принудительно загружает поколение заново
+
+        Берёт блокировку, поэтому из обработчика сигнала вызывается
+        request_reload.
+
+        :param wait: дождаться окончания загрузки
+        :return: поток загрузки или None, если загрузка уже идёт
+        """
+        with self._lock:
+            thread = None
+            if self._loading is None and self._current is not None:
+                thread = self._start(self.stamp())
+        if wait and thread is not None:
+            thread.join()
+        return thread
+
+    def _start(self, stamp):
+        self._pending = None
+        self._loading = threading.Thread(target=self._reload, args=(stamp,), name='index-reload', daemon=True)
+        self._loading.start()
+        return self._loading
+
+    def _reload(self, stamp):
+        start = time.perf_counter()
+        try:
+            current = self.load()
+        except Exception:
+            logger.exception('index reload failed, keeping generation %d', self.generation)
+            with self._lock:
+                self._failed = stamp
+                self.failures += 1
+                self._loading = None
+            return
+
+        unused = None
+        with self._lock:
+            previous = self._current
+            if previous is not None and self.close is not None:
+                if self._uses.get(id(previous)):
+                    self._retired.append((time.monotonic() + self.retire_timeout, previous))
+                else:
+                    unused = previous
+            self._current = current
+            self._stamp = stamp
+            self._failed = None
+            self.generation += 1
+            self.reloads += 1
+            self._loading = None
+        logger.info('index generation %d loaded in %.1f s', self.generation, time.perf_counter() - start)
+        if unused is not None:
+            self._close(unused)
+
+    def _close_overdue(self, now):
+        """Закрывает заменённые поколения, которые запросы держат дольше retire_timeout"""
+        overdue = []
+        with self._lock:
+            while self._retired and self._retired[0][0] <= now:
+                _, generation = self._retired.pop(0)
+                uses = self._uses.pop(id(generation), 0)
+                overdue.append((uses, generation))
+        for uses, generation in overdue:
+            logger.warning('closing a retired index generation still used by %d requests after %.0f s',
+                           uses, self.retire_timeout)
+            self._close(generation)
+
+    def _close(self, generation):
+        try:
+            self.close(generation)
+        except Exception:
+            logger.exception('closing a retired index generation failed')
+        del generation
+        # Остаток, не освобождённый счётчиком ссылок (поколения, загруженные
+        # после fork, сборщик видит)
+        gc.collect()
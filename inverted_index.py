@@ -1,35 +1,90 @@
 import os
 from collections import defaultdict
-from nltk.stem import WordNetLemmatizer
+from manifest import MANIFEST_PATH, load_manifest, diff_stage, commit_stage, page_doc_id
+from page_files import DUPLICATES_PATH, read_duplicate_ids
 
-lemmatizer = WordNetLemmatizer()
 
+def _read_page_lemmas(lemmas_path):
+    lemmas = []
+    with open(lemmas_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) < 2:
+                continue
+            lemmas.append(parts[0])
+    return lemmas
 
-def build_inverted_index_txt(pages_dir='pages', output_file='inverted_index.txt'):
-    inverted_index = defaultdict(list)
 
+def _page_inputs(pages_dir, exclude=()):
+    inputs = {}
     for page_dir in os.listdir(pages_dir):
-        if not page_dir.startswith('page_'):
+        if not page_dir.startswith('page_') or page_dir.endswith('.html') or page_doc_id(page_dir) in exclude:
             continue
-
-        page_num = int(page_dir.split('_')[1])
         lemmas_path = os.path.join(pages_dir, page_dir, 'lemmas.txt')
-
         if os.path.exists(lemmas_path):
-            with open(lemmas_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) < 2:
-                        continue
-                    lemma = parts[0]
-                    inverted_index[lemma].append(page_num)
-
-    with open(output_file, 'w', encoding='utf-8') as f:
+            inputs[page_dir] = lemmas_path
+    return inputs
+
+
+def load_inverted_index_txt(index_file='inverted_index.txt'):
+    """Загружает inverted_index.txt в словарь {лемма: множество doc_id}"""
+    inverted_index = defaultdict(set)
+    with open(index_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or ':' not in line:
+                continue
+            term, doc_ids = line.split(':', 1)
+            inverted_index[term].update(map(int, doc_ids.split(',')))
+    return inverted_index
+
+
+def _write_inverted_index_txt(inverted_index, output_file):
+    tmp_file = f'{output_file}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
         for term in sorted(inverted_index.keys()):
+            if not inverted_index[term]:
+                continue
             doc_ids = ','.join(map(str, sorted(set(inverted_index[term]))))
             f.write(f"{term}:{doc_ids}\n")
+    os.replace(tmp_file, output_file)
+
+
+def build_inverted_index_txt(pages_dir='pages', output_file='inverted_index.txt', full=False,
+                             manifest_path=MANIFEST_PATH, duplicates_path=DUPLICATES_PATH):
+    """
+    Строит inverted_index.txt по файлам lemmas.txt
+
+    Если индекс уже существует, он патчится: из постингов удаляются
+    изменённые и удалённые страницы, затем добавляются леммы изменённых.
+    Неизменённые страницы не перечитываются. Почти-дубликаты из
+    duplicates_path считаются удалёнными страницами.
+    """
+    manifest = load_manifest(manifest_path)
+    inputs = _page_inputs(pages_dir, read_duplicate_ids(duplicates_path))
+    changed, deleted, entries = diff_stage(manifest, 'inverted_index', inputs)
+
+    if full or not os.path.exists(output_file) or 'inverted_index' not in manifest['stages']:
+        inverted_index = defaultdict(set)
+        changed, removed = set(inputs), set()
+    else:
+        inverted_index = load_inverted_index_txt(output_file)
+        removed = {page_doc_id(page_name) for page_name in changed | deleted}
+        if removed:
+            for doc_ids in inverted_index.values():
+                doc_ids -= removed
+
+    for page_name in changed:
+        page_num = page_doc_id(page_name)
+        for lemma in _read_page_lemmas(inputs[page_name]):
+            inverted_index[lemma].add(page_num)
+
+    if changed or removed or not os.path.exists(output_file):
+        _write_inverted_index_txt(inverted_index, output_file)
+    commit_stage(manifest, 'inverted_index', entries, manifest_path)
 
     return inverted_index
 
 
-inverted_index = build_inverted_index_txt()
\ No newline at end of file
+if __name__ == '__main__':
+    inverted_index = build_inverted_index_txt()
@@ -0,0 +1,313 @@
+import os
+import mmap
+import struct
+import logging
+import argparse
+import numpy as np
+from scipy import sparse
+from compact_index import COMPACT_INDEX_PATH, CompactIndex, _Strings, _pack_strings
+from tf_idf import safe_idf
+
+logger = logging.getLogger(__name__)
+LSA_INDEX_PATH = 'lsa.bin'
+# Размерность латентного пространства
+LSA_RANK = 100
+# Сколько документов можно добавить обновлением модели (доля от числа
+# документов последней полной подгонки), прежде чем подогнать её заново
+LSA_REFIT_FRACTION = 0.25
+# Столько строк матрицы документов умножается за раз при поиске top-k
+LSA_BLOCK = 65536
+# Столько новых документов добавляется в разложение за один шаг обновления
+LSA_UPDATE_BATCH = 256
+
+MAGIC = b'OIPLSA\x00\x01'
+# magic, n_docs, n_terms, rank, документов при полной подгонке, добавлено с тех пор, 7 смещений секций
+HEADER = struct.Struct('<8sIIIII7Q')
+SECTIONS = ('doc_ids', 'term_offsets', 'term_blob', 'idf', 'singular_values', 'term_vectors',
+            'doc_vectors')
+
+
+def term_document_matrix(index):
+    """
+    Разреженная матрица термин × документ из бинарного индекса
+
+    В ячейках — TF-IDF веса, столбцы нормированы по L2 (как в косинусной
+    близости), чтобы длинные документы не определяли латентные оси.
+    :return: матрица CSR формы (n_terms, n_docs)
+    """
+    doc_ids = np.frombuffer(index.doc_ids, dtype=np.int32)
+    norms = np.frombuffer(index.norms, dtype=np.float64)
+    inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    indptr = np.zeros(index.n_terms + 1, dtype=np.int64)
+    cols, data = [], []
+    for term_id in range(index.n_terms):
+        postings = index.term_weights(term_id)
+        indptr[term_id + 1] = indptr[term_id] + len(postings)
+        cols.extend(doc_id for doc_id, _ in postings)
+        data.extend(weight for _, weight in postings)
+    cols = np.searchsorted(doc_ids, np.array(cols, dtype=np.int32))
+    data = np.array(data, dtype=np.float64) * inv_norms[cols]
+    return sparse.csr_matrix((data, cols, indptr), shape=(index.n_terms, index.n_docs))
+
+
+def randomized_svd(matrix, rank, oversample=10, n_iter=4, seed=0):
+    """
+    Усечённое SVD рандомизированным методом (Halko, Martinsson, Tropp)
+
+    Базис образа матрицы ищется по её произведению на случайную матрицу,
+    уточняется степенными итерациями (с ортогонализацией на каждом шаге),
+    а точное SVD считается уже для малой проекции. Нужны только
+    произведения матрицы на плотные блоки, поэтому матрица может быть
+    разреженной.
+
+    :return: (U, S) — левые сингулярные векторы (n_rows × rank) и сингулярные числа
+    """
+    rank = min(rank, *matrix.shape)
+    size = min(rank + oversample, *matrix.shape)
+    rng = np.random.default_rng(seed)
+    basis, _ = np.linalg.qr(matrix @ rng.standard_normal((matrix.shape[1], size)))
+    for _ in range(n_iter):
+        basis, _ = np.linalg.qr(matrix.T @ basis)
+        basis, _ = np.linalg.qr(matrix @ basis)
+    u, s, _ = np.linalg.svd((matrix.T @ basis).T, full_matrices=False)
+    return basis @ u[:, :rank], s[:rank]
+
+
+def update_svd(u, s, columns):
+    """
+    Дополняет усечённое SVD новыми столбцами матрицы (обновление Brand)
+
+    Новые столбцы раскладываются на часть в текущем базисе и ортогональный
+    остаток; SVD малой матрицы (rank + c) × (rank + c) поворачивает
+    расширенный базис, и он снова усекается до rank.
+    :param columns: плотная матрица новых столбцов (n_rows × c)
+    :return: (U, S) обновлённого разложения
+    """
+    rank = len(s)
+    projection = u.T @ columns
+    residual, triangle = np.linalg.qr(columns - u @ projection)
+    middle = np.block([[np.diag(s), projection],
+                       [np.zeros((triangle.shape[0], rank)), triangle]])
+    u_middle, s_new, _ = np.linalg.svd(middle, full_matrices=False)
+    u_new = np.hstack([u, residual]) @ u_middle[:, :rank]
+    return u_new, s_new[:rank]
+
+
+def build_lsa_index(compact_path=COMPACT_INDEX_PATH, output_path=LSA_INDEX_PATH, rank=LSA_RANK,
+                    refit=False, seed=0):
+    """
+    Строит или обновляет латентную семантическую модель (LSA) по бинарному индексу
+
+    Если модель уже есть, её документы — подмножество индекса и добавлено
+    не больше LSA_REFIT_FRACTION документов, базис обновляется только
+    столбцами новых документов (update_svd), без полной подгонки. Веса
+    старых документов при этом не пересчитываются в базисе, но проекции
+    всех документов считаются заново, так что изменившиеся страницы
+    получают верные векторы.
+
+    :param refit: всегда подгонять модель заново
+    :return: 'fit' или 'update'
+    """
+    index = CompactIndex(compact_path)
+    try:
+        matrix = term_document_matrix(index)
+        doc_ids = np.frombuffer(index.doc_ids, dtype=np.int32).copy()
+        terms = list(index.terms)
+        idf = np.array([safe_idf(index.df(term_id), index.n_docs) for term_id in range(index.n_terms)],
+                       dtype=np.float32)
+    finally:
+        index.close()
+
+    previous = None
+    if not refit and os.path.exists(output_path):
+        try:
+            previous = LsaIndex(output_path)
+        except ValueError:
+            previous = None
+
+    mode = 'fit'
+    if previous is not None:
+        try:
+            old_ids = np.frombuffer(previous.doc_ids, dtype=np.int32)
+            new_docs = ~np.isin(doc_ids, old_ids)
+            n_new = int(new_docs.sum())
+            if (previous.rank == min(rank, *matrix.shape) and np.isin(old_ids, doc_ids).all()
+                    and previous.n_added + n_new <= LSA_REFIT_FRACTION * previous.n_fitted):
+                # Строки базиса переносятся по терминам; новые термины получают нулевые строки
+                u = np.zeros((len(terms), previous.rank))
+                rows = [previous.term_id(term) for term in terms]
+                known = np.array([row >= 0 for row in rows], dtype=bool)
+                u[known] = previous.term_vectors[[row for row in rows if row >= 0]]
+                s = np.array(previous.singular_values, dtype=np.float64)
+                new_columns = np.flatnonzero(new_docs)
+                for start in range(0, n_new, LSA_UPDATE_BATCH):
+                    batch = new_columns[start:start + LSA_UPDATE_BATCH]
+                    u, s = update_svd(u, s, matrix[:, batch].toarray())
+                n_fitted, n_added, mode = previous.n_fitted, previous.n_added + n_new, 'update'
+        finally:
+            previous.close()
+    if mode == 'fit':
+        u, s = randomized_svd(matrix, rank, seed=seed)
+        n_fitted, n_added = len(doc_ids), 0
+
+    # Документ в латентном пространстве — проекция его столбца на базис U,
+    # нормированная по L2: скалярное произведение тогда равно косинусу
+    doc_vectors = np.asarray(matrix.T @ u, dtype=np.float64)
+    norms = np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+    doc_vectors = np.divide(doc_vectors, norms, out=np.zeros_like(doc_vectors), where=norms > 0)
+
+    term_offsets, term_blob = _pack_strings(terms)
+    sections = {
+        'doc_ids': doc_ids.astype('<i4').tobytes(),
+        'term_offsets': term_offsets,
+        'term_blob': term_blob,
+        'idf': idf.astype('<f4').tobytes(),
+        'singular_values': s.astype('<f8').tobytes(),
+        'term_vectors': u.astype('<f4').tobytes(),
+        'doc_vectors': doc_vectors.astype('<f4').tobytes(),
+    }
+    offsets = []
+    body = bytearray()
+    for name in SECTIONS:
+        body += b'\x00' * (-(HEADER.size + len(body)) % 8)
+        offsets.append(HEADER.size + len(body))
+        body += sections[name]
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(doc_ids), len(terms), len(s), n_fitted, n_added, *offsets))
+        f.write(body)
+    os.replace(tmp_path, output_path)
+    return mode
+
+
+class LsaIndex:
+    """
+    Латентная семантическая модель, открытая через mmap
+
+    Документы хранятся плотными векторами float32 единичной длины, поэтому
+    косинусная близость к запросу — произведение матрицы документов на
+    вектор запроса. Запрос переводится в латентное пространство через
+    строки базиса U для его лемм (с весами IDF), так что документ может
+    найтись по синонимам, которых в нём нет.
+    """
+
+    def __init__(self, path=LSA_INDEX_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.rank, self.n_fitted, self.n_added, *offsets = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f'{path}: неизвестный формат латентной модели')
+
+        bounds = dict(zip(SECTIONS, offsets))
+
+        def section(name, dtype, count):
+            return np.frombuffer(self._mm, dtype=dtype, count=count, offset=bounds[name])
+
+        self.doc_ids = section('doc_ids', '<i4', self.n_docs)
+        self._term_offsets = section('term_offsets', '<u8', self.n_terms + 1)
+        self.idf = section('idf', '<f4', self.n_terms)
+        self.singular_values = section('singular_values', '<f8', self.rank)
+        self.term_vectors = section('term_vectors', '<f4', self.n_terms * self.rank).reshape(self.n_terms, self.rank)
+        self.doc_vectors = section('doc_vectors', '<f4', self.n_docs * self.rank).reshape(self.n_docs, self.rank)
+        self._term_blob = bounds['term_blob']
+        self.terms = _Strings(self.term, self.n_terms)
+
+    def close(self):
+        # Массивы numpy держат ссылку на mmap: закрыть его можно, только отпустив их
+        self.doc_ids = self._term_offsets = self.idf = self.singular_values = None
+        self.term_vectors = self.doc_vectors = None
+        # Разрывает цикл модель <-> _Strings(self.term)
+        self.terms = None
+        try:
+            self._mm.close()
+        except BufferError:
+            # Кто-то ещё держит массив поверх mmap: файл останется открытым до его освобождения
+            logger.exception('%s: mmap still exported, not closed', self.path)
+
+    def term(self, term_id):
+        start, end = self._term_offsets[term_id], self._term_offsets[term_id + 1]
+        return self._mm[self._term_blob + start:self._term_blob + end].decode('utf-8')
+
+    def term_id(self, term):
+        """Номер термина в словаре модели или -1"""
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_terms and self.term(lo) == term else -1
+
+    def query_vector(self, lemma_counts):
+        """
+        Вектор запроса в латентном пространстве единичной длины
+
+        :param lemma_counts: {лемма: число вхождений в запрос}
+        :return: массив длины rank или None, если ни одной леммы нет в модели
+        """
+        vector = np.zeros(self.rank, dtype=np.float32)
+        for lemma, count in lemma_counts.items():
+            term_id = self.term_id(lemma)
+            if term_id >= 0:
+                vector += count * self.idf[term_id] * self.term_vectors[term_id]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def scores(self, query_vector, doc_ids):
+        """Латентная близость запроса к документам doc_ids (0 для документов вне модели)"""
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        rows = np.minimum(np.searchsorted(self.doc_ids, doc_ids), max(self.n_docs - 1, 0))
+        found = self.doc_ids[rows] == doc_ids if self.n_docs else np.zeros(len(doc_ids), dtype=bool)
+        scores = np.zeros(len(doc_ids), dtype=np.float32)
+        scores[found] = self.doc_vectors[rows[found]] @ query_vector
+        return scores
+
+    def search(self, query_vectors, top_n):
+        """
+        Пакетный top-k по косинусной близости
+
+        Матрица документов умножается на матрицу запросов блоками по
+        LSA_BLOCK строк; из каждого блока для каждого запроса остаются
+        top_n лучших (argpartition), и они сливаются в конце.
+
+        :param query_vectors: список векторов из query_vector (None — пустой результат)
+        :return: список результатов [(doc_id, скор)] в порядке запросов
+        """
+        active = [i for i, vector in enumerate(query_vectors) if vector is not None]
+        results = [[] for _ in query_vectors]
+        if not active or top_n <= 0 or self.n_docs == 0:
+            return results
+        queries = np.stack([query_vectors[i] for i in active], axis=1)
+        candidates = [[] for _ in active]
+        for start in range(0, self.n_docs, LSA_BLOCK):
+            block = self.doc_vectors[start:start + LSA_BLOCK] @ queries
+            for col in range(len(active)):
+                scores = block[:, col]
+                rows = np.argpartition(-scores, top_n)[:top_n] if len(scores) > top_n else np.arange(len(scores))
+                candidates[col].append((rows + start, scores[rows]))
+
+        for col, i in enumerate(active):
+            rows = np.concatenate([rows for rows, _ in candidates[col]])
+            scores = np.minimum(np.concatenate([scores for _, scores in candidates[col]]), 1.0)
+            mask = scores > 1e-6
+            rows, scores = rows[mask], scores[mask]
+            doc_ids = self.doc_ids[rows]
+            order = np.lexsort((doc_ids, -scores))[:top_n]
+            results[i] = [(int(doc_ids[j]), float(scores[j])) for j in order]
+        return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Латентная семантическая модель (LSA) по бинарному индексу')
+    parser.add_argument('--index', default=COMPACT_INDEX_PATH)
+    parser.add_argument('--output', default=LSA_INDEX_PATH)
+    parser.add_argument('--rank', type=int, default=LSA_RANK)
+    parser.add_argument('--refit', action='store_true', help='подогнать модель заново, а не обновить')
+    args = parser.parse_args()
+    mode = build_lsa_index(args.index, args.output, args.rank, args.refit)
+    print(f"LSA model ({mode}) saved to {args.output} ({os.path.getsize(args.output)} bytes)")
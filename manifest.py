@@ -0,0 +1,81 @@
+import os
+import json
+import hashlib
+
+MANIFEST_PATH = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Вычисляет sha256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Загружает манифест; при отсутствии или смене версии возвращает пустой"""
+    if not os.path.exists(path):
+        return {'version': MANIFEST_VERSION, 'stages': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'version': MANIFEST_VERSION, 'stages': {}}
+    manifest.setdefault('stages', {})
+    return manifest
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """Атомарно сохраняет манифест"""
+    write_json_atomic(manifest, path)
+
+
+def write_json_atomic(data, path):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def diff_stage(manifest, stage, inputs):
+    """
+    Сравнивает входные файлы этапа с записями манифеста
+
+    Файл считается неизменённым, если совпадают mtime и размер; иначе
+    пересчитывается хэш, и файл попадает в changed только при отличии хэша.
+
+    :param manifest: манифест, загруженный load_manifest
+    :param stage: имя этапа ('tokenizer', 'inverted_index', 'tf_idf')
+    :param inputs: словарь {page_name: путь к входному файлу}
+    :return: (changed, deleted, entries) — множества имён страниц и новые записи этапа
+    """
+    old_entries = manifest['stages'].get(stage, {})
+    entries = {}
+    changed = set()
+
+    for page_name, path in inputs.items():
+        stat = os.stat(path)
+        old = old_entries.get(page_name)
+        if old and old['mtime'] == stat.st_mtime and old['size'] == stat.st_size:
+            entries[page_name] = old
+            continue
+
+        digest = file_hash(path)
+        entries[page_name] = {'hash': digest, 'mtime': stat.st_mtime, 'size': stat.st_size}
+        if not old or old['hash'] != digest:
+            changed.add(page_name)
+
+    deleted = set(old_entries) - set(inputs)
+    return changed, deleted, entries
+
+
+def commit_stage(manifest, stage, entries, path=MANIFEST_PATH):
+    """Записывает новые записи этапа в манифест и сохраняет его"""
+    manifest['stages'][stage] = entries
+    save_manifest(manifest, path)
+
+
+def page_doc_id(page_name):
+    return int(page_name.split('_')[1])
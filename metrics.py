@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, в секундах
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class QueryTrace:
+    """
+    Разбивка одного запроса по этапам
+
+    Движок открывает этапы через with trace.stage(...), считает работу
+    через trace.count(...) и в конце отдаёт трассу хукам (run_hooks).
+    """
+
+    def __init__(self, engine=None, query=None):
+        self.engine = engine
+        self.query = query
+        self.plan = None
+        self.stages = {}
+        self.counters = {}
+        self.total = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        self.total = time.perf_counter() - self._start
+        return self
+
+    def to_dict(self):
+        return {
+            'engine': self.engine,
+            'query': self.query,
+            'total_ms': round(self.total * 1000, 3) if self.total is not None else None,
+            'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            'counters': self.counters,
+            'plan': self.plan,
+        }
+
+
+def run_hooks(hooks, trace):
+    """Завершает трассу и передаёт её хукам; ошибка хука не ломает поиск"""
+    trace.finish()
+    for hook in hooks:
+        try:
+            hook(trace)
+        except Exception:
+            logging.getLogger(__name__).exception('search hook failed')
+
+
+class Histogram:
+    """Кумулятивная гистограмма в формате Prometheus"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Metrics:
+    """
+    Хук, собирающий гистограммы этапов и счётчики работы поиска
+
+    Метрики хранятся в памяти процесса; при нескольких воркерах каждый
+    отдаёт на /metrics свои значения.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._stages = {}
+        self._counters = {}
+
+    def __call__(self, trace):
+        with self._lock:
+            self._histogram(self._queries, trace.engine).observe(trace.total)
+            for stage, seconds in trace.stages.items():
+                self._histogram(self._stages, (trace.engine, stage)).observe(seconds)
+            key = (trace.engine, 'queries')
+            self._counters[key] = self._counters.get(key, 0) + 1
+            for name, value in trace.counters.items():
+                key = (trace.engine, name)
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    @staticmethod
+    def _render_histogram(lines, name, histogram, **labels):
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{_labels(**labels, le=_format_bound(bound))}}} {count}')
+        lines.append(f'{name}_sum{{{_labels(**labels)}}} {histogram.sum}')
+        lines.append(f'{name}_count{{{_labels(**labels)}}} {histogram.count}')
+
+    def render(self, gauges=None):
+        """
+        Текст в формате Prometheus exposition
+
+        :param gauges: дополнительные значения {(имя, метки-словарь): число},
+            например счётчики кэшей
+        """
+        lines = []
+        with self._lock:
+            lines.append('# HELP search_query_seconds Полное время обработки запроса')
+            lines.append('# TYPE search_query_seconds histogram')
+            for engine, histogram in sorted(self._queries.items()):
+                self._render_histogram(lines, 'search_query_seconds', histogram, engine=engine)
+
+            lines.append('# HELP search_stage_seconds Время этапа обработки запроса')
+            lines.append('# TYPE search_stage_seconds histogram')
+            for (engine, stage), histogram in sorted(self._stages.items()):
+                self._render_histogram(lines, 'search_stage_seconds', histogram, engine=engine, stage=stage)
+
+            for name in sorted({name for _, name in self._counters}):
+                lines.append(f'# TYPE search_{name}_total counter')
+                for (engine, counter), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'search_{name}_total{{{_labels(engine=engine)}}} {value}')
+
+        by_name = {}
+        for (name, labels), value in (gauges or {}).items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name, samples in sorted(by_name.items()):
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                labels = _labels(**dict(labels))
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class SlowQueryLog:
+    """
+    Хук, записывающий медленные запросы с планом и разбивкой по этапам
+
+    Каждая запись — одна JSON-строка в логгере slow_queries (и в файле path,
+    если он задан).
+
+    :param threshold_ms: запросы не быстрее этого порога попадают в лог
+    """
+
+    def __init__(self, threshold_ms=200.0, path=None):
+        self.threshold_ms = threshold_ms
+        self.logger = logging.getLogger('slow_queries')
+        if path is not None and not any(getattr(h, 'baseFilename', None) == os.path.abspath(path)
+                                        for h in self.logger.handlers):
+            handler = logging.FileHandler(path, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+
+    def __call__(self, trace):
+        if trace.total * 1000 >= self.threshold_ms:
+            self.logger.warning(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
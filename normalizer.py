@@ -0,0 +1,315 @@
+import os
+import re
+import mmap
+import struct
+import hashlib
+import argparse
+from collections.abc import Mapping
+from term_dict import TermDictionary, build_trie
+
+NORMALIZER_PATH = 'normalizer.bin'
+# Общий словарь английского языка (строчные слова списка web2, из него же
+# взят список words NLTK); файлы корпуса его только дополняют
+BASE_WORDS = 'english_words.txt'
+LEMMAS_SEED = 'lemmas_common.txt'
+TOKENS_SEED = 'tokens_common.txt'
+# Леммы общего словаря и имена собственные корпуса, предвычисленные
+# english_lemmas.py по таблицам лемматизатора spaCy
+ENGLISH_LEMMAS = 'english_lemmas.txt'
+PROPER_NOUNS = 'proper_nouns.txt'
+
+MAGIC = b'OIPNRM\x00\x01'
+# magic, версия таблицы, n_words, n_lemmas, n_stopwords, n_trie_nodes, 10 смещений секций
+HEADER = struct.Struct('<8s16sIIIQ10Q')
+SECTIONS = ('word_offsets', 'word_blob', 'word_lemmas', 'lemma_offsets', 'lemma_blob',
+            'stopword_offsets', 'stopword_blob', 'trie_children', 'trie_labels', 'trie_words')
+# Индексируются только слова длиннее этого
+MIN_TOKEN_LENGTH = 3
+
+# Стоп-слова английского языка (список NLTK без форм с апострофом:
+# clean_text удаляет апострофы, и такие формы в токенах не встречаются)
+STOP_WORDS = frozenset('''
+i me my myself we our ours ourselves you your yours yourself yourselves he him his himself
+she her hers herself it its itself they them their theirs themselves what which who whom
+this that these those am is are was were be been being have has had having do does did
+doing a an the and but if or because as until while of at by for with about against
+between into through during before after above below to from up down in out on off over
+under again further then once here there when where why how all any both each few more
+most other some such no nor not only own same so than too very s t can will just don
+should now d ll m o re ve y ain aren couldn didn doesn hadn hasn haven isn ma mightn
+mustn needn shan shouldn wasn weren won wouldn
+'''.split())
+
+
+def clean_text(text):
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'\d+', '', text)
+    text = re.sub(r'[^\w\s]', '', text)
+    text = text.lower()
+    return text
+
+
+def tokenize(text):
+    tokens = re.findall(r'\b[a-zA-Z]+\b', text)
+    return tokens
+
+
+def _pack_strings(strings):
+    offsets = [0]
+    blob = bytearray()
+    for s in strings:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+    return struct.pack(f'<{len(offsets)}Q', *offsets), bytes(blob)
+
+
+def read_seed_lemmas(paths):
+    """
+    Читает словари "лемма слово слово ..." (как lemmas_common.txt) в {слово: лемма}
+
+    Лемма считается словом самой себя. Если слово встречается у разных
+    лемм, побеждает первый файл и первая строка.
+    """
+    lemmas_map = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                for word in parts[1:] + parts[:1]:
+                    lemmas_map.setdefault(word, parts[0])
+    return lemmas_map
+
+
+def read_words(paths):
+    """Слова из файлов по одному в строке (берётся первое поле строки)"""
+    words = set()
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            words.update(line.split()[0] for line in f if line.strip())
+    return words
+
+
+def build_normalizer(lemmas_files=(LEMMAS_SEED, ENGLISH_LEMMAS), tokens_files=(TOKENS_SEED,), stop_words=STOP_WORDS,
+                     output_path=NORMALIZER_PATH, base_files=(BASE_WORDS,), proper_nouns_files=(PROPER_NOUNS,)):
+    """
+    Собирает таблицу нормализации
+
+    Словарь — общий словарь base_files, дополненный словами корпуса из
+    tokens_files и lemmas_files: новые слова новых страниц, которых нет в
+    файлах корпуса, всё равно остаются в словаре. Имена собственные из
+    proper_nouns_files в словарь не попадают. Лемма слова берётся из
+    lemmas_files (леммы корпуса, затем предвычисленные english_lemmas.py),
+    слово без леммы в этих файлах считается леммой самого себя. Версия
+    таблицы — хэш её содержимого.
+    """
+    seed_lemmas = read_seed_lemmas(lemmas_files)
+    words = (read_words(base_files) | read_words(tokens_files) | set(seed_lemmas)) - read_words(proper_nouns_files)
+    lemmas_map = {word: seed_lemmas.get(word, word) for word in words}
+    words = sorted(words)
+    lemmas = sorted(set(lemmas_map.values()))
+    lemma_ids = {lemma: i for i, lemma in enumerate(lemmas)}
+    stop_words = sorted(stop_words)
+
+    digest = hashlib.sha1()
+    for word in words:
+        digest.update(f"{word} {lemmas_map.get(word, '')}\n".encode('utf-8'))
+    digest.update(' '.join(stop_words).encode('utf-8'))
+    version = digest.hexdigest()[:16]
+
+    word_offsets, word_blob = _pack_strings(words)
+    lemma_offsets, lemma_blob = _pack_strings(lemmas)
+    stopword_offsets, stopword_blob = _pack_strings(stop_words)
+    trie_children, trie_labels, trie_words = build_trie(words)
+    sections = {
+        'word_offsets': word_offsets,
+        'word_blob': word_blob,
+        'word_lemmas': struct.pack(f'<{len(words)}i', *(lemma_ids.get(lemmas_map.get(w), -1) for w in words)),
+        'lemma_offsets': lemma_offsets,
+        'lemma_blob': lemma_blob,
+        'stopword_offsets': stopword_offsets,
+        'stopword_blob': stopword_blob,
+        'trie_children': struct.pack(f'<{len(trie_children)}I', *trie_children),
+        'trie_labels': struct.pack(f'<{len(trie_labels)}I', *trie_labels),
+        'trie_words': struct.pack(f'<{len(trie_words)}i', *trie_words),
+    }
+
+    offsets = []
+    body = bytearray()
+    for name in SECTIONS:
+        body += b'\x00' * (-(HEADER.size + len(body)) % 8)
+        offsets.append(HEADER.size + len(body))
+        body += sections[name]
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, version.encode('ascii'), len(words), len(lemmas), len(stop_words),
+                            len(trie_labels), *offsets))
+        f.write(body)
+    os.replace(tmp_path, output_path)
+    return version
+
+
+class Normalizer:
+    """
+    Общая нормализация текста для индексации и запросов
+
+    Таблица (normalizer.bin) открывается через mmap за миллисекунды, без
+    сети и тяжёлых NLP-библиотек: словарь, лемма каждого слова и
+    стоп-слова предвычислены build_normalizer. Поиск слова — двоичный
+    поиск по байтам UTF-8 (их порядок совпадает с порядком строк).
+    """
+
+    def __init__(self, path=NORMALIZER_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_words, self.n_lemmas, self.n_stopwords, n_nodes, *offsets = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: неизвестный формат таблицы нормализации')
+        self.version = version.decode('ascii')
+
+        view = memoryview(self._mm)
+        bounds = dict(zip(SECTIONS, offsets))
+        sizes = {
+            'word_offsets': 8 * (self.n_words + 1),
+            'word_lemmas': 4 * self.n_words,
+            'lemma_offsets': 8 * (self.n_lemmas + 1),
+            'stopword_offsets': 8 * (self.n_stopwords + 1),
+            'trie_children': 4 * (n_nodes + 1),
+            'trie_labels': 4 * n_nodes,
+            'trie_words': 4 * n_nodes,
+        }
+
+        def section(name, fmt):
+            start = bounds[name]
+            return view[start:start + sizes[name]].cast(fmt)
+
+        self._word_offsets = section('word_offsets', 'Q')
+        self._word_lemmas = section('word_lemmas', 'i')
+        self._lemma_offsets = section('lemma_offsets', 'Q')
+        self._stopword_offsets = section('stopword_offsets', 'Q')
+        self._trie = (section('trie_children', 'I'), section('trie_labels', 'I'), section('trie_words', 'i'))
+        self._word_blob = bounds['word_blob']
+        self._lemma_blob = bounds['lemma_blob']
+        self._stopword_blob = bounds['stopword_blob']
+        self.lemmas_map = _LemmasMap(self)
+
+    def close(self):
+        # Разрывает цикл таблица <-> _LemmasMap
+        self.lemmas_map = None
+        for section in (self._word_offsets, self._word_lemmas, self._lemma_offsets,
+                        self._stopword_offsets, *self._trie):
+            section.release()
+        self._mm.close()
+
+    def _bytes(self, blob, offsets, i):
+        return self._mm[blob + offsets[i]:blob + offsets[i + 1]]
+
+    def _find(self, word, blob, offsets, count):
+        key = word.encode('utf-8')
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(blob, offsets, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < count and self._bytes(blob, offsets, lo) == key else -1
+
+    def word(self, word_id):
+        return self._bytes(self._word_blob, self._word_offsets, word_id).decode('utf-8')
+
+    def in_dictionary(self, word):
+        return self._find(word, self._word_blob, self._word_offsets, self.n_words) >= 0
+
+    def is_stopword(self, word):
+        return self._find(word, self._stopword_blob, self._stopword_offsets, self.n_stopwords) >= 0
+
+    def is_indexable(self, token):
+        """Попадает ли токен в индекс: словарное слово не короче MIN_TOKEN_LENGTH и не стоп-слово"""
+        return len(token) >= MIN_TOKEN_LENGTH and not self.is_stopword(token) and self.in_dictionary(token)
+
+    def lemma(self, word):
+        """Лемма слова или None (слова нет в словаре или у него нет леммы)"""
+        word_id = self._find(word, self._word_blob, self._word_offsets, self.n_words)
+        if word_id < 0 or self._word_lemmas[word_id] < 0:
+            return None
+        return self._bytes(self._lemma_blob, self._lemma_offsets, self._word_lemmas[word_id]).decode('utf-8')
+
+    def lemmatize(self, tokens):
+        """Группирует токены по леммам: {лемма: множество токенов}; токены без леммы пропускаются"""
+        lemmas = {}
+        for token in tokens:
+            lemma = self.lemma(token)
+            if lemma is not None:
+                lemmas.setdefault(lemma, set()).add(token)
+        return lemmas
+
+    def word_dictionary(self):
+        """Словарь слов таблицы с поиском по префиксу, шаблону и опечаткам"""
+        return TermDictionary(_Words(self), self._trie)
+
+
+class _Words:
+    """Отсортированные слова таблицы как последовательность (для bisect)"""
+
+    def __init__(self, normalizer):
+        self._normalizer = normalizer
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._normalizer.n_words:
+            raise IndexError(i)
+        return self._normalizer.word(i)
+
+    def __len__(self):
+        return self._normalizer.n_words
+
+
+class _LemmasMap(Mapping):
+    """Отображение {слово: лемма} поверх таблицы нормализации"""
+
+    def __init__(self, normalizer):
+        self._normalizer = normalizer
+
+    def __getitem__(self, word):
+        lemma = self._normalizer.lemma(word)
+        if lemma is None:
+            raise KeyError(word)
+        return lemma
+
+    def __contains__(self, word):
+        return self._normalizer.lemma(word) is not None
+
+    def __iter__(self):
+        normalizer = self._normalizer
+        return (normalizer.word(i) for i in range(normalizer.n_words) if normalizer._word_lemmas[i] >= 0)
+
+    def __len__(self):
+        return sum(1 for lemma_id in self._normalizer._word_lemmas if lemma_id >= 0)
+
+
+_normalizers = {}
+
+
+def get_normalizer(path=NORMALIZER_PATH):
+    """Таблица нормализации, общая для всех движков процесса (открывается один раз на путь)"""
+    normalizer = _normalizers.get(path)
+    if normalizer is None:
+        normalizer = _normalizers[path] = Normalizer(path)
+    return normalizer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сборка таблицы нормализации (леммы, стоп-слова, словарь)')
+    parser.add_argument('--lemmas', nargs='+', default=[LEMMAS_SEED, ENGLISH_LEMMAS], help='файлы "лемма слово ..."')
+    parser.add_argument('--tokens', nargs='+', default=[TOKENS_SEED], help='файлы со словами корпуса')
+    parser.add_argument('--base', nargs='*', default=[BASE_WORDS], help='общий словарь языка')
+    parser.add_argument('--proper-nouns', nargs='*', default=[PROPER_NOUNS], help='имена собственные (не индексируются)')
+    parser.add_argument('--output', default=NORMALIZER_PATH)
+    args = parser.parse_args()
+    version = build_normalizer(args.lemmas, args.tokens, output_path=args.output,
+                               base_files=args.base, proper_nouns_files=args.proper_nouns)
+    print(f"Normalizer table {version} saved to {args.output} ({os.path.getsize(args.output)} bytes)")
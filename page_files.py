@@ -0,0 +1,84 @@
+import os
+import json
+
+DUPLICATES_PATH = 'duplicates.json'
+# Заголовок, описание и текст страницы, извлечённые при токенизации (doc_store.py)
+DOCUMENT_FILE = 'document.json'
+# Производные файлы каталога страницы page_N (токенизация и TF-IDF)
+PAGE_OUTPUTS = ('tokens.txt', 'lemmas.txt', 'terms_tfidf.txt', 'lemmas_tfidf.txt', DOCUMENT_FILE)
+
+
+def read_duplicate_ids(path=DUPLICATES_PATH):
+    """
+    doc_id почти-дубликатов из duplicates.json (dedup.DuplicateIndex)
+
+    Такие страницы не индексируются; без файла — пустое множество.
+    """
+    if path is None or not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return set(map(int, json.load(f)['duplicates']))
+
+
+def remove_page_outputs(page_dir):
+    """Удаляет производные файлы страницы (исходный HTML остаётся)"""
+    for name in PAGE_OUTPUTS:
+        path = os.path.join(page_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_token_counts(tokens_path):
+    """
+    Читает tokens.txt в словарь {токен: число вхождений}
+
+    Строка — "токен число"; в файлах старого формата числа нет,
+    и каждое вхождение строки считается за 1.
+    """
+    counts = {}
+    with open(tokens_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            count = int(parts[1]) if len(parts) > 1 else 1
+            counts[parts[0]] = counts.get(parts[0], 0) + count
+    return counts
+
+
+def read_lemma_words(lemmas_path):
+    """Читает lemmas.txt в список (лемма, [слова])"""
+    lemmas = []
+    with open(lemmas_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) < 2:
+                continue
+            lemmas.append((parts[0], parts[1:]))
+    return lemmas
+
+
+def read_doc_counts(doc_path):
+    """
+    Читает tokens.txt и lemmas.txt одного документа
+
+    Частота леммы — сумма частот её слов, длина документа — сумма частот
+    всех токенов.
+
+    :return: (частоты терминов, частоты лемм, длина документа) или None, если нет tokens.txt
+    """
+    tokens_path = os.path.join(doc_path, 'tokens.txt')
+    if not os.path.exists(tokens_path):
+        return None
+
+    terms_count = read_token_counts(tokens_path)
+    length = sum(terms_count.values())
+
+    lemmas_count = {}
+    lemmas_path = os.path.join(doc_path, 'lemmas.txt')
+    if os.path.exists(lemmas_path):
+        for lemma, words in read_lemma_words(lemmas_path):
+            count = sum(terms_count.get(word, 1) for word in words)
+            lemmas_count[lemma] = lemmas_count.get(lemma, 0) + count
+
+    return terms_count, lemmas_count, length
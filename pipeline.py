@@ -0,0 +1,281 @@
+import os
+import math
+import json
+import time
+import marshal
+import argparse
+import tempfile
+from array import array
+from itertools import groupby
+from multiprocessing import Pool
+import tokenizer
+from compact_index import COMPACT_INDEX_PATH, write_compact_index
+from dedup import DUPLICATES_PATH, DuplicateIndex, positions_signature
+from doc_store import DOC_STORE_PATH, build_doc_store, iter_html_pages
+from lsa import LSA_INDEX_PATH, LSA_RANK, build_lsa_index
+from page_files import DOCUMENT_FILE, remove_page_outputs
+from positional_index import POSITIONAL_INDEX_PATH, encode_doc_positions, write_positional_blocks
+from sharding import SHARDS_DIR, build_shards
+from tf_idf import safe_idf
+
+
+def _analyze_task(args):
+    doc_id, path, page_dir = args
+    filtered_tokens, lemmas, positions, document = tokenizer.analyze_page(path, with_positions=True,
+                                                                         with_document=True)
+    # Запись хранилища документов — из того же разбора HTML (build_doc_store его не повторяет)
+    tokenizer.write_page_files(page_dir, {DOCUMENT_FILE: [json.dumps(document, ensure_ascii=False)]})
+    # Слова без леммы в таблице нормализации не попадают в lemmas.txt, но термин остаётся
+    term_lemmas = {word: lemma for lemma, words in lemmas.items() for word in words}
+    records = [(term, term_lemmas.get(term), positions[term]) for term in sorted(filtered_tokens)]
+    # Сигнатура для поиска почти-дубликатов — по индексируемым токенам в порядке текста
+    return doc_id, records, positions_signature(positions)
+
+
+def iter_records(pages_dir='pages', workers=1, duplicates=None):
+    """
+    Разбирает каждую страницу ровно один раз и выдаёт поток записей
+
+    Заодно сохраняет page_N/document.json для хранилища документов.
+
+    :param duplicates: DuplicateIndex; страницы, почти совпадающие с уже
+        разобранными (с меньшим doc_id), в поток не попадают
+    :return: генератор (doc_id, термин, лемма или None, число вхождений, позиции),
+        записи одного документа идут подряд; страница без терминов даёт
+        одну запись (doc_id, None, None, 0, ())
+    """
+    tasks = ((doc_id, path, os.path.join(pages_dir, f'page_{doc_id}'))
+             for doc_id, path in iter_html_pages(pages_dir))
+    if workers > 1:
+        with Pool(processes=workers, initializer=tokenizer.load_resources) as pool:
+            results = pool.imap(_analyze_task, tasks, chunksize=4)
+            yield from _page_records(results, duplicates)
+    else:
+        yield from _page_records(map(_analyze_task, tasks), duplicates)
+
+
+def _page_records(results, duplicates=None):
+    for doc_id, page_records, signature in results:
+        # Страницы идут по возрастанию doc_id, поэтому канонической в кластере
+        # становится страница с наименьшим номером
+        if duplicates is not None and duplicates.add(doc_id, signature) != doc_id:
+            continue
+        if not page_records:
+            yield doc_id, None, None, 0, ()
+        for term, lemma, positions in page_records:
+            yield doc_id, term, lemma, len(positions), positions
+
+
+class IndexBuilder:
+    """
+    Однопроходная сборка индекса из потока записей
+
+    Документ не копится в памяти до finish(): его tokens.txt и lemmas.txt
+    пишутся сразу, массивы номеров терминов/лемм и частот сбрасываются во
+    временный файл, а позиции дописываются в сжатые varint-блоки лемм
+    позиционного индекса. IDF, TF-IDF и нормы вычисляются в finish(), когда
+    известно число документов; массивы документов читаются из временного
+    файла по одному.
+    """
+
+    def __init__(self, pages_dir='pages'):
+        self.pages_dir = pages_dir
+        self.term_ids = {}
+        self.terms = []
+        self.lemma_ids = {}
+        self.lemmas = []
+        self.term_lemma = array('i')
+        self.term_df = array('I')
+        self.lemma_df = array('I')
+        # Массивы документов: (номера терминов, частоты терминов, номера лемм, частоты лемм)
+        self._spill = tempfile.TemporaryFile()
+        # doc_id документов в порядке записи во временный файл (по возрастанию)
+        self.doc_ids = []
+        # номер леммы -> [число документов, последний doc_id, записи encode_doc_positions]
+        self._positions = {}
+
+    def _term_id(self, term, lemma):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self.term_df.append(0)
+            self.term_lemma.append(-1 if lemma is None else self._lemma_id(lemma))
+        return term_id
+
+    def _lemma_id(self, lemma):
+        lemma_id = self.lemma_ids.get(lemma)
+        if lemma_id is None:
+            lemma_id = self.lemma_ids[lemma] = len(self.lemmas)
+            self.lemmas.append(lemma)
+            self.lemma_df.append(0)
+        return lemma_id
+
+    def add_records(self, records):
+        """
+        Добавляет документы из потока iter_records
+
+        :raises ValueError: если doc_id документов не возрастают
+        """
+        for doc_id, doc_records in groupby(records, key=lambda record: record[0]):
+            if self.doc_ids and doc_id <= self.doc_ids[-1]:
+                raise ValueError(f'documents must arrive in increasing doc_id order, got {doc_id}')
+            term_counts = {}
+            lemma_counts = {}
+            lemma_positions = {}
+            for _, term, lemma, count, positions in doc_records:
+                if term is None:
+                    continue
+                term_id = self._term_id(term, lemma)
+                term_counts[term_id] = term_counts.get(term_id, 0) + count
+                if lemma is not None:
+                    lemma_id = self._lemma_id(lemma)
+                    lemma_counts[lemma_id] = lemma_counts.get(lemma_id, 0) + count
+                    lemma_positions.setdefault(lemma_id, []).extend(positions)
+
+            # Порядок по строке — тот же, что в tokens.txt и lemmas.txt
+            term_order = sorted(term_counts, key=self.terms.__getitem__)
+            lemma_order = sorted(lemma_counts, key=self.lemmas.__getitem__)
+            for term_id in term_order:
+                self.term_df[term_id] += 1
+            for lemma_id in lemma_order:
+                self.lemma_df[lemma_id] += 1
+                entry = self._positions.setdefault(lemma_id, [0, 0, bytearray()])
+                encode_doc_positions(doc_id - entry[1], sorted(lemma_positions[lemma_id]), entry[2])
+                entry[0] += 1
+                entry[1] = doc_id
+
+            words = {}
+            for term_id in term_order:
+                lemma_id = self.term_lemma[term_id]
+                if lemma_id >= 0:
+                    words.setdefault(lemma_id, []).append(self.terms[term_id])
+            tokenizer.write_page_files(os.path.join(self.pages_dir, f'page_{doc_id}'), {
+                'tokens.txt': [f"{self.terms[term_id]} {term_counts[term_id]}" for term_id in term_order],
+                'lemmas.txt': [f"{self.lemmas[lemma_id]} {' '.join(words[lemma_id])}"
+                               for lemma_id in lemma_order],
+            })
+
+            self.doc_ids.append(doc_id)
+            marshal.dump((array('I', term_order).tobytes(),
+                          array('I', (term_counts[t] for t in term_order)).tobytes(),
+                          array('I', lemma_order).tobytes(),
+                          array('I', (lemma_counts[l] for l in lemma_order)).tobytes()), self._spill)
+
+    def _spilled_docs(self):
+        """Перебирает (doc_id, массивы документа) из временного файла по возрастанию doc_id"""
+        self._spill.seek(0)
+        for doc_id in self.doc_ids:
+            arrays = []
+            for data in marshal.load(self._spill):
+                values = array('I')
+                values.frombytes(data)
+                arrays.append(values)
+            yield doc_id, arrays
+
+    def finish(self, index_path='inverted_index.txt', compact_path=COMPACT_INDEX_PATH,
+               positions_path=POSITIONAL_INDEX_PATH):
+        """Записывает TF-IDF файлы страниц, inverted_index.txt, бинарный и позиционный индексы"""
+        total_docs = len(self.doc_ids)
+        term_idf = [safe_idf(df, total_docs) if df else 0.0 for df in self.term_df]
+        lemma_idf = [safe_idf(df, total_docs) if df else 0.0 for df in self.lemma_df]
+
+        postings = {lemma: [] for lemma, df in zip(self.lemmas, self.lemma_df) if df}
+        doc_norms = {}
+        doc_lengths = {}
+        lemmas_map = {self.terms[term_id]: self.lemmas[lemma_id]
+                      for term_id, lemma_id in enumerate(self.term_lemma) if lemma_id >= 0}
+
+        for doc_id, (term_order, term_counts, lemma_order, lemma_counts) in self._spilled_docs():
+            length = sum(term_counts)
+            doc_lengths[doc_id] = length
+
+            terms_tfidf = []
+            for term_id, count in zip(term_order, term_counts):
+                idf = term_idf[term_id]
+                terms_tfidf.append(f"{self.terms[term_id]} {idf:.6f} {count / length * idf:.6f}")
+
+            lemmas_tfidf = []
+            norm = 0.0
+            for lemma_id, count in zip(lemma_order, lemma_counts):
+                idf = lemma_idf[lemma_id]
+                line = f"{self.lemmas[lemma_id]} {idf:.6f} {count / length * idf:.6f}"
+                lemmas_tfidf.append(line)
+                # Вес берётся в том же округлении, что читают поисковые движки
+                weight = float(line.rsplit(' ', 1)[1])
+                norm += weight ** 2
+                postings[self.lemmas[lemma_id]].append((doc_id, weight, count))
+            doc_norms[doc_id] = math.sqrt(norm)
+
+            tokenizer.write_page_files(os.path.join(self.pages_dir, f'page_{doc_id}'), {
+                'terms_tfidf.txt': terms_tfidf,
+                'lemmas_tfidf.txt': lemmas_tfidf,
+            })
+        self._spill.close()
+
+        tmp_path = f'{index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for lemma in sorted(postings):
+                f.write(f"{lemma}:{','.join(str(posting[0]) for posting in postings[lemma])}\n")
+        os.replace(tmp_path, index_path)
+
+        write_compact_index(compact_path, doc_norms, postings, lemmas_map, doc_lengths)
+        write_positional_blocks(positions_path, {self.lemmas[lemma_id]: (n_docs, block)
+                                                 for lemma_id, (n_docs, _, block) in self._positions.items()})
+        return total_docs
+
+
+def build_index(pages_dir='pages', index_path='inverted_index.txt',
+                compact_path=COMPACT_INDEX_PATH, positions_path=POSITIONAL_INDEX_PATH,
+                workers=1, docs_path=DOC_STORE_PATH, lsa_path=LSA_INDEX_PATH, lsa_rank=LSA_RANK,
+                duplicates_path=DUPLICATES_PATH):
+    """
+    Полная пересборка: HTML -> записи -> постинги, DF, TF-IDF, нормы -> артефакты
+
+    Заменяет последовательный запуск tokenizer.py, inverted_index.py и
+    tf_idf.py: каждая страница разбирается один раз, промежуточные файлы
+    не перечитываются. Латентная модель (lsa_path) при новых страницах
+    обновляется, а не подгоняется заново (см. lsa.build_lsa_index).
+
+    Почти-дубликаты страниц (MinHash/LSH, см. dedup.py) не индексируются;
+    отображение дубликат -> канонический doc_id сохраняется в duplicates_path
+    вместе с дубликатами, которые краулер отбросил ещё при загрузке.
+    """
+    start = time.perf_counter()
+    builder = IndexBuilder(pages_dir)
+    duplicates = None
+    if duplicates_path is not None:
+        duplicates = DuplicateIndex(duplicates_path)
+        # Страницы на диске разбираются заново и заново распределяются по кластерам
+        page_ids = {doc_id for doc_id, _ in iter_html_pages(pages_dir)}
+        duplicates.forget(page_ids)
+    builder.add_records(iter_records(pages_dir, workers, duplicates))
+    total_docs = builder.finish(index_path, compact_path, positions_path)
+    if duplicates is not None:
+        duplicates.save()
+        skipped = page_ids.intersection(duplicates.duplicates)
+        for doc_id in skipped:
+            # Файлы страницы, проиндексированной до того, как нашёлся её дубликат
+            remove_page_outputs(os.path.join(pages_dir, f'page_{doc_id}'))
+        print(f"Skipped {len(skipped)} near-duplicate pages")
+    if docs_path is not None:
+        build_doc_store(pages_dir, output_path=docs_path, workers=workers,
+                        exclude=duplicates.duplicates if duplicates is not None else ())
+    if lsa_path is not None and lsa_rank > 0:
+        build_lsa_index(compact_path, lsa_path, lsa_rank)
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {total_docs} pages in {elapsed:.2f}s "
+          f"({len(builder.lemmas)} lemmas, {len(builder.terms)} terms)")
+    return builder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Однопроходная сборка индекса из HTML')
+    parser.add_argument('pages_dir', nargs='?', default='pages')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, default=0, help='дополнительно разбить индекс на N шардов')
+    parser.add_argument('--lsa-rank', type=int, default=LSA_RANK, help='размерность латентной модели (0 — не строить)')
+    args = parser.parse_args()
+    build_index(args.pages_dir, workers=args.workers, lsa_rank=args.lsa_rank)
+    if args.shards:
+        build_shards(args.shards, args.pages_dir, shards_dir=SHARDS_DIR)
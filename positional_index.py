@@ -0,0 +1,213 @@
+import os
+import mmap
+import struct
+from compact_index import encode_varint
+from postings import to_postings, intersect
+
+POSITIONAL_INDEX_PATH = 'positions.bin'
+
+MAGIC = b'OIPPOS\x00\x01'
+# magic, n_terms, смещения term_offsets, term_blob, term_data, data
+HEADER = struct.Struct('<8sI4Q')
+
+
+def encode_doc_positions(doc_delta, positions, data):
+    """Дописывает в data запись документа: дельта doc_id, число позиций и дельты позиций"""
+    encode_varint(doc_delta, data)
+    encode_varint(len(positions), data)
+    prev_pos = 0
+    for position in positions:
+        encode_varint(position - prev_pos, data)
+        prev_pos = position
+
+
+def write_positional_index(output_path, postings):
+    """
+    Записывает позиционный индекс
+
+    Для каждой леммы (в порядке сортировки) хранится блок varint-чисел:
+    число документов, затем для каждого документа — дельта doc_id, число
+    позиций и дельты позиций.
+
+    :param postings: словарь {лемма: список (doc_id, отсортированные позиции)}
+    """
+    blocks = {}
+    for term, docs in postings.items():
+        block = bytearray()
+        prev_doc = 0
+        for doc_id, positions in sorted(docs):
+            encode_doc_positions(doc_id - prev_doc, positions, block)
+            prev_doc = doc_id
+        blocks[term] = (len(docs), block)
+    write_positional_blocks(output_path, blocks)
+
+
+def write_positional_blocks(output_path, blocks):
+    """
+    Записывает позиционный индекс из готовых блоков
+
+    :param blocks: словарь {лемма: (число документов, записи документов
+        по возрастанию doc_id из encode_doc_positions)}
+    """
+    terms = sorted(blocks)
+    term_offsets = [0]
+    term_blob = bytearray()
+    term_data = [0]
+    data = bytearray()
+
+    for term in terms:
+        term_blob += term.encode('utf-8')
+        term_offsets.append(len(term_blob))
+
+        n_docs, block = blocks[term]
+        encode_varint(n_docs, data)
+        data += block
+        term_data.append(len(data))
+
+    sections = [
+        struct.pack(f'<{len(term_offsets)}Q', *term_offsets),
+        bytes(term_blob),
+        struct.pack(f'<{len(term_data)}Q', *term_data),
+        bytes(data),
+    ]
+    offsets = []
+    body = bytearray()
+    for section in sections:
+        body += b'\x00' * (-(HEADER.size + len(body)) % 8)
+        offsets.append(HEADER.size + len(body))
+        body += section
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(terms), *offsets))
+        f.write(body)
+    os.replace(tmp_path, output_path)
+
+
+def _read_varint(buf, pos):
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+class PositionalIndex:
+    """Позиционный индекс, открытый через mmap"""
+
+    def __init__(self, path=POSITIONAL_INDEX_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_terms, offsets_at, self._term_blob, data_offsets_at, self._data = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: неизвестный формат позиционного индекса')
+        view = memoryview(self._mm)
+        size = 8 * (self.n_terms + 1)
+        self._term_offsets = view[offsets_at:offsets_at + size].cast('Q')
+        self._term_data = view[data_offsets_at:data_offsets_at + size].cast('Q')
+
+    def close(self):
+        self._term_offsets.release()
+        self._term_data.release()
+        self._mm.close()
+
+    def _term(self, i):
+        start = self._term_blob + self._term_offsets[i]
+        return self._mm[start:self._term_blob + self._term_offsets[i + 1]].decode('utf-8')
+
+    def term_id(self, term):
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_terms and self._term(lo) == term else -1
+
+    def postings(self, term):
+        """Список (doc_id, массив позиций) леммы, по возрастанию doc_id"""
+        term_id = self.term_id(term)
+        if term_id < 0:
+            return []
+        pos = self._data + self._term_data[term_id]
+        n_docs, pos = _read_varint(self._mm, pos)
+        result = []
+        doc_id = 0
+        for _ in range(n_docs):
+            delta, pos = _read_varint(self._mm, pos)
+            doc_id += delta
+            n_positions, pos = _read_varint(self._mm, pos)
+            positions = []
+            position = 0
+            for _ in range(n_positions):
+                delta, pos = _read_varint(self._mm, pos)
+                position += delta
+                positions.append(position)
+            result.append((doc_id, to_postings(positions)))
+        return result
+
+
+def _merge_docs(postings_lists):
+    """Слияние постингов по doc_id: выдаёт (doc_id, [позиции из каждого списка])"""
+    indexes = [0] * len(postings_lists)
+    while postings_lists and all(i < len(p) for p, i in zip(postings_lists, indexes)):
+        target = max(p[i][0] for p, i in zip(postings_lists, indexes))
+        matched = True
+        for k, p in enumerate(postings_lists):
+            i = indexes[k]
+            while i < len(p) and p[i][0] < target:
+                i += 1
+            indexes[k] = i
+            if i == len(p):
+                return
+            matched = matched and p[i][0] == target
+        if matched:
+            yield target, [p[i][1] for p, i in zip(postings_lists, indexes)]
+            indexes = [i + 1 for i in indexes]
+
+
+def phrase_positions(postings_lists, offsets):
+    """
+    Документы, где термины стоят на позициях start + offsets[i]
+
+    :param postings_lists: списки (doc_id, позиции) для каждого термина фразы
+    :param offsets: смещения терминов внутри фразы
+    :return: список (doc_id, позиции начала фразы)
+    """
+    result = []
+    for doc_id, position_lists in _merge_docs(postings_lists):
+        starts = to_postings([p - offsets[0] for p in position_lists[0]])
+        for positions, offset in zip(position_lists[1:], offsets[1:]):
+            starts = intersect(starts, to_postings([p - offset for p in positions]))
+            if not starts:
+                break
+        if starts:
+            result.append((doc_id, starts))
+    return result
+
+
+def near_positions(left, right, distance):
+    """
+    Документы, где позиции левого и правого операнда отстоят не более чем на distance
+
+    :return: список (doc_id, позиции левого операнда, рядом с которыми есть правый)
+    """
+    result = []
+    for doc_id, (left_positions, right_positions) in _merge_docs([left, right]):
+        matched = []
+        j = 0
+        n = len(right_positions)
+        for position in left_positions:
+            while j < n and right_positions[j] < position - distance:
+                j += 1
+            if j < n and right_positions[j] <= position + distance:
+                matched.append(position)
+        if matched:
+            result.append((doc_id, to_postings(matched)))
+    return result
@@ -0,0 +1,74 @@
+from array import array
+from bisect import bisect_left
+
+
+def to_postings(doc_ids):
+    """Упаковывает отсортированные doc_id в компактный массив int32"""
+    return doc_ids if isinstance(doc_ids, array) else array('i', doc_ids)
+
+
+def _gallop(postings, target, lo):
+    """Первый индекс >= lo, где postings[i] >= target (экспоненциальный поиск + бисекция)"""
+    n = len(postings)
+    step = 1
+    hi = lo
+    while hi < n and postings[hi] < target:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+    return bisect_left(postings, target, lo, min(hi, n))
+
+
+def intersect(a, b):
+    """Пересечение отсортированных списков галопирующим поиском по большему"""
+    if len(a) > len(b):
+        a, b = b, a
+    result = array('i')
+    j = 0
+    n = len(b)
+    for doc_id in a:
+        j = _gallop(b, doc_id, j)
+        if j >= n:
+            break
+        if b[j] == doc_id:
+            result.append(doc_id)
+            j += 1
+    return result
+
+
+def union(a, b):
+    """Объединение отсортированных списков слиянием"""
+    result = array('i')
+    i = j = 0
+    n, m = len(a), len(b)
+    while i < n and j < m:
+        x, y = a[i], b[j]
+        if x < y:
+            result.append(x)
+            i += 1
+        elif y < x:
+            result.append(y)
+            j += 1
+        else:
+            result.append(x)
+            i += 1
+            j += 1
+    result.extend(a[i:])
+    result.extend(b[j:])
+    return result
+
+
+def difference(a, b):
+    """Документы из a, которых нет в b"""
+    if not b:
+        return to_postings(a)
+    result = array('i')
+    j = 0
+    n = len(b)
+    for doc_id in a:
+        if j < n and b[j] < doc_id:
+            j = _gallop(b, doc_id, j)
+        if j < n and b[j] == doc_id:
+            continue
+        result.append(doc_id)
+    return result
@@ -0,0 +1,89 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def index_version(*paths):
+    """
+    Штамп версии индекса по mtime и размеру его файлов
+
+    Отсутствующие файлы пропускаются. Пересборка индекса меняет штамп,
+    и закэшированные под старым штампом результаты больше не находятся.
+    """
+    parts = []
+    for path in paths:
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f'{path}:{stat.st_mtime_ns}:{stat.st_size}')
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с необязательным TTL
+
+    :param maxsize: максимальное число записей (0 — кэш отключён)
+    :param ttl: время жизни записи в секундах (None — без ограничения)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Счётчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
@@ -0,0 +1,80 @@
+import os
+import gc
+import signal
+import socket
+import argparse
+from werkzeug.serving import make_server
+import app as search_app
+
+
+def _worker(host, port, sock, threaded):
+    # SIGHUP — перечитать индекс, не дожидаясь проверки по mtime. Обработчик
+    # только ставит флаг: загрузку запускает следующий запрос (maybe_reload)
+    signal.signal(signal.SIGHUP, lambda signum, frame: search_app.reloader.request_reload())
+    server = make_server(host, port, search_app.app, threaded=threaded, fd=sock.fileno())
+    server.serve_forever()
+
+
+def serve(host='127.0.0.1', port=8000, workers=None, threaded=True):
+    """
+    Pre-fork сервер API
+
+    Индексы загружаются в родительском процессе до fork, поэтому воркеры
+    получают их страницы памяти по copy-on-write, а mmap-индекс — из
+    общего page cache. gc.freeze() убирает загруженные объекты из
+    отслеживания сборщиком мусора, чтобы его проходы в воркерах не
+    трогали (и не копировали) эти страницы; замороженное поколение
+    сборщик уже не освободит, поэтому reloader закрывает заменённое
+    поколение явно (app._close_generation), когда его отпустит последний
+    запрос. Воркеры принимают соединения с одного общего слушающего сокета.
+
+    Пересобранный индекс каждый воркер подхватывает сам (app.reloader);
+    после SIGHUP родителю все воркеры перечитывают индекс на ближайшем
+    запросе, не дожидаясь проверки по mtime.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Первое обращение загружает поколение (вне запроса, поэтому без acquire)
+    search_app.reloader.current
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    print(f"Serving on http://{host}:{port} with {workers} workers")
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker(host, port, sock, threaded)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGHUP if signum == signal.SIGHUP else signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGHUP, forward)
+    for child in children:
+        os.waitpid(child, 0)
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Продакшен-запуск API поиска (pre-fork)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--no-threads', action='store_true', help='по одному запросу на воркер')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, threaded=not args.no_threads)
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import heapq
+import socket
+import argparse
+import threading
+import socketserver
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool, Process, Queue
+from bm25 import BM25_K1, BM25_B
+from compact_index import load_page_index, write_compact_index
+from manifest import write_json_atomic
+from page_files import DUPLICATES_PATH, read_duplicate_ids
+from vector_search import VectorSearch
+
+SHARDS_DIR = 'shards'
+COLLECTION_STATS = 'collection.json'
+
+
+def shard_path(shards_dir, shard):
+    return os.path.join(shards_dir, f'shard_{shard}.bin')
+
+
+def build_shards(n_shards, pages_dir='pages', index_path='inverted_index.txt', shards_dir=SHARDS_DIR,
+                 duplicates_path=DUPLICATES_PATH):
+    """
+    Делит документы на n_shards бинарных индексов по doc_id % n_shards
+
+    В каждом шарде лежат постинги только его документов, но общий словарь
+    и BM25-статистика всего корпуса (collection.json), поэтому скор
+    документа в шарде совпадает со скором в едином индексе. TF-IDF веса
+    в lemmas_tfidf.txt уже посчитаны с глобальным IDF. Почти-дубликаты
+    (duplicates_path) в шарды не попадают.
+    """
+    doc_norms, postings, lemmas_map, doc_lengths = load_page_index(pages_dir, index_path,
+                                                                   read_duplicate_ids(duplicates_path))
+    collection = {
+        'n_docs': len(doc_norms),
+        'avgdl': sum(doc_lengths.get(d, 0) for d in doc_norms) / len(doc_norms) if doc_norms else 0.0,
+        'df': {lemma: len(docs) for lemma, docs in postings.items() if docs},
+    }
+
+    os.makedirs(shards_dir, exist_ok=True)
+    for shard in range(n_shards):
+        norms = {doc_id: norm for doc_id, norm in doc_norms.items() if doc_id % n_shards == shard}
+        # Словарь общий: слово запроса должно находить лемму в любом шарде
+        shard_postings = {lemma: [p for p in docs if p[0] % n_shards == shard]
+                          for lemma, docs in postings.items()}
+        write_compact_index(shard_path(shards_dir, shard), norms, shard_postings, lemmas_map,
+                            {doc_id: doc_lengths.get(doc_id, 0) for doc_id in norms},
+                            collection=collection)
+    # Статистика пишется последней: по ней координатор узнаёт число шардов
+    write_json_atomic({**collection, 'n_shards': n_shards}, os.path.join(shards_dir, COLLECTION_STATS))
+    print(f"Built {n_shards} shards for {len(doc_norms)} documents in {shards_dir}")
+
+
+def merge_top_k(shard_results, top_n):
+    """Слияние отсортированных top-k списков шардов (при равном скоре — по doc_id)"""
+    merged = heapq.merge(*shard_results, key=lambda item: (-item[1], item[0]))
+    return [(doc_id, score) for doc_id, score in islice(merged, top_n)]
+
+
+# Движки шардов, открытые в текущем процессе
+_engines = {}
+
+
+def _open_shard(shards_dir, shard, ranking, k1, b):
+    key = (shards_dir, shard, ranking, k1, b)
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines[key] = VectorSearch(
+            compact_path=shard_path(shards_dir, shard),
+            collection_path=os.path.join(shards_dir, COLLECTION_STATS),
+            ranking=ranking, k1=k1, b=b)
+    return engine
+
+
+def search_shard(args):
+    """
+    Задача для пула: поиск в одном шарде
+
+    :return: (номер шарда, результаты, время в секундах)
+    """
+    shards_dir, shard, ranking, k1, b, query, top_n, prune = args
+    start = time.perf_counter()
+    results = _open_shard(shards_dir, shard, ranking, k1, b).search(query, top_n, prune)
+    return shard, results, time.perf_counter() - start
+
+
+class _ShardHandler(socketserver.StreamRequestHandler):
+    """
+    Протокол воркера: строка JSON-запроса -> строка JSON-ответа
+
+    Ответ — {"results", "elapsed"} или {"error": текст}, если запрос не
+    удалось выполнить: соединение при ошибке не обрывается.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            start = time.perf_counter()
+            try:
+                request = json.loads(line)
+                results = self.server.engine.search(request['query'], request['top_n'], request['prune'])
+                response = {'results': results, 'elapsed': time.perf_counter() - start}
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class _ShardServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_shard(shard, shards_dir=SHARDS_DIR, host='127.0.0.1', port=0,
+                ranking='cosine', k1=BM25_K1, b=BM25_B, ready=None):
+    """
+    Воркер одного шарда: держит его индекс и отвечает на запросы по TCP
+
+    :param port: 0 — любой свободный порт
+    :param ready: очередь, в которую кладётся (шард, адрес) после старта
+    """
+    engine = _open_shard(shards_dir, shard, ranking, k1, b)
+    with _ShardServer((host, port), _ShardHandler) as server:
+        server.engine = engine
+        if ready is not None:
+            ready.put((shard, server.server_address))
+        else:
+            print(f"Shard {shard} listening on {server.server_address[0]}:{server.server_address[1]}")
+        server.serve_forever()
+
+
+def start_shard_workers(n_shards, shards_dir=SHARDS_DIR, ranking='cosine', k1=BM25_K1, b=BM25_B):
+    """
+    Запускает по локальному процессу-воркеру на каждый шард
+
+    :return: (список процессов, список адресов в порядке шардов)
+    """
+    ready = Queue()
+    processes = []
+    for shard in range(n_shards):
+        process = Process(target=serve_shard, args=(shard, shards_dir, '127.0.0.1', 0, ranking, k1, b, ready),
+                          daemon=True)
+        process.start()
+        processes.append(process)
+    addresses = dict(ready.get() for _ in range(n_shards))
+    return processes, [tuple(addresses[shard]) for shard in range(n_shards)]
+
+
+class _ShardClient:
+    """Постоянное соединение с воркером шарда"""
+
+    def __init__(self, address):
+        self.address = address
+        self._sock = socket.create_connection(address)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def search(self, query, top_n, prune):
+        request = json.dumps({'query': query, 'top_n': top_n, 'prune': prune}).encode('utf-8')
+        with self._lock:
+            self._file.write(request + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError(f'Воркер шарда {self.address[0]}:{self.address[1]} закрыл соединение')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f'Ошибка воркера шарда {self.address[0]}:{self.address[1]}: {response["error"]}')
+        return [tuple(item) for item in response['results']], response['elapsed']
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class ShardedSearch:
+    """
+    Координатор: рассылает запрос по шардам и сливает их top-k
+
+    mode='pool' — шарды обслуживает пул процессов (каждый процесс открывает
+    нужные ему шарды через mmap); mode='socket' — по воркеру на шард, по
+    умолчанию локальные процессы, либо уже запущенные по addresses.
+    """
+
+    def __init__(self, shards_dir=SHARDS_DIR, mode='pool', workers=None, addresses=None,
+                 ranking='cosine', k1=BM25_K1, b=BM25_B):
+        if mode not in ('pool', 'socket'):
+            raise ValueError(f'Неизвестный режим: {mode}')
+        with open(os.path.join(shards_dir, COLLECTION_STATS), 'r', encoding='utf-8') as f:
+            self.n_shards = json.load(f)['n_shards']
+        self.shards_dir = shards_dir
+        self.mode = mode
+        self.ranking = ranking
+        self.k1 = k1
+        self.b = b
+        self._pool = None
+        self._processes = []
+        self._clients = []
+
+        if mode == 'pool':
+            self._pool = Pool(processes=workers or min(self.n_shards, os.cpu_count() or 1))
+        else:
+            if addresses is None:
+                self._processes, addresses = start_shard_workers(self.n_shards, shards_dir, ranking, k1, b)
+            if len(addresses) != self.n_shards:
+                raise ValueError(f'Ожидалось {self.n_shards} адресов воркеров, получено {len(addresses)}')
+            self._clients = [_ShardClient(address) for address in addresses]
+            self._executor = ThreadPoolExecutor(max_workers=self.n_shards)
+
+    def _scatter(self, query, top_n, prune):
+        if self._pool is not None:
+            tasks = [(self.shards_dir, shard, self.ranking, self.k1, self.b, query, top_n, prune)
+                     for shard in range(self.n_shards)]
+            return self._pool.map(search_shard, tasks, chunksize=1)
+        futures = [self._executor.submit(client.search, query, top_n, prune) for client in self._clients]
+        return [(shard, *future.result()) for shard, future in enumerate(futures)]
+
+    def search_timed(self, query, top_n=5, prune=False):
+        """
+        Поиск с замером времени
+
+        :return: (результаты как у VectorSearch.search, словарь времён в мс:
+            shards — время поиска в каждом шарде, merge — слияние, total — всего)
+        """
+        start = time.perf_counter()
+        gathered = self._scatter(query, top_n, prune)
+        merge_start = time.perf_counter()
+        results = merge_top_k([shard_results for _, shard_results, _ in gathered], top_n)
+        end = time.perf_counter()
+        timings = {
+            'shards': {shard: elapsed * 1000 for shard, _, elapsed in gathered},
+            'merge': (end - merge_start) * 1000,
+            'total': (end - start) * 1000,
+        }
+        return results, timings
+
+    def search(self, query, top_n=5, prune=False):
+        return self.search_timed(query, top_n, prune)[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        for client in self._clients:
+            client.close()
+        if self._clients:
+            self._executor.shutdown()
+        for process in self._processes:
+            process.terminate()
+            process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Шардированный индекс')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='разбить индекс на шарды')
+    build_parser.add_argument('--shards', type=int, default=os.cpu_count() or 1)
+    build_parser.add_argument('--pages-dir', default='pages')
+    build_parser.add_argument('--shards-dir', default=SHARDS_DIR)
+
+    serve_parser = subparsers.add_parser('serve', help='запустить воркер одного шарда')
+    serve_parser.add_argument('shard', type=int)
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=0)
+
+    search_parser = subparsers.add_parser('search', help='поиск по всем шардам')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--mode', choices=['pool', 'socket'], default='pool')
+    search_parser.add_argument('--top-n', type=int, default=5)
+    search_parser.add_argument('--prune', action='store_true')
+
+    for sub in (serve_parser, search_parser):
+        sub.add_argument('--shards-dir', default=SHARDS_DIR)
+        sub.add_argument('--ranking', choices=['cosine', 'bm25'], default='cosine')
+        sub.add_argument('--k1', type=float, default=BM25_K1)
+        sub.add_argument('--b', type=float, default=BM25_B)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_shards(args.shards, args.pages_dir, shards_dir=args.shards_dir)
+    elif args.command == 'serve':
+        serve_shard(args.shard, args.shards_dir, args.host, args.port, args.ranking, args.k1, args.b)
+    else:
+        search_engine = ShardedSearch(args.shards_dir, args.mode, ranking=args.ranking, k1=args.k1, b=args.b)
+        try:
+            results, timings = search_engine.search_timed(args.query, args.top_n, args.prune)
+        finally:
+            search_engine.close()
+        for doc_id, score in results:
+            print(f"Документ {doc_id}: релевантность = {score:.4f}")
+        for shard, elapsed in sorted(timings['shards'].items()):
+            print(f"shard {shard}: {elapsed:.2f} ms")
+        print(f"merge: {timings['merge']:.2f} ms, total: {timings['total']:.2f} ms")
@@ -0,0 +1,103 @@
+import math
+from typing import List, Tuple
+import numpy as np
+from scipy import sparse
+from vector_search import VectorSearch
+
+
+class SparseVectorSearch(VectorSearch):
+    """
+    Векторный поиск поверх разреженной CSR-матрицы документ × лемма
+
+    Строки матрицы нормированы по L2, поэтому косинусная близость — это
+    произведение матрицы на вектор запроса, делённое на норму запроса.
+    В режиме BM25 в ячейках лежат BM25-вклады лемм, и скор — произведение
+    матрицы на вектор частот лемм запроса.
+    Словарные TF-IDF векторы документов после построения матрицы не хранятся.
+    """
+
+    def _prepare_scoring(self):
+        self._doc_ids = np.array(sorted(self.doc_norms), dtype=np.int64)
+        doc_index = {doc_id: i for i, doc_id in enumerate(self._doc_ids.tolist())}
+        self.vocabulary = {lemma: j for j, lemma in enumerate(sorted(self.inverted_index))}
+
+        rows, cols, data = [], [], []
+        weights = self._bm25_weights if self.ranking == 'bm25' else self._term_weights
+        for lemma, j in self.vocabulary.items():
+            for doc_id, weight in weights(lemma):
+                i = doc_index.get(doc_id)
+                if i is None:
+                    continue
+                rows.append(i)
+                cols.append(j)
+                data.append(weight)
+
+        shape = (len(self._doc_ids), len(self.vocabulary))
+        matrix = sparse.csr_matrix((np.array(data, dtype=np.float64), (rows, cols)), shape=shape)
+        self.doc_vectors = None
+        if self.ranking == 'bm25':
+            self.matrix = matrix
+            return
+        norms = np.array([self.doc_norms[doc_id] for doc_id in self._doc_ids.tolist()])
+        inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        self.matrix = sparse.diags(inv_norms).dot(matrix).tocsr()
+
+    def _query_matrix(self, query_vectors):
+        """Собирает разреженную матрицу лемма × запрос (для cosine столбцы L2-нормированы)"""
+        rows, cols, data = [], [], []
+        for col, query_vector in enumerate(query_vectors):
+            query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+            if self.ranking == 'bm25':
+                query_norm = 1.0 if query_vector else 0.0
+            for lemma, q_weight in query_vector.items():
+                j = self.vocabulary.get(lemma)
+                if j is None or query_norm == 0:
+                    continue
+                rows.append(j)
+                cols.append(col)
+                data.append(q_weight / query_norm)
+        shape = (len(self.vocabulary), len(query_vectors))
+        return sparse.csc_matrix((np.array(data, dtype=np.float64), (rows, cols)), shape=shape)
+
+    def _top_k(self, scores: np.ndarray, rows: np.ndarray, top_n: int) -> List[Tuple[int, float]]:
+        """Отбирает top_n документов по убыванию скора (при равенстве — по doc_id)"""
+        if self.ranking == 'cosine':
+            scores = np.minimum(scores, 1.0)
+        mask = scores > 1e-6
+        scores, doc_ids = scores[mask], self._doc_ids[rows[mask]]
+        order = np.lexsort((doc_ids, -scores))[:top_n]
+        return [(int(doc_ids[i]), float(scores[i])) for i in order]
+
+    def _score_batch(self, query_vectors, top_n: int) -> List[List[Tuple[int, float]]]:
+        # Все запросы оцениваются одним произведением разреженных матриц
+        scores = self.matrix.dot(self._query_matrix(query_vectors)).tocsc()
+        results = []
+        for col in range(len(query_vectors)):
+            start, end = scores.indptr[col], scores.indptr[col + 1]
+            results.append(self._top_k(scores.data[start:end], scores.indices[start:end], top_n)
+                           if top_n > 0 else [])
+        return results
+
+    def _score(self, query_vector, query_norm, top_n, prune=False, trace=None):
+        if trace is None:
+            return self._score_batch([query_vector], top_n)[0]
+        # Сбор кандидатов и скоринг здесь — одно произведение матриц
+        with trace.stage('scoring'):
+            return self._score_batch([query_vector], top_n)[0]
+
+    def search_batch(self, queries: List[str], top_n: int = 5, mode: str = None) -> List[List[Tuple[int, float]]]:
+        """
+        Пакетный поиск
+
+        :param queries: список текстов запросов
+        :param top_n: число результатов на запрос
+        :param mode: режим поиска; не лексический передаётся VectorSearch
+        :return: список результатов в порядке запросов (как у search)
+        """
+        mode = self._check_mode(mode)
+        if mode != 'lexical':
+            return super().search_batch(queries, top_n, mode)
+        # Как и у search, через кэш результатов, трассы и хуки; этап scoring —
+        # одно произведение матриц на все запросы, которых нет в кэше
+        return self._cached_batch(queries, top_n, mode, 'scoring', lambda batch: self._score_batch(
+            [self._query_vector(query_lemmas) for query_lemmas in batch], top_n))
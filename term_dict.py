@@ -0,0 +1,245 @@
+import argparse
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+# Верхняя граница для диапазона строк с общим префиксом
+_MAX_CHAR = '\U0010ffff'
+# Не больше стольких терминов на одно слово запроса
+MAX_EXPANSIONS = 16
+# Минимальная длина слова для 1 и 2 допустимых правок (короткие слова
+# при одной правке совпадают со слишком многими другими)
+FUZZY_ONE_EDIT = 5
+FUZZY_TWO_EDITS = 9
+# Столько первых символов при нечётком поиске должны совпадать точно:
+# опечатки в начале слова редки, а без этого обходятся все короткие префиксы
+FUZZY_PREFIX = 1
+
+
+def is_pattern(term):
+    """Содержит ли слово запроса шаблонные символы * или ?"""
+    return '*' in term or '?' in term
+
+
+def max_edits(term):
+    """Допустимое число правок для нечёткого поиска слова этой длины"""
+    if len(term) >= FUZZY_TWO_EDITS:
+        return 2
+    return 1 if len(term) >= FUZZY_ONE_EDIT else 0
+
+
+def build_trie(terms):
+    """
+    Строит префиксное дерево по отсортированному списку терминов
+
+    Узлы нумеруются в порядке обхода в ширину, поэтому дети узла i — это
+    узлы children[i]..children[i + 1] - 1, упорядоченные по символу.
+
+    :return: (children, labels, values) — массивы: начало детей узла (длина
+        n_nodes + 1), код символа ребра в узел, номер термина узла или -1
+    """
+    children = array('I')
+    labels = array('I', [0])
+    values = array('i')
+    nodes = deque([(0, len(terms), 0)])
+    while nodes:
+        lo, hi, depth = nodes.popleft()
+        if lo < hi and len(terms[lo]) == depth:
+            values.append(lo)
+            lo += 1
+        else:
+            values.append(-1)
+        children.append(len(labels))
+        while lo < hi:
+            char = terms[lo][depth]
+            end = lo + 1
+            while end < hi and terms[end][depth] == char:
+                end += 1
+            labels.append(ord(char))
+            nodes.append((lo, end, depth + 1))
+            lo = end
+    children.append(len(labels))
+    return children, labels, values
+
+
+class TermDictionary:
+    """
+    Словарь терминов с поиском по префиксу, шаблону и опечаткам
+
+    Префиксное дерево строится при индексации (секции trie_* бинарного
+    индекса) или при загрузке текстового индекса. Шаблоны и расстояние
+    Левенштейна проверяются автоматом по мере спуска по дереву: ветка
+    отсекается, как только автомат не может дойти до допускающего
+    состояния, поэтому обходится малая часть словаря.
+
+    :param terms: отсортированная последовательность строк без повторов
+    :param trie: (children, labels, values) из build_trie; по умолчанию
+        строится по terms
+    """
+
+    def __init__(self, terms, trie=None):
+        self.terms = terms
+        self._children, self._labels, self._values = trie if trie is not None else build_trie(terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        node = self._descend(term)
+        return node is not None and self._values[node] >= 0
+
+    def _descend(self, prefix):
+        """Узел дерева для префикса или None"""
+        node = 0
+        for char in prefix:
+            lo, hi = self._children[node], self._children[node + 1]
+            node = bisect_left(self._labels, ord(char), lo, hi)
+            if node == hi or self._labels[node] != ord(char):
+                return None
+        return node
+
+    def prefix(self, prefix, limit=MAX_EXPANSIONS):
+        """Первые limit терминов (по алфавиту), начинающихся с prefix"""
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + _MAX_CHAR, lo)
+        return [self.terms[i] for i in range(lo, min(hi, lo + limit))]
+
+    def wildcard(self, pattern, limit=MAX_EXPANSIONS):
+        """
+        Термины, подходящие под шаблон: * — любая подстрока, ? — один символ
+
+        Спуск начинается с узла литерального префикса шаблона; шаблон без
+        префикса ('*ine') обходит всё дерево.
+        :return: первые limit совпадений по алфавиту
+        """
+        literal = min((i for i in (pattern.find('*'), pattern.find('?')) if i >= 0), default=len(pattern))
+        node = self._descend(pattern[:literal])
+        results = []
+
+        def emit(term, positions):
+            if len(pattern) in positions:
+                results.append(term)
+            return len(results) < limit
+
+        if node is not None and limit > 0:
+            self._walk(node, pattern[:literal], _glob_closure(pattern, {literal}),
+                       lambda positions, char: _glob_step(pattern, positions, char),
+                       emit, frozenset(map(ord, pattern)))
+        return results
+
+    def fuzzy(self, term, edits=None, limit=MAX_EXPANSIONS, prefix_length=FUZZY_PREFIX):
+        """
+        Термины на расстоянии Левенштейна не больше edits
+
+        Автомат Левенштейна моделируется побитово (Wu–Manber): состояние —
+        edits + 1 битовых масок, бит i маски e означает, что спуск можно
+        сопоставить с term[:i] не более чем за e правок. Переход по символу —
+        несколько сдвигов на каждое e, без таблицы расстояний.
+
+        :param edits: допустимое число правок (по умолчанию max_edits(term))
+        :param prefix_length: длина префикса, совпадающего точно (на расстояние
+            он не влияет)
+        :return: список (термин, расстояние), ближайшие первыми
+        """
+        edits = max_edits(term) if edits is None else edits
+        prefix, term = term[:prefix_length], term[prefix_length:]
+        node = self._descend(prefix)
+        if node is None:
+            return []
+        full = (1 << (len(term) + 1)) - 1
+        accept = 1 << len(term)
+        masks = {}
+        for i, char in enumerate(term, 1):
+            masks[char] = masks.get(char, 0) | 1 << i
+
+        def step(state, char):
+            mask = masks.get(char, 0)
+            previous = state[0]
+            new = [(previous << 1) & mask]
+            for errors in range(1, edits + 1):
+                current = state[errors]
+                # совпадение | вставка | замена | удаление символа term
+                new.append((((current << 1) & mask) | previous | (previous << 1) | (new[-1] << 1)) & full)
+                previous = current
+            # Маска с наибольшим числом правок содержит все остальные
+            return new if new[-1] else None
+
+        matches = []
+
+        def emit(match, state):
+            for errors, positions in enumerate(state):
+                if positions & accept:
+                    matches.append((errors, match))
+                    break
+            return True
+
+        start = [(1 << (errors + 1)) - 1 & full for errors in range(edits + 1)]
+        self._walk(node, prefix, start, step, emit, frozenset(map(ord, term)))
+        return [(match, distance) for distance, match in sorted(matches)[:limit]]
+
+    def _walk(self, node, prefix, state, step, emit, alphabet):
+        """
+        Спуск по дереву от узла node (с префиксом prefix) в состоянии автомата state
+
+        :param step: функция (состояние, символ) -> состояние или None, если
+            ветка не может дать совпадений; символ None — любой символ не из alphabet
+        :param emit: вызывается для каждого термина с его состоянием;
+            False останавливает обход
+        :param alphabet: коды символов, на которые автомат реагирует особо
+        :return: False, если обход остановлен
+        """
+        if self._values[node] >= 0 and not emit(prefix, state):
+            return False
+        # Переход по «прочему» символу один для всех таких детей: если он
+        # мёртв, проверяются только дети с символами из alphabet
+        other = step(state, None)
+        for child in range(self._children[node], self._children[node + 1]):
+            label = self._labels[child]
+            if label in alphabet:
+                child_state = step(state, chr(label))
+            else:
+                child_state = other
+            if child_state is not None and not self._walk(child, prefix + chr(label), child_state,
+                                                          step, emit, alphabet):
+                return False
+        return True
+
+
+def _glob_closure(pattern, positions):
+    """Добавляет позиции после '*': звёздочка может совпасть с пустой строкой"""
+    positions = set(positions)
+    for pos in sorted(positions):
+        while pos < len(pattern) and pattern[pos] == '*':
+            pos += 1
+            positions.add(pos)
+    return frozenset(positions)
+
+
+def _glob_step(pattern, positions, char):
+    following = set()
+    for pos in positions:
+        if pos == len(pattern):
+            continue
+        if pattern[pos] == '*':
+            following.add(pos)
+        elif pattern[pos] == '?' or pattern[pos] == char:
+            following.add(pos + 1)
+    return _glob_closure(pattern, following) if following else None
+
+
+if __name__ == '__main__':
+    from compact_index import COMPACT_INDEX_PATH, CompactIndex
+
+    parser = argparse.ArgumentParser(description='Расширение слова по словарю бинарного индекса')
+    parser.add_argument('term', help='слово, префикс* или шаблон с * и ?')
+    parser.add_argument('--index', default=COMPACT_INDEX_PATH)
+    parser.add_argument('--edits', type=int, help='допустимое число правок для нечёткого поиска')
+    parser.add_argument('--limit', type=int, default=MAX_EXPANSIONS)
+    args = parser.parse_args()
+
+    dictionary = CompactIndex(args.index).word_dictionary()
+    if is_pattern(args.term):
+        print('\n'.join(dictionary.wildcard(args.term, args.limit)))
+    else:
+        for match, distance in dictionary.fuzzy(args.term, args.edits, args.limit):
+            print(f'{match}\t{distance}')
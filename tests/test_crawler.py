@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import crawler
+from crawler import CrawlState, HostLimiter, crawl, fetch
+
+ARTICLES = ['/articles/a', '/articles/b', '/articles/c']
+
+
+def _make_app(hits, failing):
+    """Сайт со страницей списка и тремя статьями; статьи из failing отвечают ошибкой"""
+    async def listing(request):
+        hits['listing'] = hits.get('listing', 0) + 1
+        links = ''.join(f'<a href="{path}">{path}</a>' for path in ARTICLES)
+        return web.Response(text=f'<html><body>{links}</body></html>', content_type='text/html')
+
+    async def article(request):
+        path = request.path
+        hits[path] = hits.get(path, 0) + 1
+        status = failing.get(path)
+        if isinstance(status, list):
+            status = status.pop(0) if status else None
+        if status:
+            return web.Response(status=status)
+        return web.Response(text=f'<html><body>article {path}</body></html>', content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/articles', listing)
+    app.router.add_get('/articles/{name}', article)
+    return app
+
+
+def _run_crawl(server, tmp_path):
+    site = str(server.make_url('')).rstrip('/')
+    return crawl(f'{site}/articles', site, max_pages=1, max_articles=10, concurrency=2,
+                 min_delay=0, max_delay=0, pages_dir=str(tmp_path / 'pages'),
+                 index_file=str(tmp_path / 'index.txt'), state_path=str(tmp_path / 'state.json'),
+                 duplicates_path=None)
+
+
+def test_crawl_resumes_after_failure(tmp_path):
+    hits = {}
+    failing = {'/articles/b': 404}
+
+    async def scenario():
+        async with TestServer(_make_app(hits, failing)) as server:
+            state = await _run_crawl(server, tmp_path)
+            assert len(state.article_links) == 3
+            assert len(state.downloaded) == 2
+            # Второй запуск: список не запрашивается снова, скачивается только пропущенная статья
+            failing.clear()
+            state = await _run_crawl(server, tmp_path)
+            assert len(state.downloaded) == 3
+
+    asyncio.run(scenario())
+    assert hits == {'listing': 1, '/articles/a': 1, '/articles/b': 2, '/articles/c': 1}
+    assert sorted(os.listdir(tmp_path / 'pages')) == ['page_0.html', 'page_1.html', 'page_2.html']
+    assert len(CrawlState(str(tmp_path / 'state.json')).downloaded) == 3
+    with open(tmp_path / 'index.txt', encoding='utf-8') as f:
+        assert sorted(line.split()[0] for line in f) == ['0:', '1:', '2:']
+
+
+def test_resume_does_not_duplicate_index_lines(tmp_path):
+    hits = {}
+
+    async def scenario():
+        async with TestServer(_make_app(hits, {})) as server:
+            await _run_crawl(server, tmp_path)
+            # Сбой между записью строки index.txt и state.save(): статья c не отмечена скачанной
+            state = CrawlState(str(tmp_path / 'state.json'))
+            state.downloaded.discard(state.article_links[2])
+            state.save()
+            await _run_crawl(server, tmp_path)
+
+    asyncio.run(scenario())
+    assert hits['/articles/c'] == 2
+    with open(tmp_path / 'index.txt', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert sorted(lines) == sorted(set(lines)) and len(lines) == 3
+
+
+def test_fetch_retries_transient_errors():
+    hits = {}
+    failing = {'/articles/a': [429, 503], '/articles/b': [404]}
+
+    async def scenario():
+        async with TestServer(_make_app(hits, failing)) as server:
+            async with aiohttp.ClientSession() as session:
+                limiter = HostLimiter(concurrency=2, min_delay=0, max_delay=0)
+                text = await fetch(session, limiter, str(server.make_url('/articles/a')), backoff=0.01)
+                missing = await fetch(session, limiter, str(server.make_url('/articles/b')), backoff=0.01)
+                return text, missing
+
+    text, missing = asyncio.run(scenario())
+    assert 'article /articles/a' in text
+    assert hits['/articles/a'] == 3
+    # 404 не повторяется
+    assert missing is None and hits['/articles/b'] == 1
+
+
+def test_host_limiter_spreads_delay_over_slots():
+    async def scenario():
+        limiter = HostLimiter(concurrency=4, min_delay=0.2, max_delay=0.2)
+        start = time.monotonic()
+        for _ in range(4):
+            await limiter('http://example.org/x')
+        return time.monotonic() - start
+
+    # Четыре старта с интервалом 0.2 / 4, а не 0.2
+    assert asyncio.run(scenario()) < 0.3
+
+
+def test_state_deduplicates_article_variants(tmp_path):
+    state = CrawlState(str(tmp_path / 'state.json'))
+    assert state.add_link(f'{crawler.base_url}/articles/10.3389/x')
+    assert not state.add_link(f'{crawler.base_url}/articles/10.3389/x/full?utm=1')
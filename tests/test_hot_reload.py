@@ -0,0 +1,42 @@
+import time
+from hot_reload import IndexReloader
+
+
+class Generation:
+    def __init__(self, number):
+        self.number = number
+
+
+def make_reloader(closed, retire_timeout=60.0):
+    numbers = iter(range(1, 100))
+    return IndexReloader(lambda: Generation(next(numbers)), [__file__], interval=0,
+                         close=lambda generation: closed.append(generation.number), retire_timeout=retire_timeout)
+
+
+def test_retired_generation_closes_after_last_release():
+    closed = []
+    reloader = make_reloader(closed)
+    first = reloader.acquire()
+    second_use = reloader.acquire()
+    reloader.reload(wait=True)
+    assert closed == []
+    reloader.release(first)
+    assert closed == []
+    reloader.release(second_use)
+    assert closed == [1]
+    # Поколение без запросов закрывается сразу после подмены
+    reloader.reload(wait=True)
+    assert closed == [1, 2]
+
+
+def test_retire_timeout_closes_stuck_generation():
+    closed = []
+    reloader = make_reloader(closed, retire_timeout=0.05)
+    stuck = reloader.acquire()
+    reloader.reload(wait=True)
+    time.sleep(0.1)
+    reloader.maybe_reload()
+    assert closed == [1]
+    # Поздний release уже закрытого поколения ничего не делает
+    reloader.release(stuck)
+    assert closed == [1]
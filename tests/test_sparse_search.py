@@ -0,0 +1,33 @@
+import os
+import pytest
+from sparse_search import SparseVectorSearch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES = ['diabetes', 'cancer treatment', 'zzzzzz', 'diabetes']
+
+
+@pytest.fixture
+def engine():
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        engine = SparseVectorSearch('pages', 'inverted_index.txt', compact_path='index.bin')
+        yield engine
+        engine.close()
+    finally:
+        os.chdir(cwd)
+
+
+def test_lexical_batch_goes_through_cache_and_hooks(engine):
+    traces = []
+    engine.hooks.append(traces.append)
+    results = engine.search_batch(QUERIES)
+    assert sorted(trace.query for trace in traces) == sorted(QUERIES)
+    scored = [trace for trace in traces if 'scoring' in trace.stages]
+    assert len(scored) == 3 and all(trace.counters['batch_size'] == 3 for trace in scored)
+
+    # Следующий пакет и одиночные запросы берут результаты из того же кэша
+    traces.clear()
+    assert engine.search_batch(QUERIES) == results
+    assert sum(trace.counters.get('cache_hits', 0) for trace in traces) == 3
+    assert [engine.search(query) for query in QUERIES] == results
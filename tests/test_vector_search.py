@@ -0,0 +1,49 @@
+import os
+import pytest
+from vector_search import VectorSearch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def engines():
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        text_engine = VectorSearch('pages', 'inverted_index.txt')
+        compact_engine = VectorSearch('pages', 'inverted_index.txt', compact_path='index.bin')
+        yield text_engine, compact_engine
+        compact_engine.close()
+    finally:
+        os.chdir(cwd)
+
+
+def page_lemmas(doc_id):
+    with open(os.path.join(ROOT, 'pages', f'page_{doc_id}', 'lemmas.txt'), 'r', encoding='utf-8') as f:
+        return {line.split()[0] for line in f if line.strip()}
+
+
+@pytest.mark.parametrize('query', ['diabetes', 'diabetez', 'diabetes?'])
+def test_search_returns_documents_with_word(engines, query):
+    # Опечатка исправляется к слову словаря, найденные страницы содержат его лемму
+    for engine in engines:
+        results = engine.search(query)
+        assert results
+        assert all('diabetes' in page_lemmas(doc_id) for doc_id, _ in results)
+
+
+@pytest.mark.parametrize('query', ['stiffen', 'stick', 'diabetes', 'diabetez', 'provider', 'runing', 'diab*',
+                                   'cancer treatment', 'the', 'zzzzzz'])
+def test_text_and_compact_query_lemmas_match(engines, query):
+    # Слово запроса лемматизируется общей таблицей, а не словарём слов индекса
+    text_engine, compact_engine = engines
+    assert text_engine._query_lemmas(query) == compact_engine._query_lemmas(query)
+
+
+def test_known_word_is_not_fuzzy_corrected(engines):
+    # stiffen нет в корпусе дословно (только stiffening), но нормализатор его знает
+    for engine in engines:
+        assert engine._query_lemmas('stiffen') == ['stiffen']
+        results = engine.search('stiffen')
+        assert results
+        assert all('stiffen' in page_lemmas(doc_id) for doc_id, _ in results)
@@ -1,79 +1,152 @@
 import os
+import json
 import math
-from collections import defaultdict
+from compact_index import build_compact_index
+from page_files import DUPLICATES_PATH, read_doc_counts, read_duplicate_ids
+from manifest import (MANIFEST_PATH, load_manifest, diff_stage, commit_stage,
+                      write_json_atomic, page_doc_id)
 
+STATS_PATH = 'tf_idf_stats.json'
 
-def calculate_tf_idf(pages_dir='pages'):
-    doc_terms = defaultdict(dict)
-    doc_lemmas = defaultdict(dict)
-    doc_lengths = defaultdict(int)
-    term_docs = defaultdict(set)
-    lemma_docs = defaultdict(set)
 
+def safe_idf(df, N):
+    return math.log((N / df) + 1)
+
+# def safe_idf(df, N):
+#     return math.log((N) / (df))
+
+
+def _write_doc(doc_dir, doc, term_idf, lemma_idf):
+    """Записывает terms_tfidf.txt и lemmas_tfidf.txt документа"""
+    length = doc['length']
+
+    # Для терминов (из tokens.txt)
+    with open(os.path.join(doc_dir, 'terms_tfidf.txt'), 'w', encoding='utf-8') as f:
+        for term, count in doc['terms'].items():
+            tf = count / length
+            tf_idf = tf * term_idf[term]
+            f.write(f"{term} {term_idf[term]:.6f} {tf_idf:.6f}\n")
+
+    # Для лемм (из lemmas.txt)
+    with open(os.path.join(doc_dir, 'lemmas_tfidf.txt'), 'w', encoding='utf-8') as f:
+        for lemma, count in doc['lemmas'].items():
+            tf = count / length
+            tf_idf = tf * lemma_idf[lemma]
+            f.write(f"{lemma} {lemma_idf[lemma]:.6f} {tf_idf:.6f}\n")
+
+
+def load_stats(stats_path=STATS_PATH):
+    """
+    Загружает сохранённую статистику корпуса
+
+    Формат: {"term_df": {...}, "lemma_df": {...},
+             "docs": {doc_id: {"terms": {...}, "lemmas": {...}, "length": n}}}
+    """
+    if not os.path.exists(stats_path):
+        return {'term_df': {}, 'lemma_df': {}, 'docs': {}}
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _page_inputs(pages_dir, exclude=()):
+    inputs = {}
     for page_dir in os.listdir(pages_dir):
-        if not page_dir.startswith('page_'):
+        if not page_dir.startswith('page_') or page_dir.endswith('.html') or page_doc_id(page_dir) in exclude:
             continue
+        tokens_path = os.path.join(pages_dir, page_dir, 'tokens.txt')
+        if os.path.exists(tokens_path):
+            inputs[page_dir] = tokens_path
+    return inputs
 
-        doc_id = int(page_dir.split('_')[1])
-        doc_path = os.path.join(pages_dir, page_dir)
 
-        # Обработка терминов из tokens.txt
-        tokens_path = os.path.join(doc_path, 'tokens.txt')
-        if os.path.exists(tokens_path):
-            with open(tokens_path, 'r', encoding='utf-8') as f:
-                terms = [line.strip() for line in f if line.strip()]
-                for term in terms:
-                    doc_terms[doc_id][term] = doc_terms[doc_id].get(term, 0) + 1
-                    term_docs[term].add(doc_id)
-                doc_lengths[doc_id] += len(terms)
-
-        # Обработка лемм из lemmas.txt
-        lemmas_path = os.path.join(doc_path, 'lemmas.txt')
-        if os.path.exists(lemmas_path):
-            with open(lemmas_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) < 2:
-                        continue
-                    lemma = parts[0]
-                    count = len(parts) - 1
-                    doc_lemmas[doc_id][lemma] = doc_lemmas[doc_id].get(lemma, 0) + count
-                    lemma_docs[lemma].add(doc_id)
-
-    # 2. Расчет IDF
-    total_docs = len(doc_lengths)
-
-    # def safe_idf(df, N):
-    #     return math.log((N) / (df))
-    def safe_idf(df, N):
-        return math.log((N / df) + 1)
+def _update_df(df, keys, delta):
+    for key in keys:
+        df[key] = df.get(key, 0) + delta
+        if df[key] <= 0:
+            del df[key]
+
+
+def calculate_tf_idf(pages_dir='pages', full=False, manifest_path=MANIFEST_PATH,
+                     stats_path=STATS_PATH, duplicates_path=DUPLICATES_PATH):
+    """
+    Расчёт TF-IDF для терминов и лемм всех документов
+
+    Частоты документов хранятся в stats_path, поэтому при добавлении,
+    изменении или удалении страниц перечитываются только они, а веса
+    остальных документов пересчитываются из сохранённой статистики и
+    перезаписываются лишь там, где изменился IDF. Почти-дубликаты из
+    duplicates_path в корпус не входят.
+    """
+    manifest = load_manifest(manifest_path)
+    # Изменение lemmas.txt без tokens.txt тоже требует пересчёта
+    inputs = _page_inputs(pages_dir, read_duplicate_ids(duplicates_path))
+    lemma_inputs = {page_name: os.path.join(pages_dir, page_name, 'lemmas.txt')
+                    for page_name in inputs
+                    if os.path.exists(os.path.join(pages_dir, page_name, 'lemmas.txt'))}
+    changed, deleted, entries = diff_stage(manifest, 'tf_idf', inputs)
+    lemma_changed, _, lemma_entries = diff_stage(manifest, 'tf_idf_lemmas', lemma_inputs)
+    changed |= lemma_changed
+
+    stats = load_stats(stats_path)
+    if full or 'tf_idf' not in manifest['stages'] or not stats['docs']:
+        stats = {'term_df': {}, 'lemma_df': {}, 'docs': {}}
+        changed, deleted = set(inputs), set()
+
+    term_df, lemma_df, docs = stats['term_df'], stats['lemma_df'], stats['docs']
+    old_total = len(docs)
+    old_term_idf = {term: safe_idf(df, old_total) for term, df in term_df.items()}
+    old_lemma_idf = {lemma: safe_idf(df, old_total) for lemma, df in lemma_df.items()}
+
+    # 1. Вычитаем старые вклады изменённых и удалённых документов
+    for page_name in changed | deleted:
+        old_doc = docs.pop(str(page_doc_id(page_name)), None)
+        if old_doc:
+            _update_df(term_df, old_doc['terms'], -1)
+            _update_df(lemma_df, old_doc['lemmas'], -1)
+
+    # 2. Читаем только новые и изменённые документы
+    for page_name in changed:
+        doc = read_doc_counts(os.path.join(pages_dir, page_name))
+        if doc is None:
+            continue
+        terms_count, lemmas_count, length = doc
+        docs[str(page_doc_id(page_name))] = {'terms': terms_count, 'lemmas': lemmas_count,
+                                             'length': length}
+        _update_df(term_df, terms_count, 1)
+        _update_df(lemma_df, lemmas_count, 1)
+
+    # 3. Расчет IDF
+    total_docs = len(docs)
 
     # IDF для терминов
-    term_idf = {term: safe_idf(len(docs), total_docs)
-                for term, docs in term_docs.items()}
+    term_idf = {term: safe_idf(df, total_docs) for term, df in term_df.items()}
 
     # IDF для лемм
-    lemma_idf = {lemma: safe_idf(len(docs), total_docs)
-                 for lemma, docs in lemma_docs.items()}
+    lemma_idf = {lemma: safe_idf(df, total_docs) for lemma, df in lemma_df.items()}
 
-    # 3. Расчет и сохранение TF-IDF
-    for doc_id in doc_lengths:
-        doc_dir = os.path.join(pages_dir, f'page_{doc_id}')
+    # 4. Расчет и сохранение TF-IDF только там, где веса могли измениться
+    changed_ids = {str(page_doc_id(page_name)) for page_name in changed}
+    if total_docs != old_total:
+        affected = set(docs)
+    else:
+        changed_terms = {term for term, idf in term_idf.items() if old_term_idf.get(term) != idf}
+        changed_lemmas = {lemma for lemma, idf in lemma_idf.items()
+                          if old_lemma_idf.get(lemma) != idf}
+        affected = {doc_id for doc_id, doc in docs.items()
+                    if doc_id in changed_ids or
+                    not changed_terms.isdisjoint(doc['terms']) or
+                    not changed_lemmas.isdisjoint(doc['lemmas'])}
 
-        # Для терминов (из tokens.txt)
-        with open(os.path.join(doc_dir, 'terms_tfidf.txt'), 'w', encoding='utf-8') as f:
-            for term, count in doc_terms[doc_id].items():
-                tf = count / doc_lengths[doc_id]
-                tf_idf = tf * term_idf[term]
-                f.write(f"{term} {term_idf[term]:.6f} {tf_idf:.6f}\n")
+    for doc_id in affected:
+        doc_dir = os.path.join(pages_dir, f'page_{doc_id}')
+        _write_doc(doc_dir, docs[doc_id], term_idf, lemma_idf)
 
-        # Для лемм (из lemmas.txt)
-        with open(os.path.join(doc_dir, 'lemmas_tfidf.txt'), 'w', encoding='utf-8') as f:
-            for lemma, count in doc_lemmas[doc_id].items():
-                tf = count / doc_lengths[doc_id]
-                tf_idf = tf * lemma_idf[lemma]
-                f.write(f"{lemma} {lemma_idf[lemma]:.6f} {tf_idf:.6f}\n")
+    write_json_atomic(stats, stats_path)
+    commit_stage(manifest, 'tf_idf', entries, manifest_path)
+    commit_stage(manifest, 'tf_idf_lemmas', lemma_entries, manifest_path)
+    return affected
 
 
 if __name__ == '__main__':
-    calculate_tf_idf()
\ No newline at end of file
+    calculate_tf_idf()
+    build_compact_index()
@@ -1,68 +1,218 @@
 import os
-import re
-import spacy
+import json
+import time
+import shutil
+import tempfile
+import argparse
+from multiprocessing import Pool
 from bs4 import BeautifulSoup
-import nltk
-from nltk.corpus import words
+from manifest import MANIFEST_PATH, load_manifest, diff_stage, commit_stage, page_doc_id
+from dedup import DUPLICATES_PATH, DuplicateIndex, positions_signature
+from doc_store import build_doc_store, document_from_soup, iter_html_pages
+from normalizer import clean_text, tokenize, get_normalizer
+from page_files import DOCUMENT_FILE, read_duplicate_ids, remove_page_outputs
 
-nltk.download('words')
-nltk.download('punkt')
-nltk.download('stopwords')
+normalizer = None
 
-nlp = spacy.load('en_core_web_sm')
 
-english_words = set(words.words())
-stop_words = set(nltk.corpus.stopwords.words('english'))
+def load_resources():
+    """Открывает таблицу нормализации (один раз на процесс)"""
+    global normalizer
+    if normalizer is None:
+        normalizer = get_normalizer()
 
-def clean_text(text):
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\d+', '', text)
-    text = re.sub(r'[^\w\s]', '', text)
-    text = text.lower()
-    return text
-
-def tokenize(text):
-    tokens = re.findall(r'\b[a-zA-Z]+\b', text)
-    return tokens
 
 def lemmatize(tokens):
-    lemmas = {}
-    for token in tokens:
-        doc = nlp(token)
-        lemma = doc[0].lemma_
-        if lemma not in lemmas:
-            lemmas[lemma] = set()
-        lemmas[lemma].add(token)
-    return lemmas
-
-def process_documents(directory):
-    for filename in os.listdir(directory):
-        if filename.endswith('.html'):
-            page_name = filename.replace('.html', '')
-            output_dir = os.path.join(directory, page_name)
-            os.makedirs(output_dir, exist_ok=True)
-
-            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as file:
-                soup = BeautifulSoup(file, 'html.parser')
-                text = soup.get_text()
-                cleaned_text = clean_text(text)
-                tokens = tokenize(cleaned_text)
-                filtered_tokens = set()
-                for token in tokens:
-                    if (token in english_words and
-                        token not in stop_words and
-                        len(token) > 2 and
-                        nlp(token)[0].pos_ != 'PROPN'):
-                        filtered_tokens.add(token)
-                lemmas = lemmatize(filtered_tokens)
-
-                with open(os.path.join(output_dir, 'tokens.txt'), 'w', encoding='utf-8') as f:
-                    for token in sorted(filtered_tokens):
-                        f.write(f"{token}\n")
-                with open(os.path.join(output_dir, 'lemmas.txt'), 'w', encoding='utf-8') as f:
-                    for lemma, words in sorted(lemmas.items()):
-                        if lemma in english_words:
-                            f.write(f"{lemma} {' '.join(sorted(words))}\n")
-
-            print(f"Processed {filename} and saved results to {output_dir}")
-process_documents('pages')
\ No newline at end of file
+    load_resources()
+    return normalizer.lemmatize(tokens)
+
+def analyze_tokens(tokens):
+    """
+    Отбирает токены страницы для индекса и группирует их по леммам
+
+    Словарь, стоп-слова и леммы берутся из таблицы нормализации — той же,
+    что используют поисковые движки при разборе запроса.
+
+    :param tokens: уникальные токены страницы
+    :return: (множество индексируемых токенов, словарь {лемма: множество токенов})
+    """
+    load_resources()
+    filtered_tokens = {token for token in tokens if normalizer.is_indexable(token)}
+    return filtered_tokens, normalizer.lemmatize(filtered_tokens)
+
+def write_page_files(output_dir, files):
+    """
+    Атомарно записывает файлы каталога страницы
+
+    Файлы сначала пишутся во временный каталог рядом с output_dir и только
+    затем переносятся на место, поэтому читатель никогда не увидит
+    частично записанный результат.
+
+    :param output_dir: каталог страницы page_N
+    :param files: словарь {имя файла: итерируемое строк без перевода строки}
+    """
+    parent = os.path.dirname(output_dir) or '.'
+    staging_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(output_dir) + '.', dir=parent)
+    try:
+        for name, lines in files.items():
+            with open(os.path.join(staging_dir, name), 'w', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(f"{line}\n")
+
+        if not os.path.exists(output_dir):
+            os.rename(staging_dir, output_dir)
+            return
+        for name in files:
+            os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+def _write_page_output(output_dir, filtered_tokens, lemmas, positions, document):
+    """
+    Атомарно записывает tokens.txt, lemmas.txt и document.json страницы
+
+    Строка tokens.txt: "токен число_вхождений".
+    """
+    write_page_files(output_dir, {
+        'tokens.txt': [f"{token} {len(positions[token])}" for token in sorted(filtered_tokens)],
+        'lemmas.txt': [f"{lemma} {' '.join(sorted(words))}"
+                       for lemma, words in sorted(lemmas.items())],
+        DOCUMENT_FILE: [json.dumps(document, ensure_ascii=False)],
+    })
+
+def analyze_page(path, with_positions=False, with_document=False):
+    """
+    Разбирает HTML-страницу
+
+    :param with_positions: дополнительно вернуть позиции токенов в тексте
+    :param with_document: дополнительно вернуть запись для хранилища документов
+        (doc_store.document_from_soup) — из того же разбора HTML
+    :return: (множество отфильтрованных токенов, словарь {лемма: множество токенов}),
+        затем при with_positions словарь {токен: список позиций} (позиции
+        считаются по всем словам страницы, включая стоп-слова), при
+        with_document — словарь {"title", "summary", "text"}
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        soup = BeautifulSoup(file, 'html.parser')
+    text = soup.get_text()
+    cleaned_text = clean_text(text)
+    tokens = tokenize(cleaned_text)
+    filtered_tokens, lemmas = analyze_tokens(set(tokens))
+    result = [filtered_tokens, lemmas]
+
+    if with_positions:
+        positions = {}
+        for position, token in enumerate(tokens):
+            if token in filtered_tokens:
+                positions.setdefault(token, []).append(position)
+        result.append(positions)
+    if with_document:
+        # document_from_soup вырезает навигацию из soup, поэтому после токенов
+        result.append(document_from_soup(soup))
+    return tuple(result)
+
+def process_page(path, output_dir):
+    """
+    Обрабатывает одну страницу и записывает результат в её каталог page_N
+
+    :return: сигнатура MinHash для поиска почти-дубликатов
+    """
+    filtered_tokens, lemmas, positions, document = analyze_page(path, with_positions=True, with_document=True)
+    _write_page_output(output_dir, filtered_tokens, lemmas, positions, document)
+    return positions_signature(positions)
+
+def _process_page_task(args):
+    path, output_dir = args
+    return path, output_dir, process_page(path, output_dir)
+
+def process_documents(directory, workers=1, full=False, manifest_path=MANIFEST_PATH,
+                      duplicates_path=DUPLICATES_PATH):
+    """
+    Обрабатывает страницы каталога
+
+    По умолчанию обрабатываются только новые и изменённые страницы (по
+    манифесту с хэшами), а каталоги удалённых страниц удаляются. Смена
+    версии таблицы нормализации переобрабатывает все страницы.
+
+    Обработанные страницы проверяются на почти-дубликаты (dedup.py): у
+    дубликата производные файлы удаляются, поэтому inverted_index.py и
+    tf_idf.py его не видят. Дубликаты удалённой страницы обрабатываются
+    заново — одна из них становится канонической.
+
+    :param directory: каталог со страницами page_N.html или page_N/page_N.html
+    :param workers: число процессов; при workers > 1 страницы распределяются по пулу
+    :param full: обработать все страницы независимо от манифеста
+    :param manifest_path: путь к манифесту
+    :param duplicates_path: состояние поиска почти-дубликатов (None — не искать)
+    :return: (множество обработанных страниц, множество удалённых страниц)
+    """
+    load_resources()
+    manifest = load_manifest(manifest_path)
+    if manifest.get('normalizer') != normalizer.version:
+        full = True
+    inputs = {f'page_{doc_id}': path for doc_id, path in iter_html_pages(directory)}
+    changed, deleted, entries = diff_stage(manifest, 'tokenizer', inputs)
+    if full:
+        changed = set(inputs)
+    duplicates = DuplicateIndex(duplicates_path) if duplicates_path is not None else None
+    if duplicates is not None:
+        removed = {page_doc_id(page_name) for page_name in deleted}
+        changed |= {page_name for page_name in inputs
+                    if duplicates.duplicates.get(page_doc_id(page_name)) in removed}
+    changed |= {page_name for page_name in inputs
+                if not os.path.exists(os.path.join(directory, page_name, 'lemmas.txt'))
+                and not (duplicates is not None and duplicates.is_duplicate(page_doc_id(page_name)))}
+
+    for page_name in sorted(deleted):
+        shutil.rmtree(os.path.join(directory, page_name), ignore_errors=True)
+        print(f"Removed {page_name}")
+
+    tasks = [(inputs[page_name], os.path.join(directory, page_name)) for page_name in sorted(changed)]
+    start = time.perf_counter()
+    signatures = {}
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(processes=min(workers, len(tasks)), initializer=load_resources) as pool:
+            for path, output_dir, signature in pool.imap_unordered(_process_page_task, tasks):
+                signatures[os.path.basename(output_dir)] = signature
+                print(f"Processed {path} and saved results to {output_dir}")
+    else:
+        for task in tasks:
+            path, output_dir, signature = _process_page_task(task)
+            signatures[os.path.basename(output_dir)] = signature
+            print(f"Processed {path} and saved results to {output_dir}")
+
+    if duplicates is not None:
+        duplicates.forget(page_doc_id(page_name) for page_name in changed | deleted)
+        skipped = 0
+        # По возрастанию doc_id, как в pipeline.py: из обработанных страниц
+        # канонической становится страница с меньшим номером
+        for page_name in sorted(signatures, key=page_doc_id):
+            doc_id = page_doc_id(page_name)
+            if duplicates.add(doc_id, signatures[page_name]) != doc_id:
+                remove_page_outputs(os.path.join(directory, page_name))
+                skipped += 1
+        duplicates.save()
+        print(f"Skipped {skipped} near-duplicate pages")
+
+    elapsed = time.perf_counter() - start
+    rate = len(tasks) / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {len(tasks)} pages in {elapsed:.2f}s ({rate:.2f} pages/sec, workers={workers}), "
+          f"skipped {len(inputs) - len(tasks)} unchanged")
+
+    manifest['normalizer'] = normalizer.version
+    commit_stage(manifest, 'tokenizer', entries, manifest_path)
+    return changed, deleted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Токенизация и лемматизация страниц')
+    parser.add_argument('directory', nargs='?', default='pages')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--full', action='store_true', help='обработать все страницы заново')
+    args = parser.parse_args()
+    changed, _ = process_documents(args.directory, workers=args.workers, full=args.full)
+    # Заголовки и тексты для сниппетов извлечены при разборе страниц; в
+    # хранилище обновляются только записи обработанных страниц
+    build_doc_store(args.directory, workers=args.workers, exclude=read_duplicate_ids(),
+                    changed={page_doc_id(page_name) for page_name in changed})
@@ -1,38 +1,88 @@
 import os
+import json
 import math
 import re
-from collections import defaultdict
+import heapq
+from collections import defaultdict, Counter
+from contextlib import ExitStack
 from typing import Dict, List, Tuple, Set
+from bm25 import BM25_K1, BM25_B, bm25_idf, bm25_weight
+from compact_index import CompactIndex
+from lsa import LsaIndex
+from manifest import MANIFEST_PATH
+from metrics import QueryTrace, run_hooks
+from page_files import read_doc_counts
+from normalizer import get_normalizer
+from query_cache import LRUCache, index_version
+from term_dict import MAX_EXPANSIONS, is_pattern
+
+_MISSING = object()
+# Режимы поиска: по леммам, в латентном пространстве LSA и их смесь
+MODES = ('lexical', 'semantic', 'hybrid')
+# Доля лексического скора в гибридном режиме
+HYBRID_WEIGHT = 0.5
 
 
 class VectorSearch:
-    def __init__(self, pages_dir='pages', index_path='inverted_index.txt'):
+    def __init__(self, pages_dir='pages', index_path='inverted_index.txt', compact_path=None,
+                 cache_size=1024, cache_ttl=None, ranking='cosine', k1=BM25_K1, b=BM25_B,
+                 collection_path=None, normalizer=None, lsa_path=None, mode='lexical',
+                 hybrid_weight=HYBRID_WEIGHT):
+        if ranking not in ('cosine', 'bm25'):
+            raise ValueError(f'Неизвестный способ ранжирования: {ranking}')
+        if mode not in MODES:
+            raise ValueError(f'Неизвестный режим поиска: {mode}')
+        if mode != 'lexical' and lsa_path is None:
+            raise ValueError(f'Для режима {mode} нужна латентная модель (lsa.py)')
         self.pages_dir = pages_dir
-        self.lemmas_map = self._build_lemmas_map()
-        self.inverted_index = self._load_inverted_index(index_path)
-        self.doc_vectors, self.doc_norms = self._load_tfidf_vectors()
+        self.ranking = ranking
+        self.mode = mode
+        self.hybrid_weight = hybrid_weight
+        self.k1 = k1
+        self.b = b
+        # Слова запроса приводятся к леммам той же таблицей, что и при индексации
+        self.normalizer = normalizer or get_normalizer()
+        # Кэши привязаны к версии индекса: пересобранный индекс даёт новый штамп
+        self.index_version = index_version(compact_path or index_path, MANIFEST_PATH, self.normalizer.path,
+                                           lsa_path)
+        # Латентная модель (lsa.py) для семантического и гибридного режимов
+        self.lsa = LsaIndex(lsa_path) if lsa_path is not None else None
+        # Для шарда DF, число документов и avgdl берутся по всему корпусу
+        self.collection = None
+        if collection_path is not None:
+            with open(collection_path, 'r', encoding='utf-8') as f:
+                self.collection = json.load(f)
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        self.lemma_cache = LRUCache(cache_size * 8, cache_ttl)
+        # Хуки получают QueryTrace каждого запроса (metrics.Metrics, metrics.SlowQueryLog)
+        self.hooks = []
+        self.compact_index = None
+        if compact_path is not None:
+            # Бинарный индекс: словари заменяются представлениями поверх mmap
+            self.compact_index = CompactIndex(compact_path)
+            self.inverted_index = self.compact_index.postings_map
+            self.doc_vectors = None
+            self.doc_norms = self.compact_index.norms_map
+        else:
+            self.inverted_index = self._load_inverted_index(index_path)
+            self.doc_vectors, self.doc_norms = self._load_tfidf_vectors()
+        # Словарь слов для запросов с * и ? и для слов с опечатками
+        if self.compact_index is not None:
+            self.term_dict = self.compact_index.word_dictionary()
+        else:
+            self.term_dict = self.normalizer.word_dictionary()
         self.common_lemmas = self._identify_common_lemmas()
-
-    def _build_lemmas_map(self) -> Dict[str, str]:
-        """Строит словарь {слово: лемма} из всех файлов lemmas.txt"""
-        lemmas_map = {}
-        for page_dir in os.listdir(self.pages_dir):
-            if not page_dir.startswith('page_'):
-                continue
-
-            lemmas_path = os.path.join(self.pages_dir, page_dir, 'lemmas.txt')
-            if not os.path.exists(lemmas_path):
-                continue
-
-            with open(lemmas_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) < 2:
-                        continue
-                    lemma = parts[0]
-                    for word in parts[1:]:
-                        lemmas_map[word] = lemma
-        return lemmas_map
+        if ranking == 'bm25':
+            self._load_term_frequencies()
+        self._prepare_scoring()
+
+    def close(self):
+        """Закрывает mmap-файлы индекса; таблицу нормализации закрывает её владелец"""
+        if self.compact_index is not None:
+            self.compact_index.close()
+        if self.lsa is not None:
+            self.lsa.close()
+        self.inverted_index = self.doc_norms = self.term_dict = None
 
     def _load_inverted_index(self, index_path='inverted_index.txt') -> Dict[str, List[int]]:
         """Загружает обратный индекс из файла"""
@@ -48,10 +98,116 @@ class VectorSearch:
 
     def _identify_common_lemmas(self) -> Set[str]:
         """Определяет леммы, встречающиеся во всех документах"""
+        if self.collection is not None:
+            n_docs = self.collection['n_docs']
+            return {lemma for lemma, df in self.collection['df'].items() if df == n_docs}
+        if self.compact_index is not None:
+            index = self.compact_index
+            return {index.term(term_id) for term_id in range(index.n_terms)
+                    if index.df(term_id) == index.n_docs}
         total_docs = len([d for d in os.listdir(self.pages_dir) if d.startswith('page_')])
         return {lemma for lemma, docs in self.inverted_index.items()
                 if len(docs) == total_docs}
 
+    def _prepare_scoring(self):
+        """
+        Готовит плотную нумерацию документов для массива аккумуляторов,
+        предвычисленные нормы и верхние границы вклада лемм (для MaxScore)
+        """
+        self._doc_ids = sorted(self.doc_norms)
+        self._doc_index = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+        self._norms = [self.doc_norms[doc_id] for doc_id in self._doc_ids]
+
+        self._max_scores = {}
+        if self.compact_index is None:
+            for doc_id, vector in self.doc_vectors.items():
+                norm = self.doc_norms.get(doc_id)
+                if not norm:
+                    continue
+                for lemma, weight in vector.items():
+                    if weight / norm > self._max_scores.get(lemma, 0.0):
+                        self._max_scores[lemma] = weight / norm
+
+    def _max_score(self, lemma: str) -> float:
+        """Верхняя граница weight / doc_norm по всем документам леммы"""
+        if self.compact_index is not None:
+            term_id = self.compact_index.term_id(lemma)
+            return self.compact_index.max_score(term_id) if term_id >= 0 else 0.0
+        return self._max_scores.get(lemma, 0.0)
+
+    def _term_weights(self, lemma: str) -> List[Tuple[int, float]]:
+        """Возвращает список (doc_id, tf-idf) для леммы"""
+        if self.compact_index is not None:
+            term_id = self.compact_index.term_id(lemma)
+            return self.compact_index.term_weights(term_id) if term_id >= 0 else []
+        return [(doc_id, self.doc_vectors[doc_id][lemma])
+                for doc_id in self.inverted_index.get(lemma, [])
+                if doc_id in self.doc_vectors and lemma in self.doc_vectors[doc_id]]
+
+    def _load_term_frequencies(self):
+        """
+        Загружает частоты лемм и длины документов для BM25
+
+        Для бинарного индекса они уже лежат в index.bin, для текстового
+        читаются из tokens.txt и lemmas.txt страниц.
+        """
+        self._bm25_bounds = {}
+        if self.compact_index is not None:
+            index = self.compact_index
+            self.doc_lengths = dict(zip(index.doc_ids.tolist(), index.doc_lengths.tolist()))
+            self.avgdl = index.avgdl
+            self._tfs = None
+            return
+
+        self.doc_lengths = {}
+        self._tfs = defaultdict(list)
+        for doc_id in sorted(self.doc_norms):
+            counts = read_doc_counts(os.path.join(self.pages_dir, f'page_{doc_id}'))
+            self.doc_lengths[doc_id] = counts[2] if counts else 0
+            if counts is None:
+                continue
+            for lemma, tf in counts[1].items():
+                self._tfs[lemma].append((doc_id, tf))
+        self._tfs = dict(self._tfs)
+        if self.collection is not None:
+            self.avgdl = self.collection['avgdl']
+        else:
+            self.avgdl = sum(self.doc_lengths.values()) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def _term_tfs(self, lemma: str) -> List[Tuple[int, int]]:
+        """Возвращает список (doc_id, число вхождений) для леммы"""
+        if self.compact_index is not None:
+            term_id = self.compact_index.term_id(lemma)
+            return self.compact_index.term_tfs(term_id) if term_id >= 0 else []
+        return self._tfs.get(lemma, [])
+
+    def _bm25_weights(self, lemma: str) -> List[Tuple[int, float]]:
+        """Возвращает список (doc_id, BM25-вклад леммы) для одного вхождения в запрос"""
+        tfs = self._term_tfs(lemma)
+        if self.collection is not None:
+            idf = bm25_idf(self.collection['df'].get(lemma, 0), self.collection['n_docs'])
+        else:
+            idf = bm25_idf(len(tfs), len(self.doc_norms))
+        return [(doc_id, bm25_weight(tf, idf, self.doc_lengths.get(doc_id, 0), self.avgdl, self.k1, self.b))
+                for doc_id, tf in tfs]
+
+    def _bm25_max(self, lemma: str) -> float:
+        """
+        Верхняя граница BM25-вклада леммы
+
+        Берётся из index.bin, если индекс собран с теми же k1 и b, иначе
+        вычисляется по постингам один раз и запоминается.
+        """
+        index = self.compact_index
+        if index is not None and (index.bm25_k1, index.bm25_b) == (self.k1, self.b):
+            term_id = index.term_id(lemma)
+            return index.bm25_max_score(term_id) if term_id >= 0 else 0.0
+        bound = self._bm25_bounds.get(lemma)
+        if bound is None:
+            bound = self._bm25_bounds[lemma] = max(
+                (weight for _, weight in self._bm25_weights(lemma)), default=0.0)
+        return bound
+
     def _load_tfidf_vectors(self) -> Tuple[Dict[int, Dict[str, float]], Dict[int, float]]:
         """Загружает TF-IDF векторы и вычисляет их нормы"""
         doc_vectors = {}
@@ -83,64 +239,310 @@ class VectorSearch:
 
         return doc_vectors, doc_norms
 
-    def search(self, query: str, top_n: int = 5) -> List[Tuple[int, float]]:
-        """Поиск с учетом общих терминов"""
-        words = re.findall(r'\w+', query.lower())
-        query_lemmas = [self.lemmas_map[word]
-                        for word in words
-                        if word in self.lemmas_map]
-
-        if not query_lemmas:
-            print("Не найдено лемм для поиска.")
-            return []
-
-
-        # Строим вектор запроса
+    @staticmethod
+    def _query_words(query: str) -> List[str]:
+        """Слова запроса; * и ? внутри слова — шаблон, ? в конце — знак вопроса"""
+        words = (word.rstrip('?') for word in re.findall(r'[\w*?]*\w[\w*?]*', query.lower()))
+        return [word for word in words if word.strip('*?')]
+
+    def _is_indexed(self, lemma: str) -> bool:
+        """Есть ли лемма в индексе (для шарда — во всём корпусе)"""
+        if self.collection is not None:
+            return lemma in self.collection['df']
+        return lemma in self.inverted_index
+
+    def _expand_word(self, word: str) -> Tuple[str, ...]:
+        """
+        Леммы слова запроса, которые есть в индексе
+
+        Слово из словаря нормализатора даёт свою лемму — ту же, что при
+        индексации, в обоих видах индекса. Шаблон даёт леммы подходящих слов
+        словаря, а неизвестное нормализатору слово — леммы ближайших слов по
+        расстоянию Левенштейна; не больше MAX_EXPANSIONS слов.
+        """
+        if is_pattern(word):
+            words = self.term_dict.wildcard(word, MAX_EXPANSIONS)
+        elif self.normalizer.in_dictionary(word):
+            lemma = self.normalizer.lemma(word)
+            return (lemma,) if lemma is not None and self._is_indexed(lemma) else ()
+        elif not word.isalpha() or self.normalizer.is_stopword(word):
+            return ()
+        else:
+            words = [match for match, _ in self.term_dict.fuzzy(word, limit=MAX_EXPANSIONS)]
+        lemmas = (self.normalizer.lemma(match) for match in words)
+        return tuple(dict.fromkeys(lemma for lemma in lemmas if lemma is not None and self._is_indexed(lemma)))
+
+    def _query_lemmas(self, query: str) -> List[str]:
+        """Приводит слова запроса к леммам (с расширением шаблонов и опечаток), отбрасывая неизвестные"""
+        query_lemmas = []
+        for word in self._query_words(query):
+            key = (self.index_version, word)
+            lemmas = self.lemma_cache.get(key, _MISSING)
+            if lemmas is _MISSING:
+                lemmas = self._expand_word(word)
+                self.lemma_cache.put(key, lemmas)
+            query_lemmas.extend(lemmas)
+        return query_lemmas
+
+    def query_lemmas(self, query: str) -> Set[str]:
+        """Множество лемм запроса (например, для подсветки в сниппетах)"""
+        return set(self._query_lemmas(query))
+
+    def _query_vector(self, query_lemmas: List[str]) -> Dict[str, float]:
+        """Строит вектор запроса с учетом общих терминов"""
+        if self.ranking == 'bm25':
+            # BM25 суммирует вклады по вхождениям лемм в запрос
+            return dict(Counter(query_lemmas))
         query_vector = {}
-        for lemma in set(query_lemmas):
+        for lemma, count in Counter(query_lemmas).items():
             if lemma in self.common_lemmas:
                 # Для общих лемм используем TF (частоту в запросе)
-                query_vector[lemma] = query_lemmas.count(lemma) / len(query_lemmas)
+                query_vector[lemma] = count / len(query_lemmas)
             else:
                 # Для остальных лемм используем бинарный вес
                 query_vector[lemma] = 1
+        return query_vector
+
+    def _kth_score(self, acc: List[float], touched: List[int], top_n: int, finalize) -> float:
+        """Текущий k-й по величине (частичный) итоговый скор кандидатов"""
+        if len(touched) < top_n:
+            return 0.0
+        scores = heapq.nlargest(top_n, (finalize(i, acc[i]) for i in touched))
+        return scores[-1] if len(scores) == top_n else 0.0
+
+    def _score(self, query_vector: Dict[str, float], query_norm: float, top_n: int,
+               prune: bool = False, trace: QueryTrace = None) -> List[Tuple[int, float]]:
+        """Оценивает документы выбранным способом ранжирования"""
+        if trace is None:
+            trace = QueryTrace()
+        if self.ranking == 'bm25':
+            # Чтение и декодирование постингов — часть этапа candidates
+            with trace.stage('candidates'):
+                terms = [(self._bm25_weights(lemma), q_weight, q_weight * self._bm25_max(lemma))
+                         for lemma, q_weight in query_vector.items()]
+            return self._term_at_a_time(terms, top_n, prune, lambda i, score: score, trace)
+
+        if query_norm == 0:
+            return []
+        norms = self._norms
+
+        def cosine(i, score):
+            return min(score / (query_norm * norms[i]), 1.0) if norms[i] else 0.0
+
+        with trace.stage('candidates'):
+            terms = [(self._term_weights(lemma), q_weight, q_weight * self._max_score(lemma) / query_norm)
+                     for lemma, q_weight in query_vector.items()]
+        return self._term_at_a_time(terms, top_n, prune, cosine, trace)
+
+    def _term_at_a_time(self, terms, top_n: int, prune: bool, finalize,
+                        trace: QueryTrace = None) -> List[Tuple[int, float]]:
+        """
+        Term-at-a-time: постинги лемм запроса проходятся по очереди,
+        вклады копятся в массиве аккумуляторов, а top-k выбирается
+        ограниченной кучей.
+
+        При prune=True применяется MaxScore: леммы идут по убыванию верхней
+        границы вклада, и как только сумма границ оставшихся лемм меньше
+        текущего k-го скора, новые документы в кандидаты не добавляются.
+
+        :param terms: список (постинги [(doc_id, вес)], вес в запросе,
+            верхняя граница вклада в итоговый скор)
+        :param finalize: функция (номер документа, аккумулятор) -> итоговый скор
+        :param trace: трасса запроса для этапов candidates, scoring, sort
+        """
+        if top_n <= 0:
+            return []
+        if trace is None:
+            trace = QueryTrace()
+
+        acc = [0.0] * len(self._doc_ids)
+        seen = bytearray(len(self._doc_ids))
+        touched = []
+        doc_index = self._doc_index
+
+        with trace.stage('candidates'):
+            if prune:
+                terms = sorted(terms, key=lambda term: term[2], reverse=True)
+                remaining = sum(bound for _, _, bound in terms)
+
+            for postings, q_weight, bound in terms:
+                essential = True
+                if prune:
+                    essential = remaining >= self._kth_score(acc, touched, top_n, finalize)
+                    remaining -= bound
+
+                trace.count('postings', len(postings))
+                for doc_id, doc_weight in postings:
+                    i = doc_index.get(doc_id)
+                    if i is None:
+                        continue
+                    if not seen[i]:
+                        if not essential:
+                            continue
+                        seen[i] = 1
+                        touched.append(i)
+                    acc[i] += q_weight * doc_weight
+
+        # Держим кучу из top_n лучших по итоговому скору
+        trace.count('candidates', len(touched))
+        heap = []
+        with trace.stage('scoring'):
+            for i in touched:
+                score = finalize(i, acc[i])
+                if score <= 1e-6:
+                    continue
 
-        query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
-
-        # Находим релевантные документы
-        relevant_docs = set()
-        for lemma in query_lemmas:
-            if lemma in self.inverted_index:
-                relevant_docs.update(self.inverted_index[lemma])
+                item = (score, -self._doc_ids[i])
+                if len(heap) < top_n:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        with trace.stage('sort'):
+            return [(-neg_doc_id, score) for score, neg_doc_id in sorted(heap, reverse=True)]
+
+    def _check_mode(self, mode):
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError(f'Неизвестный режим поиска: {mode}')
+        if mode != 'lexical' and self.lsa is None:
+            raise ValueError(f'Для режима {mode} нужна латентная модель (lsa.py)')
+        return mode
+
+    def _score_hybrid(self, query_vector: Dict[str, float], query_norm: float, query_lemmas: List[str],
+                      top_n: int, trace: QueryTrace) -> List[Tuple[int, float]]:
+        """
+        Смесь лексического и латентного скоров: w * lexical + (1 - w) * max(latent, 0)
+
+        Лексический скор берётся по всем кандидатам (BM25 делится на
+        лучший скор запроса), латентный — для них же и для top_n лучших по
+        латентной близости. Документ вне обоих множеств не может обойти
+        латентный top_n, поэтому результат точный.
+        """
+        weight = self.hybrid_weight
+        lexical = dict(self._score(query_vector, query_norm, len(self._doc_ids), False, trace))
+        if self.ranking == 'bm25' and lexical:
+            best = max(lexical.values())
+            lexical = {doc_id: score / best for doc_id, score in lexical.items()}
+        with trace.stage('latent'):
+            latent_vector = self.lsa.query_vector(Counter(query_lemmas))
+            latent = {}
+            if latent_vector is not None:
+                latent = dict(self.lsa.search([latent_vector], top_n)[0])
+                doc_ids = [doc_id for doc_id in lexical if doc_id not in latent]
+                latent.update(zip(doc_ids, self.lsa.scores(latent_vector, doc_ids).tolist()))
+        with trace.stage('sort'):
+            scores = {doc_id: weight * lexical.get(doc_id, 0.0) + (1 - weight) * max(latent.get(doc_id, 0.0), 0.0)
+                      for doc_id in lexical.keys() | latent.keys()}
+            ranked = sorted(((score, doc_id) for doc_id, score in scores.items() if score > 1e-6),
+                            key=lambda item: (-item[0], item[1]))
+            return [(doc_id, score) for score, doc_id in ranked[:top_n]]
+
+    def search(self, query: str, top_n: int = 5, prune: bool = False, mode: str = None) -> List[Tuple[int, float]]:
+        """
+        Поиск с учетом общих терминов
+
+        :param query: текст запроса
+        :param top_n: число результатов
+        :param prune: отсекать документы по верхним границам (MaxScore)
+        :param mode: lexical, semantic или hybrid (по умолчанию режим движка)
+        :return: список (doc_id, косинусная близость или BM25-скор), по убыванию скора
+        """
+        mode = self._check_mode(mode)
+        trace = QueryTrace('vector', query)
+        key = (self.index_version, ' '.join(self._query_words(query)), top_n, prune, mode)
+        results = self.result_cache.get(key)
+        if results is not None:
+            trace.count('cache_hits')
+            run_hooks(self.hooks, trace)
+            return list(results)
+
+        with trace.stage('lemmas'):
+            query_lemmas = self._query_lemmas(query)
+        if not query_lemmas:
+            print("Не найдено лемм для поиска.")
+            run_hooks(self.hooks, trace)
+            return []
 
-        # Вычисляем косинусную близость
-        results = []
-        for doc_id in relevant_docs:
-            if doc_id not in self.doc_vectors:
+        query_vector = self._query_vector(query_lemmas)
+        query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+        trace.plan = {'ranking': self.ranking, 'mode': mode, 'top_n': top_n, 'prune': prune,
+                      'terms': query_vector}
+        if mode == 'semantic':
+            with trace.stage('latent'):
+                results = self.lsa.search([self.lsa.query_vector(Counter(query_lemmas))], top_n)[0]
+        elif mode == 'hybrid':
+            results = self._score_hybrid(query_vector, query_norm, query_lemmas, top_n, trace)
+        else:
+            results = self._score(query_vector, query_norm, top_n, prune, trace)
+        self.result_cache.put(key, tuple(results))
+        run_hooks(self.hooks, trace)
+        return results
+
+    def search_batch(self, queries: List[str], top_n: int = 5, mode: str = None) -> List[List[Tuple[int, float]]]:
+        """
+        Пакетный поиск: список результатов search в порядке запросов
+
+        В семантическом режиме запросы, которых нет в кэше результатов,
+        оцениваются одним проходом по матрице документов (LsaIndex.search).
+        """
+        mode = self._check_mode(mode)
+        if mode != 'semantic':
+            return [self.search(query, top_n, mode=mode) for query in queries]
+        lsa = self.lsa
+        return self._cached_batch(queries, top_n, mode, 'latent', lambda batch: lsa.search(
+            [lsa.query_vector(Counter(query_lemmas)) for query_lemmas in batch], top_n))
+
+    def _cached_batch(self, queries: List[str], top_n: int, mode: str, stage: str,
+                      score_batch) -> List[List[Tuple[int, float]]]:
+        """
+        Пакетный поиск через кэш результатов, трассы и хуки — как у search
+
+        Запросы, которых нет в кэше, оцениваются одним вызовом score_batch
+        (список лемм каждого запроса -> список результатов); этап stage в
+        трассе каждого такого запроса — время всего вызова.
+        """
+        results = [None] * len(queries)
+        misses = []
+        for i, query in enumerate(queries):
+            trace = QueryTrace('vector', query)
+            key = (self.index_version, ' '.join(self._query_words(query)), top_n, False, mode)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                trace.count('cache_hits')
+                run_hooks(self.hooks, trace)
+                results[i] = list(cached)
                 continue
-
-            dot_product = 0.0
-            for lemma, q_weight in query_vector.items():
-                if lemma in self.doc_vectors[doc_id]:
-                    doc_weight = self.doc_vectors[doc_id][lemma]
-                    dot_product += q_weight * doc_weight
-
-            doc_norm = self.doc_norms[doc_id]
-            if doc_norm == 0 or query_norm == 0:
-                cosine_sim = 0.0
-            else:
-                cosine_sim = min(dot_product / (query_norm * doc_norm), 1.0)
-
-            if cosine_sim > 1e-6:
-                results.append((doc_id, cosine_sim))
-
-        return sorted(results, key=lambda x: x[1], reverse=True)[:top_n]
-
+            with trace.stage('lemmas'):
+                query_lemmas = self._query_lemmas(query)
+            if not query_lemmas:
+                run_hooks(self.hooks, trace)
+                results[i] = []
+                continue
+            trace.plan = {'ranking': self.ranking, 'mode': mode, 'top_n': top_n, 'prune': False,
+                          'terms': self._query_vector(query_lemmas)}
+            misses.append((i, key, trace, query_lemmas))
+
+        if misses:
+            with ExitStack() as stages:
+                for _, _, trace, _ in misses:
+                    stages.enter_context(trace.stage(stage))
+                batch = score_batch([query_lemmas for _, _, _, query_lemmas in misses])
+            for (i, key, trace, _), query_results in zip(misses, batch):
+                trace.count('batch_size', len(misses))
+                self.result_cache.put(key, tuple(query_results))
+                run_hooks(self.hooks, trace)
+                results[i] = query_results
+        return results
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Счётчики кэшей результатов и лемм"""
+        return {'results': self.result_cache.stats(), 'lemmas': self.lemma_cache.stats()}
 
     def interactive_search(self):
         """Интерактивный режим поиска"""
         print("=== Интеллектуальная поисковая система ===")
-        print(f"Загружено документов: {len(self.doc_vectors)}")
+        print(f"Загружено документов: {len(self.doc_norms)}")
         print(f"Общих лемм: {len(self.common_lemmas)}")
         print("Введите 'exit' для выхода\n")
 